@@ -0,0 +1,166 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import psycopg2
+
+from tietokanta import PAIVITYS_LUKKO, kasvata_datasukupolvi
+
+# Asetukset
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# Kuinka usein päivityksen tarve ja käsin tehdyt pyynnöt tarkistetaan (s)
+AJASTIN_VALI = float(os.environ.get('AJASTIN_VALI', 60))
+
+# Data päivitetään, kun viimeisimmästä päivityksestä on kulunut tämä aika (h)
+PAIVITYSVALI_H = float(os.environ.get('PAIVITYSVALI_H', 24))
+
+# Epäonnistunutta automaattista päivitystä yritetään uudelleen aikaisintaan tämän ajan päästä (h)
+UUSINTAVALI_H = float(os.environ.get('UUSINTAVALI_H', 1))
+
+# Yhden päivitysajon aikaraja (s)
+PAIVITYS_AIKARAJA = 3600
+
+def log_message(message, level="INFO"):
+    """Yksinkertainen lokitusfunktio"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] [{level}] {message}", flush=True)
+
+def get_db_connection():
+    return psycopg2.connect(DATABASE_URL)
+
+def kirjaa_syke(conn):
+    """Kirjaa ajastimen elonmerkin; epäonnistuminen ei estä päivitystä"""
+    try:
+        c = conn.cursor()
+        c.execute("UPDATE Paivitystila SET syke = NOW()")
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        log_message(f"Elonmerkin kirjaus epäonnistui: {str(e)}", "WARNING")
+
+def paivityksen_syy(c):
+    """Palauttaa syyn päivittää ('pyydetty' tai 'vanhentunut') tai None"""
+    c.execute("""
+        SELECT pyydetty IS NOT NULL AND (aloitettu IS NULL OR pyydetty > aloitettu),
+               COALESCE((SELECT MAX(last_updated) FROM Kilpailut)
+                        < NOW() - make_interval(secs => %s), TRUE)
+               AND (aloitettu IS NULL OR aloitettu < NOW() - make_interval(secs => %s))
+        FROM Paivitystila
+    """, (PAIVITYSVALI_H * 3600, UUSINTAVALI_H * 3600))
+    pyydetty, vanhentunut = c.fetchone()
+    if pyydetty:
+        return 'pyydetty'
+    if vanhentunut:
+        return 'vanhentunut'
+    return None
+
+def aja_paivitys(conn):
+    """Ajaa automaatti_haku.py:n; palauttaa (onnistui, viesti)
+
+    Elonmerkki kirjataan myös ajon aikana, jottei pitkä päivitys näytä pysähtyneeltä ajastimelta.
+    """
+    prosessi = subprocess.Popen([sys.executable, 'automaatti_haku.py'],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    alku = time.monotonic()
+    while True:
+        try:
+            # communicate voidaan kutsua uudelleen aikakatkaisun jälkeen menettämättä tulostetta
+            _, stderr = prosessi.communicate(timeout=AJASTIN_VALI)
+            break
+        except subprocess.TimeoutExpired:
+            if time.monotonic() - alku > PAIVITYS_AIKARAJA:
+                prosessi.kill()
+                prosessi.communicate()
+                return False, "Päivitys aikakatkaistiin (yli 1 tunti)"
+            kirjaa_syke(conn)
+
+    if prosessi.returncode != 0:
+        return False, f"Päivitys epäonnistui: {stderr[-2000:]}"
+
+    # Viimeisin päivitysaika ja datasukupolvi samassa transaktiossa
+    c = conn.cursor()
+    c.execute("UPDATE Kilpailut SET last_updated = NOW() WHERE last_updated = (SELECT MAX(last_updated) FROM Kilpailut)")
+    kasvata_datasukupolvi(c)
+    conn.commit()
+    return True, "Tietokanta päivitetty onnistuneesti!"
+
+def tarkista_ja_paivita(conn, pakota=False):
+    """Päivittää datan, jos se on tarpeen ja mikään muu prosessi ei ole jo päivittämässä
+
+    Lukko on istuntokohtainen advisory-lukko, joten se vapautuu myös, jos
+    ajastin kaatuu tai yhteys katkeaa kesken ajon.
+    """
+    c = conn.cursor()
+    syy = 'pakotettu' if pakota else paivityksen_syy(c)
+    conn.commit()
+    if syy is None:
+        return False
+
+    c.execute("SELECT pg_try_advisory_lock(%s)", (PAIVITYS_LUKKO,))
+    saatiin = c.fetchone()[0]
+    conn.commit()
+    if not saatiin:
+        log_message("Toinen prosessi päivittää jo, ohitetaan")
+        return False
+
+    try:
+        # Toinen ajastin on voinut päivittää juuri ennen lukon saamista
+        if not pakota:
+            syy = paivityksen_syy(c)
+            conn.commit()
+            if syy is None:
+                return False
+
+        ajaja = f"{socket.gethostname()}:{os.getpid()}"
+        log_message(f"Päivitys alkoi ({syy})")
+        c.execute("""
+            UPDATE Paivitystila
+            SET tila = 'kaynnissa', viesti = NULL, ajaja = %s, aloitettu = NOW()
+        """, (ajaja,))
+        conn.commit()
+
+        try:
+            onnistui, viesti = aja_paivitys(conn)
+        except Exception as e:
+            conn.rollback()
+            onnistui, viesti = False, f"Päivitysprosessi epäonnistui: {str(e)}"
+
+        c.execute("UPDATE Paivitystila SET tila = %s, viesti = %s, valmistunut = NOW()",
+                  ('valmis' if onnistui else 'virhe', viesti))
+        conn.commit()
+        log_message(viesti, "INFO" if onnistui else "ERROR")
+        return onnistui
+    finally:
+        c.execute("SELECT pg_advisory_unlock(%s)", (PAIVITYS_LUKKO,))
+        conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description='Päivittää tietokannan ajastetusti web-pyyntöjen ulkopuolella')
+    parser.add_argument('--kerran', action='store_true', help='Tarkista kerran ja lopeta')
+    parser.add_argument('--pakota', action='store_true', help='Päivitä heti tarpeesta riippumatta')
+    args = parser.parse_args()
+
+    log_message(f"Ajastin käynnistyi (tarkistusväli {AJASTIN_VALI:g} s)")
+    while True:
+        try:
+            conn = get_db_connection()
+            try:
+                kirjaa_syke(conn)
+                tarkista_ja_paivita(conn, args.pakota)
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            log_message(f"Tietokantavirhe: {str(e)}", "ERROR")
+
+        if args.kerran:
+            break
+        args.pakota = False
+        time.sleep(AJASTIN_VALI)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import base64
+import binascii
+import json
+import os
+import threading
+import uuid
+
+from flask import Blueprint, Response, current_app, g, jsonify, request, stream_with_context
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from normalisointi import normalisoi_nimi
+from kyselyt import kilpailut_sql, hae_laji, lajin_parhaat_sql, hae_urheilija_idt, urheilijan_tulokset_sql
+from tietokanta import PooliTaynna
+from vienti import VIENTIMUODOT, json_arvo, vientikursori, vientiosat
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Sivukoko: oletus ja suurin sallittu ?raja=
+API_RAJA = int(os.environ.get('API_RAJA', 100))
+API_RAJA_MAX = int(os.environ.get('API_RAJA_MAX', 10000))
+
+# Kuinka monta riviä palvelinpuolen kursorista luetaan kerralla
+API_ITERSIZE = int(os.environ.get('API_ITERSIZE', 500))
+
+# Yhtä aikaa käynnissä olevien massavientien enimmäismäärä; vienti käyttää omaa
+# poolin ulkopuolista yhteyttään, jottei hidas lataus vie sivujen yhteyksiä
+VIENTI_RINNAKKAIN = int(os.environ.get('VIENTI_RINNAKKAIN', 2))
+_vientipaikat = threading.BoundedSemaphore(VIENTI_RINNAKKAIN)
+
+# Kursorissa tuntematon päivämäärä vastaa järjestyksessä käytettyä oletusta (kyselyt.KILPAILUN_PVM)
+TUNTEMATON_PVM = '0001-01-01'
+
+# Vastauksen kentät reiteittäin (?kentat= voi valita näistä osan)
+KILPAILU_KENTAT = ['kilpailu_id', 'kilpailun_nimi', 'alkupvm', 'lajeja', 'tuloksia', 'urheilijoita']
+TULOS_KENTAT = ['tulos_id', 'laji_id', 'lajin_nimi', 'sarja', 'sijoitus', 'urheilija_id', 'etunimi',
+                'sukunimi', 'seura', 'tulos', 'tulos_arvo', 'tulos_tila', 'syntymavuosi', 'sukupuoli']
+URHEILIJAN_TULOS_KENTAT = ['tulos_id', 'urheilija_id', 'etunimi', 'sukunimi', 'kilpailu_id', 'kilpailun_nimi',
+                           'alkupvm', 'lajin_nimi', 'sarja', 'sijoitus', 'tulos', 'syntymavuosi', 'sukupuoli']
+PARHAAT_KENTAT = ['urheilija_id', 'etunimi', 'sukunimi', 'seura', 'tulos', 'vertailuarvo', 'kilpailu_id',
+                  'kilpailun_nimi', 'alkupvm', 'sijoitus', 'syntymavuosi', 'sukupuoli']
+
+
+class ApiVirhe(Exception):
+    """Virheellinen API-pyyntö, palautetaan JSON-virheenä"""
+
+    def __init__(self, viesti, status=400):
+        super().__init__(viesti)
+        self.viesti = viesti
+        self.status = status
+
+
+@api.errorhandler(ApiVirhe)
+def api_virhe(e):
+    return jsonify({'virhe': e.viesti}), e.status
+
+
+@api.errorhandler(psycopg2.Error)
+@api.errorhandler(PooliTaynna)
+def api_tietokantavirhe(e):
+    current_app.logger.error(f"API-virhe: {str(e)}")
+    return jsonify({'virhe': 'Tietokantavirhe'}), 500
+
+
+def hae_yhteys():
+    """Pyynnön tietokantayhteys samoin kuin sivuilla, lukukopiolta jos se on käytössä (palautetaan teardownissa)"""
+    if 'db_conn' not in g:
+        g.db_pooli, g.db_conn, g.lukukopion_sukupolvi = current_app.extensions['lukureititin'].ota()
+    return g.db_conn
+
+
+def avaa_vientiyhteys():
+    """Avaa viennille oman yhteyden samaan kantaan kuin pyynnön pooli (kopio tai pääkanta)"""
+    reititin = current_app.extensions['lukureititin']
+    kohde, _ = reititin.valitse()
+    try:
+        return psycopg2.connect(kohde.dsn, **kohde.connect_kwargs)
+    except psycopg2.OperationalError:
+        if kohde is reititin.ensisijainen:
+            raise
+        ensisijainen = reititin.ensisijainen
+        return psycopg2.connect(ensisijainen.dsn, **ensisijainen.connect_kwargs)
+
+
+def koodaa_kursori(arvot):
+    """Sivutuskursori on base64-koodattu JSON-lista viimeisen rivin järjestysavaimesta"""
+    teksti = json.dumps(arvot, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(teksti.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def pura_kursori(pituus, pvm_alussa=False):
+    """Lukee ?kursori=-parametrin, palauttaa listan tai None"""
+    kursori = request.args.get('kursori', '').strip()
+    if not kursori:
+        return None
+    try:
+        teksti = base64.urlsafe_b64decode(kursori + '=' * (-len(kursori) % 4)).decode('utf-8')
+        arvot = json.loads(teksti)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ApiVirhe('Virheellinen kursori')
+    if not isinstance(arvot, list) or len(arvot) != pituus:
+        raise ApiVirhe('Virheellinen kursori')
+    if pvm_alussa and arvot[0] is None:
+        arvot[0] = TUNTEMATON_PVM
+    return arvot
+
+
+def lue_raja():
+    raja = request.args.get('raja', API_RAJA, type=int)
+    return max(1, min(raja, API_RAJA_MAX))
+
+
+def lue_kentat(sallitut):
+    """Lukee ?kentat=a,b -valinnan, oletuksena kaikki kentät"""
+    kentat = request.args.get('kentat', '').strip()
+    if not kentat:
+        return sallitut
+    valitut = [k.strip() for k in kentat.split(',') if k.strip()]
+    tuntemattomat = [k for k in valitut if k not in sallitut]
+    if tuntemattomat:
+        raise ApiVirhe(f"Tuntemattomat kentät: {', '.join(tuntemattomat)}")
+    return valitut
+
+
+def virtaa(sql, params, raja, kentat, avain, alku=''):
+    """Suorittaa kyselyn palvelinpuolen kursorilla ja virtaa rivit JSON-vastauksena
+
+    Kyselyn pitää hakea raja + 1 riviä; ylimääräisen rivin perusteella vastaukseen
+    lisätään seuraavan sivun kursori. avain on sivutusavaimen kentät.
+    """
+    c = hae_yhteys().cursor(name=f"api_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+    c.itersize = API_ITERSIZE
+    # Kysely suoritetaan ennen vastauksen aloittamista, jotta virhe palautuu statuksena
+    c.execute(sql, params)
+
+    def tuota():
+        yield '{' + alku + '"data":['
+        maara = 0
+        viimeinen = None
+        lisaa = False
+        puskuri = []
+        try:
+            for rivi in c:
+                if maara == raja:
+                    lisaa = True
+                    break
+                puskuri.append(json.dumps({k: rivi[k] for k in kentat}, default=json_arvo, ensure_ascii=False))
+                viimeinen = rivi
+                maara += 1
+                if len(puskuri) >= API_ITERSIZE:
+                    yield (',' if maara > len(puskuri) else '') + ','.join(puskuri)
+                    puskuri = []
+            if puskuri:
+                yield (',' if maara > len(puskuri) else '') + ','.join(puskuri)
+        finally:
+            c.close()
+
+        seuraava = koodaa_kursori([viimeinen[k] for k in avain]) if lisaa else None
+        yield '],"seuraava":' + json.dumps(seuraava) + '}'
+
+    return Response(stream_with_context(tuota()), mimetype='application/json')
+
+
+@api.route('/kilpailut')
+def kilpailut():
+    """Kilpailut uusimmasta vanhimpaan"""
+    raja = lue_raja()
+    kentat = lue_kentat(KILPAILU_KENTAT)
+    ennen = pura_kursori(2, pvm_alussa=True)
+    sql, params = kilpailut_sql(raja + 1, ennen)
+    return virtaa(sql, params, raja, kentat, ['alkupvm', 'kilpailu_id'])
+
+
+@api.route('/kilpailut/<int:kilpailu_id>')
+def kilpailu(kilpailu_id):
+    """Kilpailun perustiedot ja lajit"""
+    c = hae_yhteys().cursor(cursor_factory=RealDictCursor)
+    c.execute("""
+        SELECT kilpailu_id, kilpailun_nimi, paikkakunta, alkupvm, loppupvm
+        FROM Kilpailut WHERE kilpailu_id = %s
+    """, (kilpailu_id,))
+    kilpailu = c.fetchone()
+    if not kilpailu:
+        raise ApiVirhe('Kilpailua ei löytynyt', 404)
+
+    c.execute("""
+        SELECT laji_id, lajin_nimi, sarja, luettelo_id
+        FROM Lajit
+        WHERE kilpailu_id = %s
+        ORDER BY lajin_nimi, laji_id
+    """, (kilpailu_id,))
+    kilpailu['lajit'] = c.fetchall()
+    return current_app.response_class(json.dumps(kilpailu, default=json_arvo, ensure_ascii=False),
+                                      mimetype='application/json')
+
+
+@api.route('/kilpailut/<int:kilpailu_id>/tulokset')
+def kilpailun_tulokset(kilpailu_id):
+    """Kilpailun tulokset lajeittain, ?laji_id= rajaa yhteen lajiin"""
+    raja = lue_raja()
+    kentat = lue_kentat(TULOS_KENTAT)
+    jalkeen = pura_kursori(2)
+    laji_id = request.args.get('laji_id', type=int)
+
+    sql = """
+        SELECT t.tulos_id, l.laji_id, l.lajin_nimi, l.sarja, t.sijoitus,
+               u.urheilija_id, u.etunimi, u.sukunimi,
+               COALESCE(s.seura_nimi, '-') as seura,
+               COALESCE(CAST(t.tulos AS TEXT), t.lisatiedot) as tulos,
+               t.tulos_arvo, t.tulos_tila, u.syntymavuosi, u.sukupuoli
+        FROM Tulokset t
+        JOIN Lajit l ON t.laji_id = l.laji_id AND t.kilpailu_id = l.kilpailu_id
+        JOIN Urheilijat u ON t.urheilija_id = u.urheilija_id
+        LEFT JOIN Seurat s ON u.seura_id = s.seura_id
+        WHERE t.kilpailu_id = %s
+    """
+    params = [kilpailu_id]
+
+    if laji_id is not None:
+        sql += " AND t.laji_id = %s"
+        params.append(laji_id)
+
+    if jalkeen:
+        sql += " AND (t.laji_id, t.tulos_id) > (%s, %s)"
+        params.extend(jalkeen)
+
+    sql += " ORDER BY t.laji_id, t.tulos_id LIMIT %s"
+    params.append(raja + 1)
+    return virtaa(sql, params, raja, kentat, ['laji_id', 'tulos_id'], f'"kilpailu_id":{kilpailu_id},')
+
+
+@api.route('/urheilijat')
+def urheilijan_tulokset():
+    """Nimihaun urheilijoiden tulokset uusimmasta vanhimpaan"""
+    nimi = request.args.get('nimi', '').strip()
+    sukupuoli = request.args.get('sukupuoli', '').upper()
+    ika_min = request.args.get('ika_min', type=int)
+    ika_max = request.args.get('ika_max', type=int)
+    raja = lue_raja()
+    kentat = lue_kentat(URHEILIJAN_TULOS_KENTAT)
+    ennen = pura_kursori(2, pvm_alussa=True)
+
+    if not normalisoi_nimi(nimi):
+        raise ApiVirhe('Anna urheilijan nimi')
+
+    c = hae_yhteys().cursor()
+    urheilija_idt = hae_urheilija_idt(c, nimi, sukupuoli if sukupuoli in ['M', 'N'] else None)
+
+    sql, params = urheilijan_tulokset_sql(urheilija_idt, ika_min, ika_max)
+    if ennen:
+        sql += " AND (COALESCE(k.alkupvm, DATE '0001-01-01'), t.tulos_id) < (%s, %s)"
+        params.extend(ennen)
+    sql += " ORDER BY COALESCE(k.alkupvm, DATE '0001-01-01') DESC, t.tulos_id DESC LIMIT %s"
+    params.append(raja + 1)
+    return virtaa(sql, params, raja, kentat, ['alkupvm', 'tulos_id'])
+
+
+@api.route('/lajit')
+def lajit():
+    """Lajiluettelo"""
+    c = hae_yhteys().cursor(cursor_factory=RealDictCursor)
+    c.execute("""
+        SELECT luettelo_id AS laji_id, nimi, mittaustyyppi, parempi, yksikko
+        FROM Lajiluettelo
+        ORDER BY nimi
+    """)
+    return jsonify({'data': c.fetchall()})
+
+
+@api.route('/lajit/<int:laji_id>/parhaat')
+def lajin_parhaat(laji_id):
+    """Lajin parhaat tulokset urheilijoittain"""
+    sukupuoli = request.args.get('sukupuoli', '').upper()
+    ika_min = request.args.get('ika_min', type=int)
+    ika_max = request.args.get('ika_max', type=int)
+    vuosi = request.args.get('vuosi', type=int)
+    raja = lue_raja()
+    kentat = lue_kentat(PARHAAT_KENTAT)
+    jalkeen = pura_kursori(2)
+
+    c = hae_yhteys().cursor()
+    laji = hae_laji(c, laji_id)
+    if not laji:
+        raise ApiVirhe('Lajia ei löytynyt', 404)
+
+    sql, params = lajin_parhaat_sql(laji_id, sukupuoli, vuosi, ika_min, ika_max,
+                                    maara=raja + 1, jalkeen=jalkeen)
+    alku = f'"laji_id":{laji[0]},"laji":{json.dumps(laji[1], ensure_ascii=False)},'
+    return virtaa(sql, params, raja, kentat, ['vertailuarvo', 'urheilija_id'], alku)
+
+
+@api.route('/vienti')
+def vienti():
+    """Tulosten massavienti CSV- tai NDJSON-muodossa (vuosi, seura, laji_id)"""
+    muoto = request.args.get('muoto', 'csv')
+    vuosi = request.args.get('vuosi', type=int)
+    seura = request.args.get('seura', '').strip()
+    laji_id = request.args.get('laji_id', type=int)
+
+    if muoto not in VIENTIMUODOT:
+        raise ApiVirhe(f"Tuntematon muoto: {muoto}")
+
+    if not _vientipaikat.acquire(blocking=False):
+        raise ApiVirhe("Liian monta vientiä käynnissä, yritä hetken kuluttua uudelleen", 503)
+
+    conn = None
+    try:
+        conn = avaa_vientiyhteys()
+        c = vientikursori(conn, vuosi, seura, laji_id)
+    except Exception:
+        if conn is not None:
+            conn.close()
+        _vientipaikat.release()
+        raise
+
+    vapautettu = []
+
+    def vapauta():
+        # Vastaus suljetaan aina, myös kun asiakas katkaisee latauksen tai sitä ei lueta lainkaan
+        if not vapautettu:
+            vapautettu.append(True)
+            conn.close()
+            _vientipaikat.release()
+
+    tiedostonimi = f"tulokset{'_' + str(vuosi) if vuosi else ''}.{muoto}"
+    vastaus = Response(stream_with_context(vientiosat(c, muoto)),
+                       mimetype=VIENTIMUODOT[muoto],
+                       headers={'Content-Disposition': f'attachment; filename="{tiedostonimi}"'})
+    vastaus.call_on_close(vapauta)
+    return vastaus
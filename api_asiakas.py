@@ -0,0 +1,170 @@
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from api_valimuisti import luo_valimuisti
+
+# Tuloslistan julkisen rajapinnan asetukset
+API_OSOITE = os.environ.get('TULOSLISTA_API', 'https://cached-public-api.tuloslista.com/live/v1')
+API_POOLI = int(os.environ.get('API_POOLI', 10))  # avoimia yhteyksiä isäntää kohden
+API_AIKARAJA = float(os.environ.get('API_AIKARAJA', 10))  # vastauksen odotus (s), kutsukohtainen timeout ohittaa
+API_YHDISTYS_AIKARAJA = float(os.environ.get('API_YHDISTYS_AIKARAJA', 5))  # yhteyden avaus (s)
+API_YRITYKSET = int(os.environ.get('API_YRITYKSET', 3))  # uusintayritykset 429/5xx- ja yhteysvirheissä
+API_VIIVE = float(os.environ.get('API_VIIVE', 0.5))  # uusinnan perusviive (s), kasvaa eksponentiaalisesti
+
+UUSITTAVAT_STATUKSET = (429, 500, 502, 503, 504)
+
+# Polun numeeriset osat korvataan, jotta tilastot kootaan rajapinnan päätepisteittäin
+_ID_OSA = re.compile(r'/\d+(?=/|$)')
+
+
+class HajontaRetry(Retry):
+    """Eksponentiaalinen viive satunnaisella hajonnalla, jotta rinnakkaiset uusinnat eivät osu yhtä aikaa"""
+
+    def get_backoff_time(self):
+        viive = super().get_backoff_time()
+        return viive / 2 + random.uniform(0, viive / 2) if viive > 0 else 0
+
+
+class ApiAsiakas:
+    """Jaettu HTTP-istunto rajapinnalle: yhteyksien uudelleenkäyttö, uusinnat ja tilastot"""
+
+    def __init__(self, osoite=API_OSOITE, pooli=API_POOLI, aikaraja=API_AIKARAJA,
+                 yhdistys_aikaraja=API_YHDISTYS_AIKARAJA, yritykset=API_YRITYKSET, viive=API_VIIVE):
+        self.osoite = osoite.rstrip('/')
+        self.aikaraja = aikaraja
+        self.yhdistys_aikaraja = yhdistys_aikaraja
+
+        uusinnat = HajontaRetry(
+            total=yritykset,
+            backoff_factor=viive,
+            status_forcelist=UUSITTAVAT_STATUKSET,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            # Viimeinen virhevastaus palautetaan kutsujalle, joka tarkistaa sen raise_for_statusilla
+            raise_on_status=False
+        )
+        sovitin = HTTPAdapter(pool_connections=pooli, pool_maxsize=pooli, max_retries=uusinnat)
+        self.istunto = requests.Session()
+        self.istunto.mount('https://', sovitin)
+        self.istunto.mount('http://', sovitin)
+
+        self._lukko = threading.Lock()
+        self._tilastot = {}
+        self._valimuisti = None
+        self._valimuisti_luotu = False
+
+    def _kirjaa(self, paatepiste, kesto, virhe, uusintoja):
+        with self._lukko:
+            t = self._tilastot.get(paatepiste)
+            if t is None:
+                t = self._tilastot[paatepiste] = {'kutsuja': 0, 'virheita': 0, 'uusintoja': 0,
+                                                  'aika_yhteensa_s': 0.0, 'aika_max_s': 0.0}
+            t['kutsuja'] += 1
+            t['virheita'] += 1 if virhe else 0
+            t['uusintoja'] += uusintoja
+            t['aika_yhteensa_s'] += kesto
+            t['aika_max_s'] = max(t['aika_max_s'], kesto)
+
+    def get(self, polku, timeout=None, **kwargs):
+        """GET rajapinnan polkuun (esim. /competition/123); palauttaa requests.Response-olion"""
+        paatepiste = _ID_OSA.sub('/{id}', polku)
+        alku = time.monotonic()
+        try:
+            vastaus = self.istunto.get(self.osoite + polku,
+                                       timeout=(self.yhdistys_aikaraja, timeout or self.aikaraja),
+                                       **kwargs)
+        except requests.RequestException:
+            self._kirjaa(paatepiste, time.monotonic() - alku, True, 0)
+            raise
+
+        historia = getattr(getattr(vastaus.raw, 'retries', None), 'history', None) or ()
+        self._kirjaa(paatepiste, time.monotonic() - alku, vastaus.status_code >= 400, len(historia))
+        return vastaus
+
+    def valimuisti(self):
+        """Palauttaa levyvälimuistin (luodaan ensimmäisellä käytöllä) tai None"""
+        with self._lukko:
+            if not self._valimuisti_luotu:
+                self._valimuisti = luo_valimuisti()
+                self._valimuisti_luotu = True
+            return self._valimuisti
+
+    def hae_sisalto(self, polku, timeout=None, muuttumaton=False, puhdista=None):
+        """Hakee polun sisällön tekstinä levyvälimuistin kautta
+
+        Muuttumattomaksi merkitty sisältö (viralliset tulokset) palautetaan
+        välimuistista kysymättä palvelimelta. Muut tarkistetaan ehdollisella
+        pyynnöllä (If-None-Match / If-Modified-Since), jos palvelin antoi tunnisteet.
+        puhdista käsittelee vastauksen tekstin ennen tallennusta.
+        """
+        valimuisti = self.valimuisti()
+        osoite = self.osoite + polku
+        merkinta = None
+        if valimuisti is not None:
+            try:
+                merkinta = valimuisti.hae(osoite)
+                if merkinta is not None and merkinta['muuttumaton']:
+                    valimuisti.osuma(osoite)
+                    return merkinta['sisalto']
+            except (OSError, sqlite3.Error) as e:
+                print(f"Välimuistin luku epäonnistui ({polku}): {str(e)}")
+                merkinta = None
+
+        otsakkeet = {}
+        if merkinta is not None:
+            if merkinta['etag']:
+                otsakkeet['If-None-Match'] = merkinta['etag']
+            if merkinta['muokattu']:
+                otsakkeet['If-Modified-Since'] = merkinta['muokattu']
+
+        vastaus = self.get(polku, timeout=timeout, headers=otsakkeet)
+        if vastaus.status_code == 304 and merkinta is not None:
+            try:
+                valimuisti.osuma(osoite, vahvistettu=True, muuttumaton=muuttumaton)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Välimuistin päivitys epäonnistui ({polku}): {str(e)}")
+            return merkinta['sisalto']
+        vastaus.raise_for_status()
+
+        sisalto = puhdista(vastaus.text) if puhdista else vastaus.text
+        if valimuisti is not None:
+            try:
+                valimuisti.tallenna(osoite, sisalto, vastaus.headers.get('ETag'),
+                                    vastaus.headers.get('Last-Modified'), muuttumaton)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Välimuistiin tallennus epäonnistui ({polku}): {str(e)}")
+        return sisalto
+
+    def tilastot(self):
+        """Palauttaa päätepisteittäiset kutsu-, virhe- ja viivetilastot"""
+        with self._lukko:
+            tilastot = {paatepiste: dict(t) for paatepiste, t in self._tilastot.items()}
+        for t in tilastot.values():
+            t['aika_keskiarvo_s'] = t['aika_yhteensa_s'] / t['kutsuja'] if t['kutsuja'] else 0.0
+        return tilastot
+
+    def tulosta_tilastot(self, tulosta=print):
+        """Tulostaa tilastot ajon lopuksi annetulla funktiolla (esim. log_message)"""
+        for paatepiste, t in sorted(self.tilastot().items()):
+            tulosta(f"API {paatepiste}: {t['kutsuja']} kutsua, {t['virheita']} virhettä, "
+                    f"{t['uusintoja']} uusintaa, keskim. {t['aika_keskiarvo_s']:.3f} s, "
+                    f"max {t['aika_max_s']:.3f} s")
+        if self._valimuisti is not None:
+            try:
+                v = self._valimuisti.tilastot()
+            except sqlite3.Error:
+                return
+            tulosta(f"API-välimuisti: {v['osumia']} osumaa, {v['vahvistettuja']} vahvistettua (304), "
+                    f"{v['ohituksia']} haettua, {v['poistettuja']} poistettua, "
+                    f"{v['merkintoja']} merkintää, {v['koko_mt']}/{v['max_koko_mt']} Mt")
+
+
+# Prosessin yhteinen asiakas; istunto on säieturvallinen GET-kutsuille
+asiakas = ApiAsiakas()
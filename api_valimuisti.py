@@ -0,0 +1,174 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Rajapinnan vastausten levyvälimuisti
+API_VALIMUISTI = os.environ.get('API_VALIMUISTI', 'data/api_valimuisti')  # tyhjä = ei välimuistia
+API_VALIMUISTI_MT = float(os.environ.get('API_VALIMUISTI_MT', 200))  # sisältötiedostojen yhteiskoko ennen poistoja
+
+# Hakemiston lukon odotus, kun useampi hakuprosessi kirjoittaa yhtä aikaa (s)
+HAKEMISTO_AIKARAJA = 30
+
+
+class LevyValimuisti:
+    """Osoitteittain haettava välimuisti, jonka sisällöt tallennetaan tiivisteensä nimisiin tiedostoihin
+
+    Hakemisto (SQLite) kertoo osoitteen sisällön tiivisteen, ETag- ja Last-Modified-
+    tunnisteet sekä viimeisimmän käyttöajan. Sama sisältö tallentuu vain kerran,
+    vaikka useampi osoite palauttaisi sen. Kokorajan ylittyessä poistetaan
+    pisimpään käyttämättä olleet osoitteet.
+    """
+
+    def __init__(self, hakemisto, max_koko):
+        self.hakemisto = hakemisto
+        self.max_koko = max_koko
+        self._sisallot = os.path.join(hakemisto, 'sisalto')
+        self._tietokanta = os.path.join(hakemisto, 'hakemisto.sqlite')
+        os.makedirs(self._sisallot, exist_ok=True)
+
+        self._lukko = threading.Lock()
+        self._osumia = 0
+        self._vahvistettuja = 0
+        self._ohituksia = 0
+        self._poistettuja = 0
+
+        with self._yhteys() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS vastaukset (
+                    osoite TEXT PRIMARY KEY,
+                    tiiviste TEXT NOT NULL,
+                    koko INTEGER NOT NULL,
+                    etag TEXT,
+                    muokattu TEXT,
+                    muuttumaton INTEGER NOT NULL DEFAULT 0,
+                    kaytetty REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_vastaukset_tiiviste ON vastaukset (tiiviste)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_vastaukset_kaytetty ON vastaukset (kaytetty)")
+
+    @contextmanager
+    def _yhteys(self):
+        """Oma yhteys jokaiselle käsittelylle, koska sqlite-yhteyttä ei jaeta säikeiden kesken"""
+        conn = sqlite3.connect(self._tietokanta, timeout=HAKEMISTO_AIKARAJA)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _polku(self, tiiviste):
+        return os.path.join(self._sisallot, f"{tiiviste}.json")
+
+    def _laske(self, kentta):
+        with self._lukko:
+            setattr(self, kentta, getattr(self, kentta) + 1)
+
+    def hae(self, osoite):
+        """Palauttaa osoitteen merkinnän sanakirjana sisältöineen tai None"""
+        with self._yhteys() as conn:
+            rivi = conn.execute("""
+                SELECT tiiviste, etag, muokattu, muuttumaton FROM vastaukset WHERE osoite = ?
+            """, (osoite,)).fetchone()
+        if rivi is None:
+            return None
+
+        tiiviste, etag, muokattu, muuttumaton = rivi
+        try:
+            with open(self._polku(tiiviste), 'rb') as f:
+                data = f.read()
+        except OSError:
+            # Toinen prosessi on ehtinyt poistaa sisällön
+            return None
+        if hashlib.sha256(data).hexdigest() != tiiviste:
+            return None
+
+        return {'sisalto': data.decode('utf-8'), 'tiiviste': tiiviste, 'etag': etag,
+                'muokattu': muokattu, 'muuttumaton': bool(muuttumaton)}
+
+    def osuma(self, osoite, vahvistettu=False, muuttumaton=False):
+        """Kirjaa käytön; vahvistettu = palvelin vastasi 304 Not Modified"""
+        self._laske('_vahvistettuja' if vahvistettu else '_osumia')
+        with self._yhteys() as conn:
+            conn.execute("""
+                UPDATE vastaukset SET kaytetty = ?, muuttumaton = MAX(muuttumaton, ?) WHERE osoite = ?
+            """, (time.time(), int(muuttumaton), osoite))
+
+    def tallenna(self, osoite, sisalto, etag=None, muokattu=None, muuttumaton=False):
+        """Tallentaa osoitteen uuden sisällön ja poistaa tarvittaessa vanhimmat merkinnät"""
+        self._laske('_ohituksia')
+        data = sisalto.encode('utf-8')
+        tiiviste = hashlib.sha256(data).hexdigest()
+        polku = self._polku(tiiviste)
+        if not os.path.exists(polku):
+            valiaikainen = f"{polku}.{os.getpid()}.{threading.get_ident()}"
+            with open(valiaikainen, 'wb') as f:
+                f.write(data)
+            os.replace(valiaikainen, polku)
+
+        with self._yhteys() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO vastaukset (osoite, tiiviste, koko, etag, muokattu, muuttumaton, kaytetty)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (osoite, tiiviste, len(data), etag, muokattu, int(muuttumaton), time.time()))
+            poistettavat = self._karsi(conn)
+
+        # Tiedostot poistetaan vasta, kun hakemiston muutos on tallennettu
+        for poistettava in poistettavat:
+            try:
+                os.remove(self._polku(poistettava))
+            except OSError:
+                pass
+
+    def _karsi(self, conn):
+        """Poistaa pisimpään käyttämättä olleita osoitteita, kunnes sisällöt mahtuvat kokorajaan
+
+        Palauttaa tiivisteet, joihin mikään osoite ei enää viittaa.
+        """
+        koko = conn.execute("SELECT COALESCE(SUM(koko), 0) FROM (SELECT DISTINCT tiiviste, koko FROM vastaukset)").fetchone()[0]
+        if koko <= self.max_koko:
+            return []
+
+        poistettavat = []
+        for osoite, tiiviste, tiedoston_koko in conn.execute(
+                "SELECT osoite, tiiviste, koko FROM vastaukset ORDER BY kaytetty").fetchall():
+            if koko <= self.max_koko:
+                break
+            conn.execute("DELETE FROM vastaukset WHERE osoite = ?", (osoite,))
+            self._laske('_poistettuja')
+            if conn.execute("SELECT 1 FROM vastaukset WHERE tiiviste = ?", (tiiviste,)).fetchone() is None:
+                poistettavat.append(tiiviste)
+                koko -= tiedoston_koko
+        return poistettavat
+
+    def tilastot(self):
+        """Palauttaa prosessin osumat ja ohitukset sekä välimuistin koon"""
+        with self._yhteys() as conn:
+            merkintoja, koko = conn.execute("""
+                SELECT (SELECT COUNT(*) FROM vastaukset),
+                       (SELECT COALESCE(SUM(koko), 0) FROM (SELECT DISTINCT tiiviste, koko FROM vastaukset))
+            """).fetchone()
+        with self._lukko:
+            return {
+                'osumia': self._osumia,
+                'vahvistettuja': self._vahvistettuja,
+                'ohituksia': self._ohituksia,
+                'poistettuja': self._poistettuja,
+                'merkintoja': merkintoja,
+                'koko_mt': round(koko / (1024 * 1024), 1),
+                'max_koko_mt': round(self.max_koko / (1024 * 1024), 1)
+            }
+
+
+def luo_valimuisti():
+    """Luo asetusten mukaisen välimuistin tai palauttaa None, jos se ei ole käytössä"""
+    if not API_VALIMUISTI:
+        return None
+    try:
+        return LevyValimuisti(API_VALIMUISTI, int(API_VALIMUISTI_MT * 1024 * 1024))
+    except (OSError, sqlite3.Error) as e:
+        print(f"Rajapinnan välimuistia ei voitu avata: {str(e)}")
+        return None
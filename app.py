@@ -1,10 +1,20 @@
-import threading
 import time
-from datetime import datetime, timedelta
+import hashlib
+import hmac
+from datetime import datetime, date, timedelta
 import os
-import psycopg2
-from flask import Flask, render_template, request, url_for, redirect, flash
-import subprocess
+from functools import wraps
+from flask import Flask, render_template, request, url_for, redirect, flash, g, jsonify, session, Response, abort
+from tietokanta import YhteysPooli, LukuReititin, PAIVITYS_LUKKO, PAIVITYS_KAYNNISSA_SQL
+from valimuisti import TuoreusValimuisti, SivuValimuisti, DimensioValimuisti
+from normalisointi import normalisoi_nimi
+from api import api
+from pakkaus import pakkaa_vastaus, laheta_esipakattu, valitse_koodaus, pakattava, pakkaa, merkitse_pakatuksi
+import mittarit
+import hidasloki
+from mittarit import MittaavaYhteys
+from kyselyt import (kilpailut_sql, hae_laji, lajin_parhaat_sql, hae_urheilija_idt, urheilijan_tulokset_sql,
+                     KAIKKI_KAUDET)
 
 app = Flask(__name__)
 app.secret_key = 'salainen_avain'
@@ -12,125 +22,317 @@ app.secret_key = 'salainen_avain'
 # PostgreSQL-tietokannan asetukset
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
-# Päivitystilan seuranta
-update_in_progress = False
-last_update_status = {"success": None, "message": ""}
-
-def get_db_connection():
-    """Muodosta yhteys PostgreSQL-tietokantaan"""
-    try:
-        # Käytä suoraan DATABASE_URL:ia
-        conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-        return conn
-    except Exception as e:
-        app.logger.error(f"Tietokantayhteys epäonnistui: {str(e)}")
-        raise
+# Prosessin yhteinen yhteyspooli (koko: DB_POOL_MIN / DB_POOL_MAX); yhteydet mittaavat kyselynsä
+pooli = YhteysPooli(DATABASE_URL, sslmode='require', connection_factory=MittaavaYhteys,
+                    odotus_mittari=mittarit.yhteyden_odotus.havainto)
+app.extensions['pooli'] = pooli
+
+# Valinnainen lukukopio: lukupyynnöt ohjataan sille, kun se on tavoitettavissa ja ajan tasalla
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+lukupooli = None
+if DATABASE_READ_URL:
+    # Keepalive katkaisee puoliavoimen yhteyden, jos kopio katoaa kesken kyselyn
+    lukupooli = YhteysPooli(DATABASE_READ_URL, sslmode='require', connect_timeout=5,
+                            keepalives=1, keepalives_idle=30, keepalives_interval=5, keepalives_count=3,
+                            connection_factory=MittaavaYhteys,
+                            odotus_mittari=mittarit.yhteyden_odotus.havainto)
+reititin = LukuReititin(pooli, lukupooli)
+app.extensions['lukureititin'] = reititin
+
+# Pyyntöjen, SQL-kyselyjen ja sivupohjien mittaus (/metrics)
+mittarit.alusta(app)
+
+# Hitaiden kyselyjen EXPLAIN ajetaan omalla yhteydellä poolin ulkopuolella
+hidasloki.alusta(DATABASE_URL, sslmode='require')
+
+# JSON-rajapinta (/api/v1)
+app.register_blueprint(api)
+
+# Vastaukset pakataan gzipillä tai brotlilla (asetukset pakkaus.py:ssä)
+app.after_request(pakkaa_vastaus)
+
+# Kauanko päivitysaika pidetään muistissa ennen uutta kyselyä (s)
+TUOREUS_TTL = float(os.environ.get('TUOREUS_TTL', 30))
+
+# Renderöityjen sivujen välimuistin muistiraja prosessia kohden (Mt)
+SIVUVALIMUISTI_MT = float(os.environ.get('SIVUVALIMUISTI_MT', 32))
+
+# Selaimen ja välityspalvelimen välimuistiaika (s), reittikohtaiset arvot @valimuistissa-kutsuissa
+SELAIN_MAX_AGE = 60
+
+# Päättyneen kilpailun sivu voidaan pitää välimuistissa pitkään
+VALMIS_KILPAILU_PAIVAA = 7
+VALMIS_KILPAILU_MAX_AGE = 86400
+
+# Staattisten tiedostojen välimuistiaika (s)
+STAATTINEN_MAX_AGE = 7 * 86400
+
+# Kilpailulistauksen sivukoko
+KILPAILUT_SIVULLA = int(os.environ.get('KILPAILUT_SIVULLA', 50))
+
+# Urheilijalistauksen oletussivukoko ja suurin sallittu sivukoko
+URHEILIJAT_SIVULLA = int(os.environ.get('URHEILIJAT_SIVULLA', 100))
+URHEILIJAT_SIVULLA_MAX = 500
+
+# Ylläpitosivujen avain (?avain= tai X-Yllapito-Avain); ilman sitä sivut eivät ole käytössä
+YLLAPITO_AVAIN = os.environ.get('YLLAPITO_AVAIN')
+
+# Uuden workerin lämmitys (gunicorn.conf.py): suosituimpien lajien määrä ja aikaraja (s)
+LAMMITYS_LAJEJA = int(os.environ.get('LAMMITYS_LAJEJA', 10))
+LAMMITYS_AIKARAJA = float(os.environ.get('LAMMITYS_AIKARAJA', 20))
+
+# Lämmityspyynnön WSGI-ympäristön avain, jolla annetaan kyselyjen aikaraja (ms);
+# HTTP-otsakkeet päätyvät ympäristöön HTTP_-alkuisina, joten asiakas ei voi asettaa sitä
+LAMMITYS_AIKARAJA_AVAIN = 'tilastokaappari.lammitys_aikaraja_ms'
+
+# Tämän prosessin viimeisimmän lämmityksen tiedot (/tilastot)
+lammitys = {}
+
+def get_db_connection(kirjoitus=False):
+    """Palauttaa pyynnön tietokantayhteyden poolista (sama yhteys koko pyynnön ajan)
+
+    GET-pyynnöt lukevat lukukopiolta, jos se on käytössä; kirjoittava reitti
+    pyytää yhteyttä parametrilla kirjoitus=True, jolloin käytetään pääkantaa.
+    """
+    if 'db_conn' not in g:
+        try:
+            g.db_pooli, g.db_conn, g.lukukopion_sukupolvi = reititin.ota(
+                kirjoitus or request.method not in ('GET', 'HEAD'))
+            aikaraja_ms = request.environ.get(LAMMITYS_AIKARAJA_AVAIN)
+            if aikaraja_ms:
+                # Koskee vain pyynnön transaktiota, joka perutaan yhteyden palatessa pooliin
+                g.db_conn.cursor().execute("SET LOCAL statement_timeout = %s", (int(aikaraja_ms),))
+        except Exception as e:
+            app.logger.error(f"Tietokantayhteys epäonnistui: {str(e)}")
+            raise
+    return g.db_conn
+
+@app.teardown_appcontext
+def palauta_db_yhteys(exception):
+    """Palauttaa pyynnön yhteyden pooliin"""
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        g.pop('db_pooli', pooli).palauta(conn)
+
+def hae_tuoreus():
+    """Hakee viimeisimmän päivitysajan, datasukupolven ja päivitysajon tilan tietokannasta"""
+    with pooli.yhteys() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT (SELECT MAX(last_updated) FROM Kilpailut),
+                   sukupolvi, paivitetty::timestamptz
+            FROM Datasukupolvi
+        """)
+        paivitetty, sukupolvi, muutettu = c.fetchone()
+
+        # Päivitysajon tila on ajastimen (ajastin.py) kirjaama; käynnissä oleva ajo pitää lukkoa
+        c.execute(PAIVITYS_KAYNNISSA_SQL, (PAIVITYS_LUKKO,))
+        kaynnissa = c.fetchone()[0]
+        # Sivut näyttävät päivitystilan, joten Last-Modified on myöhäisin datan tai
+        # tilan muutos: ajon alku ja loppu, tuloksen piilotus vuorokauden jälkeen,
+        # vanhentuneen datan huomautus ja vuoden vaihde.
+        c.execute("""
+            SELECT tila, viesti, valmistunut > NOW() - INTERVAL '1 day',
+                   GREATEST(%s::timestamptz, aloitettu::timestamptz, valmistunut::timestamptz,
+                            CASE WHEN valmistunut <= NOW() - INTERVAL '1 day'
+                                 THEN (valmistunut + INTERVAL '1 day')::timestamptz END,
+                            CASE WHEN %s::timestamp <= LOCALTIMESTAMP - INTERVAL '1 day'
+                                 THEN (%s::timestamp + INTERVAL '1 day')::timestamptz END,
+                            date_trunc('year', NOW()))
+            FROM Paivitystila
+        """, (muutettu, paivitetty, paivitetty))
+        tila, viesti, tuore, muutettu = c.fetchone()
+
+    # Päättyneen ajon tulos näytetään vuorokauden ajan
+    tulos = {"success": None, "message": ""}
+    if tuore and tila in ('valmis', 'virhe'):
+        tulos = {"success": tila == 'valmis', "message": viesti}
+
+    return {'paivitetty': paivitetty or datetime.min, 'sukupolvi': sukupolvi, 'muutettu': muutettu,
+            'kaynnissa': kaynnissa, 'tulos': tulos}
+
+# Päivitysaika, datasukupolvi ja päivitystila luetaan välimuistista, jotta jokainen sivunlataus ei kysy niitä kannasta
+tuoreus = TuoreusValimuisti(hae_tuoreus, ttl=TUOREUS_TTL)
+
+# Renderöidyt sivut; voimassa kunnes datasukupolvi vaihtuu
+sivut = SivuValimuisti(int(SIVUVALIMUISTI_MT * 1024 * 1024))
 
 def get_last_update_time():
-    """Hakee viimeisimmän päivitysajan tietokannasta"""
+    """Palauttaa viimeisimmän päivitysajan tuoreusvälimuistista"""
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT MAX(last_updated) as last_update FROM Kilpailut")
-        result = c.fetchone()
-        conn.close()
-
-        if result and result[0]:
-            return result[0]
-        return datetime.min
+        return tuoreus.hae()['paivitetty']
     except Exception as e:
         app.logger.error(f"Päivitysajan hakuvirhe: {str(e)}")
         return datetime.min
 
-def update_database_thread():
-    """Suorita tietokannan päivitys taustasäikeessä"""
-    global update_in_progress, last_update_status
-
-    update_in_progress = True
+def hae_datasukupolvi():
+    """Palauttaa datasukupolven ja sivujen muutosajan tuoreusvälimuistista, (None, None) jos niitä ei saatu"""
     try:
-        app.logger.info("Taustapäivitys alkoi")
-        result = subprocess.run(['python', 'automaatti_haku.py'], 
-                              capture_output=True, text=True, timeout=3600)  # 1h timeout
-
-        if result.returncode == 0:
-            # Päivitetään viimeisin päivitysaika tietokantaan
-            current_time = datetime.now().isoformat()
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute("UPDATE Kilpailut SET last_updated = %s WHERE last_updated = (SELECT MAX(last_updated) FROM Kilpailut)", 
-                     (current_time,))
-            conn.commit()
-            conn.close()
-
-            last_update_status = {"success": True, "message": "Tietokanta päivitetty onnistuneesti!"}
-            app.logger.info("Taustapäivitys valmis")
-        else:
-            error_msg = f"Päivitys epäonnistui: {result.stderr}"
-            last_update_status = {"success": False, "message": error_msg}
-            app.logger.error(error_msg)
-
-    except subprocess.TimeoutExpired:
-        error_msg = "Päivitys aikakatkaistiin (yli 1 tunti)"
-        last_update_status = {"success": False, "message": error_msg}
-        app.logger.error(error_msg)
+        arvot = tuoreus.hae()
+        return arvot['sukupolvi'], arvot['muutettu']
     except Exception as e:
-        error_msg = f"Päivitysprosessi epäonnistui: {str(e)}"
-        last_update_status = {"success": False, "message": error_msg}
-        app.logger.error(error_msg)
-    finally:
-        update_in_progress = False
-
-def check_db_update():
-    """Tarkistaa päivitysajan ja käynnistää taustapäivityksen tarvittaessa"""
-    global update_in_progress
-
-    # Älä päivitä jos päivitys on jo meneillään
-    if update_in_progress:
-        app.logger.info("Päivitys on jo meneillään")
-        return
+        app.logger.error(f"Datasukupolven hakuvirhe: {str(e)}")
+        return None, None
 
+def hae_paivitystila():
+    """Palauttaa (päivitys käynnissä, viimeisimmän ajon tulos) tuoreusvälimuistista"""
     try:
-        # Hae viimeisin päivitysaika tietokannasta
-        last_update = get_last_update_time()
+        arvot = tuoreus.hae()
+        return arvot['kaynnissa'], arvot['tulos']
+    except Exception as e:
+        app.logger.error(f"Päivitystilan hakuvirhe: {str(e)}")
+        return False, {"success": None, "message": ""}
 
-        # Päivitä jos yli 24h vanha
-        if datetime.now() - last_update > timedelta(days=1):
-            # Käynnistä taustasäie
-            thread = threading.Thread(target=update_database_thread)
-            thread.daemon = True  # Säie sammuu kun pääohjelma sammuu
-            thread.start()
-            app.logger.info("Taustapäivitys käynnistetty")
+def lataa_vuodet():
+    """Vuodet, joilta on kilpailuja, uusin ensin"""
+    with pooli.yhteys() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT DISTINCT EXTRACT(YEAR FROM alkupvm) as vuosi
+            FROM Kilpailut
+            WHERE alkupvm IS NOT NULL
+            ORDER BY vuosi DESC
+        """)
+        return [int(r[0]) for r in c.fetchall()]
 
-    except Exception as e:
-        app.logger.error(f"Automaattipäivitys epäonnistui: {str(e)}")
+def lataa_lajit():
+    """Lajiluettelon lajit nimen mukaan"""
+    with pooli.yhteys() as conn:
+        c = conn.cursor()
+        c.execute("""
+            SELECT luettelo_id, nimi
+            FROM Lajiluettelo
+            ORDER BY nimi
+        """)
+        return [{'laji_id': r[0], 'nimi': r[1]} for r in c.fetchall()]
+
+# Pudotusvalikkojen luettelot; ladataan uudelleen vasta datasukupolven vaihtuessa
+dimensiot = DimensioValimuisti({'vuodet': lataa_vuodet, 'lajit': lataa_lajit})
+
+def hae_dimensio(nimi):
+    """Palauttaa luettelon (vuodet tai lajit) dimensiovälimuistista"""
+    sukupolvi, _ = hae_datasukupolvi()
+    return dimensiot.hae(nimi, sukupolvi)
+
+def sivun_avain():
+    """Välimuistiavain: reitti, normalisoidut parametrit ja sivupohjan tilatiedot"""
+    parametrit = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if v != ''))
+    polku = tuple(sorted((request.view_args or {}).items()))
+    needs_update = datetime.now() - get_last_update_time() > timedelta(days=1)
+    update_in_progress, last_update_status = hae_paivitystila()
+    return (request.endpoint, polku, parametrit, update_in_progress, last_update_status['message'],
+            needs_update, datetime.now().year)
+
+def on_muuttumaton(etag, muutettu):
+    """Tarkistaa pyynnön ehdot (If-None-Match ensisijaisesti, muuten If-Modified-Since)"""
+    if request.if_none_match:
+        # Heikko vertailu, koska pakattu vastaus lähetetään heikolla ETagilla
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and muutettu:
+        return muutettu.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def aseta_validaattorit(vastaus, etag, muutettu, max_age):
+    """Lisää vastaukseen ETag-, Last-Modified- ja Cache-Control-otsakkeet"""
+    vastaus.set_etag(etag)
+    if muutettu:
+        vastaus.last_modified = muutettu
+    vastaus.cache_control.public = True
+    vastaus.cache_control.max_age = max_age
+    return vastaus
+
+def pakkaa_sivu(vastaus, avain, sukupolvi):
+    """Pakkaa välimuistin sivun kerran koodausta kohden ja käyttää pakattua runkoa osumissa
+
+    Pakattu vastaus ohittaa pakkaa_vastauksen, koska sillä on jo Content-Encoding.
+    """
+    runko = vastaus.get_data()
+    koodaus = valitse_koodaus() if pakattava(vastaus.mimetype, len(runko)) else None
+    if koodaus is None:
+        return vastaus
+    pakattu = sivut.hae_pakattu(avain, sukupolvi, koodaus)
+    if pakattu is None:
+        pakattu = pakkaa(runko, koodaus)
+        sivut.tallenna_pakattu(avain, sukupolvi, koodaus, pakattu)
+    vastaus.set_data(pakattu)
+    merkitse_pakatuksi(vastaus, koodaus)
+    return vastaus
+
+def valimuistissa(max_age=SELAIN_MAX_AGE):
+    """Palauttaa sivun välimuistista, jos data ei ole muuttunut sen renderöinnin jälkeen
+
+    Vastaukseen lisätään datasukupolvesta ja päivitystilasta johdettu ETag ja Last-Modified, joten
+    ehdolliseen pyyntöön vastataan 304:llä ennen yhtään tietokantakyselyä.
+    Näkymä voi pidentää välimuistiaikaa asettamalla g.max_age.
+    """
+    def koriste(nakyma):
+        @wraps(nakyma)
+        def kaare(*args, **kwargs):
+            sukupolvi, muutettu = hae_datasukupolvi()
+            # Flash-viestit näytetään vain kerran, joten niitä sisältävää sivua ei tallenneta
+            if sukupolvi is None or '_flashes' in session:
+                return nakyma(*args, **kwargs)
+
+            avain = sivun_avain()
+            etag = hashlib.sha1(f"{sukupolvi}:{avain!r}".encode('utf-8')).hexdigest()[:20]
+
+            # 304 ei lue sivua välimuistista, joten sitä ei lasketa osumaksi eikä ohitukseksi
+            if on_muuttumaton(etag, muutettu):
+                vastaus = app.response_class(status=304)
+                sivun_max_age = sivut.hae_max_age(avain, sukupolvi)
+                return aseta_validaattorit(vastaus, etag, muutettu,
+                                           max_age if sivun_max_age is None else sivun_max_age)
+
+            sivu = sivut.hae(avain, sukupolvi)
+            if sivu is not None:
+                runko, mimetype, sivun_max_age = sivu
+                vastaus = app.response_class(runko, mimetype=mimetype)
+                aseta_validaattorit(vastaus, etag, muutettu, sivun_max_age)
+                return pakkaa_sivu(vastaus, avain, sukupolvi)
+
+            vastaus = app.make_response(nakyma(*args, **kwargs))
+            # Pääkannasta jäljessä olevan lukukopion sivua ei tallenneta uuden sukupolven alle
+            kopion_sukupolvi = g.get('lukukopion_sukupolvi')
+            if kopion_sukupolvi is not None and kopion_sukupolvi != sukupolvi:
+                vastaus.cache_control.no_cache = True
+            elif vastaus.status_code == 200:
+                sivun_max_age = g.get('max_age', max_age)
+                sivut.tallenna(avain, sukupolvi, vastaus.get_data(), vastaus.mimetype, sivun_max_age)
+                aseta_validaattorit(vastaus, etag, muutettu, sivun_max_age)
+                pakkaa_sivu(vastaus, avain, sukupolvi)
+            return vastaus
+        return kaare
+    return koriste
 
 @app.route('/paivita_tietokanta')
 def paivita_tietokanta():
-    """Manuaalinen tietokannan päivitys taustalla"""
-    global update_in_progress
+    """Pyytää ajastinta päivittämään tietokannan heti"""
+    update_in_progress, _ = hae_paivitystila()
 
     if update_in_progress:
         flash('Päivitys on jo meneillään', 'info')
     else:
-        # Käynnistä taustapäivitys
-        thread = threading.Thread(target=update_database_thread)
-        thread.daemon = True
-        thread.start()
-        flash('Taustapäivitys käynnistetty. Sivu päivittyy automaattisesti.', 'success')
+        conn = get_db_connection(kirjoitus=True)
+        c = conn.cursor()
+        c.execute("UPDATE Paivitystila SET pyydetty = NOW()")
+        conn.commit()
+        flash('Päivitys pyydetty. Ajastin käynnistää sen hetken kuluttua.', 'success')
 
     return redirect(url_for('index'))
 
-@app.before_request
-def before_request():
-    """Suorita ennen jokaista pyyntöä"""
-    if request.endpoint != 'static':
-        check_db_update()
+def staattinen(filename):
+    """Staattiset tiedostot esipakattuina (python pakkaus.py static buildissa)"""
+    return laheta_esipakattu(app.static_folder, filename, STAATTINEN_MAX_AGE)
+
+app.view_functions['static'] = staattinen
+
+@app.route('/favicon.ico')
+def favicon():
+    return laheta_esipakattu(app.static_folder, 'favicon.ico', STAATTINEN_MAX_AGE)
 
 @app.context_processor
 def inject_template_vars():
     """Lisää yhteiset muuttujat kaikille templateille"""
-    global update_in_progress, last_update_status
-
     last_update = None
     last_update_dt = get_last_update_time()
     needs_update = True
@@ -139,6 +341,8 @@ def inject_template_vars():
         last_update = last_update_dt.strftime('%d.%m.%Y %H:%M')
         needs_update = (datetime.now() - last_update_dt) > timedelta(days=1)
 
+    update_in_progress, last_update_status = hae_paivitystila()
+
     return {
         'current_year': datetime.now().year,
         'db_last_update': last_update,
@@ -147,53 +351,214 @@ def inject_template_vars():
         'last_update_status': last_update_status
     }
 
+def lammita():
+    """Täyttää yhteyspoolin ja renderöi suosituimmat sivut välimuistiin
+
+    Kutsutaan uudessa workerissa ennen ensimmäistä pyyntöä, jotta kierrätetyn
+    workerin jälkeen ensimmäinen käyttäjä ei maksa kylmää käynnistystä.
+    Aikaraja tarkistetaan sivujen välillä, ja jokaisen sivun kyselyt saavat
+    statement_timeoutiksi jäljellä olevan ajan, ettei yksittäinen hidas sivu
+    venytä lämmitystä gunicornin timeoutin yli. Etusivua ei lämmitetä, koska
+    sitä ei tallenneta sivuvälimuistiin.
+    """
+    alku = time.monotonic()
+    polut = ['/kilpailut', '/lajit']
+    sivuja = virheita = kasiteltyja = 0
+
+    try:
+        pooli.esitayta()
+        with pooli.yhteys() as conn:
+            c = conn.cursor()
+            c.execute("SET LOCAL statement_timeout = %s", (int(LAMMITYS_AIKARAJA * 1000),))
+            # Suosituimmat lajit urheilijamäärällä (kaikkien aikojen rivejä on yksi urheilijaa kohden)
+            c.execute("""
+                SELECT luettelo_id FROM Ennatykset
+                WHERE kausi = %s
+                GROUP BY luettelo_id
+                ORDER BY COUNT(*) DESC
+                LIMIT %s
+            """, (KAIKKI_KAUDET, LAMMITYS_LAJEJA))
+            polut += [f"/laji?laji_id={rivi[0]}" for rivi in c.fetchall()]
+            conn.rollback()
+    except Exception as e:
+        app.logger.error(f"Lämmityksen tietokantavirhe: {str(e)}")
+        virheita += 1
+
+    # Lukukopio täytetään erikseen, ettei tavoittamaton kopio estä pääkannan lämmitystä
+    if lukupooli is not None and reititin.tila() is not None:
+        try:
+            lukupooli.esitayta()
+        except Exception as e:
+            app.logger.error(f"Lukukopion lämmitys epäonnistui: {str(e)}")
+            virheita += 1
+
+    asiakas = app.test_client()
+    for polku in polut:
+        # Worker ei vastaa gunicornin valvontaan lämmityksen aikana
+        jaljella = LAMMITYS_AIKARAJA - (time.monotonic() - alku)
+        if jaljella <= 0:
+            break
+        kasiteltyja += 1
+        vastaus = asiakas.get(polku, environ_base={LAMMITYS_AIKARAJA_AVAIN: max(1, int(jaljella * 1000))})
+        if vastaus.status_code == 200:
+            sivuja += 1
+        else:
+            virheita += 1
+
+    lammitys.update({
+        'aloitettu': datetime.now().isoformat(timespec='seconds'),
+        'kesto_s': round(time.monotonic() - alku, 3),
+        'sivuja': sivuja,
+        'ohitettuja': len(polut) - kasiteltyja,
+        'virheita': virheita
+    })
+    return lammitys
+
+def hae_ajastimen_syke():
+    """Palauttaa ajastimen viimeisimmän elonmerkin iän sekunteina tai None, jos sitä ei ole"""
+    try:
+        with pooli.yhteys() as conn:
+            c = conn.cursor()
+            c.execute("SELECT EXTRACT(EPOCH FROM NOW() - syke::timestamptz) FROM Paivitystila")
+            rivi = c.fetchone()
+            conn.rollback()
+    except Exception as e:
+        app.logger.error(f"Ajastimen elonmerkin hakuvirhe: {str(e)}")
+        return None
+    return round(float(rivi[0]), 1) if rivi and rivi[0] is not None else None
+
+@app.route('/tilastot')
+def tilastot():
+    """Palauttaa prosessin sisäiset tilastot JSON-muodossa"""
+    return jsonify({
+        'pooli': pooli.tilastot(),
+        'lukukopio': dict(reititin.tilastot(), pooli=lukupooli.tilastot() if lukupooli else None),
+        'sivuvalimuisti': sivut.tilastot(),
+        'dimensiot': dimensiot.tilastot(),
+        'lammitys': lammitys,
+        'ajastin': {'syke_ika_s': hae_ajastimen_syke()}
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prosessin mittarit Prometheus-tekstimuodossa"""
+    tilastot = pooli.tilastot()
+    lisarivit = [
+        '# HELP db_pool_connections Poolin yhteydet tiloittain',
+        '# TYPE db_pool_connections gauge',
+        f'db_pool_connections{{tila="kaytossa"}} {tilastot["kaytossa"]}',
+        f'db_pool_connections{{tila="vapaa"}} {tilastot["vapaita"]}',
+        '# HELP db_pool_timeouts_total Yhteyden lainauksen aikakatkaisut',
+        '# TYPE db_pool_timeouts_total counter',
+        f'db_pool_timeouts_total {tilastot["aikakatkaisuja"]}'
+    ]
+    syke_ika = hae_ajastimen_syke()
+    if syke_ika is not None:
+        lisarivit += [
+            '# HELP scheduler_heartbeat_age_seconds Aika ajastimen viimeisimmästä elonmerkistä',
+            '# TYPE scheduler_heartbeat_age_seconds gauge',
+            f'scheduler_heartbeat_age_seconds {syke_ika}'
+        ]
+    return Response(mittarit.muotoile(lisarivit), mimetype=mittarit.METRIIKKA_TYYPPI)
+
+def yllapito(nakyma):
+    """Sallii näkymän vain ylläpitoavaimella, muuten 404"""
+    @wraps(nakyma)
+    def kaare(*args, **kwargs):
+        avain = request.args.get('avain') or request.headers.get('X-Yllapito-Avain') or ''
+        if not YLLAPITO_AVAIN or not hmac.compare_digest(avain.encode(), YLLAPITO_AVAIN.encode()):
+            abort(404)
+        vastaus = app.make_response(nakyma(*args, **kwargs))
+        vastaus.cache_control.no_store = True
+        return vastaus
+    return kaare
+
+@app.route('/yllapito/hitaat')
+@yllapito
+def hitaat_kyselyt():
+    """Hitaiden kyselyjen loki uusimmasta vanhimpaan"""
+    maara = min(request.args.get('maara', 100, type=int), 1000)
+    return render_template('hitaat_kyselyt.html',
+                           kyselyt=hidasloki.lue(maara),
+                           kynnys_ms=hidasloki.HIDAS_KYSELY_MS,
+                           explain_osuus=hidasloki.HIDAS_EXPLAIN_OSUUS)
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/kilpailut')
+@valimuistissa()
 def nayta_kilpailut():
+    # Sivutus päivämäärän mukaan: näytetään kilpailut, jotka ovat ennen annettua (pvm, id) -paria
+    ennen_pvm = request.args.get('ennen_pvm', '').strip()
+    ennen_id = request.args.get('ennen_id', type=int)
+
+    try:
+        if ennen_pvm:
+            ennen_pvm = datetime.strptime(ennen_pvm, '%Y-%m-%d').date()
+    except ValueError:
+        return render_template('error.html', message='Virheellinen päivämäärä'), 400
+
     try:
         with get_db_connection() as conn:
             c = conn.cursor()
-            # Muutettu kysely: hae vain kilpailut joissa on tuloksia
-            c.execute("""
-                SELECT DISTINCT k.kilpailu_id, k.kilpailun_nimi, k.alkupvm 
-                FROM Kilpailut k
-                JOIN Lajit l ON k.kilpailu_id = l.kilpailu_id
-                JOIN Tulokset t ON l.laji_id = t.laji_id
-                ORDER BY k.alkupvm DESC
-            """)
+            ennen = (ennen_pvm, ennen_id) if ennen_pvm and ennen_id is not None else None
+            # Haetaan yksi ylimääräinen rivi, jotta tiedetään onko seuraavaa sivua
+            sql, params = kilpailut_sql(KILPAILUT_SIVULLA + 1, ennen)
+
+            c.execute(sql, params)
             kilpailut = c.fetchall()
 
             # Muunnetaan tuplet sanakirjoiksi
             kilpailut_list = []
-            for kilpailu in kilpailut:
+            for kilpailu in kilpailut[:KILPAILUT_SIVULLA]:
                 kilpailut_list.append({
                     'kilpailu_id': kilpailu[0],
                     'kilpailun_nimi': kilpailu[1],
-                    'alkupvm': kilpailu[2]
+                    'alkupvm': kilpailu[2],
+                    'lajeja': kilpailu[3],
+                    'tuloksia': kilpailu[4],
+                    'urheilijoita': kilpailu[5]
                 })
 
-        return render_template('kilpailut.html', kilpailut=kilpailut_list)
+        seuraava = None
+        if len(kilpailut) > KILPAILUT_SIVULLA:
+            viimeinen = kilpailut_list[-1]
+            seuraava = {
+                'ennen_pvm': (viimeinen['alkupvm'] or datetime.min.date()).isoformat(),
+                'ennen_id': viimeinen['kilpailu_id']
+            }
+
+        return render_template('kilpailut.html',
+                             kilpailut=kilpailut_list,
+                             seuraava=seuraava,
+                             ensimmainen_sivu=not ennen_pvm)
     except Exception as e:
         app.logger.error(f"Kilpailujen hakuvirhe: {str(e)}")
         return render_template('error.html', message='Tietokantayhteys epäonnistui'), 500
 
 @app.route('/kilpailu/<int:kilpailu_id>')
+@valimuistissa()
 def nayta_kilpailun_tulokset(kilpailu_id):
     try:
         conn = get_db_connection()
         c = conn.cursor()
 
         # Hae kilpailun perustiedot
-        c.execute("SELECT kilpailun_nimi, alkupvm, paikkakunta FROM Kilpailut WHERE kilpailu_id = %s", (kilpailu_id,))
+        c.execute("""
+            SELECT kilpailun_nimi, alkupvm, paikkakunta, COALESCE(loppupvm, alkupvm)
+            FROM Kilpailut WHERE kilpailu_id = %s
+        """, (kilpailu_id,))
         kilpailu = c.fetchone()
 
         if not kilpailu:
-            conn.close()
             return render_template('error.html', message='Kilpailua ei löytynyt'), 404
 
+        # Päättyneen kilpailun tulokset muuttuvat enää harvoin
+        if kilpailu[3] and kilpailu[3] <= date.today() - timedelta(days=VALMIS_KILPAILU_PAIVAA):
+            g.max_age = VALMIS_KILPAILU_MAX_AGE
+
         # Muunnetaan kilpailu sanakirjaksi
         kilpailu_dict = {
             'kilpailun_nimi': kilpailu[0],
@@ -201,56 +566,49 @@ def nayta_kilpailun_tulokset(kilpailu_id):
             'paikkakunta': kilpailu[2]
         }
 
-        # Hae kilpailun lajit
+        # Hae kaikki lajit ja niiden tulokset yhdellä kyselyllä.
+        # Lajit ilman tuloksia tulevat mukaan yhtenä rivinä, jonka tulossarakkeet ovat NULL.
         c.execute("""
-            SELECT laji_id, lajin_nimi, sarja 
-            FROM Lajit 
-            WHERE kilpailu_id = %s
-            ORDER BY lajin_nimi
+            SELECT l.laji_id, l.lajin_nimi, l.sarja,
+                   t.tulos_id, t.sijoitus, u.etunimi, u.sukunimi,
+                   COALESCE(s.seura_nimi, '-') as seura,
+                   COALESCE(CAST(t.tulos AS TEXT), t.lisatiedot) as tulos,
+                   u.syntymavuosi, u.sukupuoli
+            FROM Lajit l
+            LEFT JOIN (Tulokset t
+                       JOIN Urheilijat u ON t.urheilija_id = u.urheilija_id)
+                   ON t.laji_id = l.laji_id AND t.kilpailu_id = l.kilpailu_id
+            LEFT JOIN Seurat s ON u.seura_id = s.seura_id
+            WHERE l.kilpailu_id = %s
+            ORDER BY l.lajin_nimi, l.laji_id, t.sijoitus
         """, (kilpailu_id,))
-        lajit = c.fetchall()
+        rows = c.fetchall()
 
-        # Muunnetaan lajit sanakirjoiksi
+        # Ryhmitellään rivit lajeittain yhdellä läpikäynnillä
         lajit_list = []
-        for laji in lajit:
-            lajit_list.append({
-                'laji_id': laji[0],
-                'lajin_nimi': laji[1],
-                'sarja': laji[2]
-            })
-
-        # Hae tulokset kullekin lajille
         tulokset = {}
-        for laji in lajit_list:
-            c.execute("""
-                SELECT t.sijoitus, u.etunimi, u.sukunimi, 
-                       COALESCE(s.seura_nimi, '-') as seura, 
-                       COALESCE(CAST(t.tulos AS TEXT), t.lisatiedot) as tulos,
-                       u.syntymavuosi, u.sukupuoli
-                FROM Tulokset t
-                JOIN Urheilijat u ON t.urheilija_id = u.urheilija_id
-                LEFT JOIN Seurat s ON u.seura_id = s.seura_id
-                WHERE t.laji_id = %s
-                ORDER BY t.sijoitus
-            """, (laji['laji_id'],))
-            results = c.fetchall()
-
-            # Muunnetaan tulokset sanakirjoiksi
-            tulokset_list = []
-            for result in results:
-                tulokset_list.append({
-                    'sijoitus': result[0],
-                    'etunimi': result[1],
-                    'sukunimi': result[2],
-                    'seura': result[3],
-                    'tulos': result[4],
-                    'syntymavuosi': result[5],
-                    'sukupuoli': result[6]
+        for row in rows:
+            laji_id = row[0]
+            if laji_id not in tulokset:
+                lajit_list.append({
+                    'laji_id': laji_id,
+                    'lajin_nimi': row[1],
+                    'sarja': row[2]
                 })
-
-            tulokset[laji['laji_id']] = tulokset_list
-
-        conn.close()
+                tulokset[laji_id] = []
+
+            if row[3] is None:
+                continue
+
+            tulokset[laji_id].append({
+                'sijoitus': row[4],
+                'etunimi': row[5],
+                'sukunimi': row[6],
+                'seura': row[7],
+                'tulos': row[8],
+                'syntymavuosi': row[9],
+                'sukupuoli': row[10]
+            })
 
         return render_template('kilpailun_tulokset.html', 
                              kilpailu=kilpailu_dict, 
@@ -261,48 +619,31 @@ def nayta_kilpailun_tulokset(kilpailu_id):
         return render_template('error.html', message='Tietokantavirhe'), 500
 
 @app.route('/urheilija')
+@valimuistissa(max_age=300)
 def hae_urheilijan_tulokset():
     nimi = request.args.get('nimi', '').strip()
     sukupuoli = request.args.get('sukupuoli', '').upper()
     ika_min = request.args.get('ika_min', type=int)
     ika_max = request.args.get('ika_max', type=int)
 
-    if not nimi:
+    if not normalisoi_nimi(nimi):
         return render_template('error.html', message='Anna urheilijan nimi'), 400
 
     try:
         conn = get_db_connection()
         c = conn.cursor()
 
-        sql = """
-            SELECT l.lajin_nimi, l.sarja, k.kilpailun_nimi, k.alkupvm, 
-                   COALESCE(CAST(t.tulos AS TEXT), t.lisatiedot) as tulos,
-                   t.sijoitus, u.syntymavuosi, u.sukupuoli
-            FROM Tulokset t
-            JOIN Urheilijat u ON t.urheilija_id = u.urheilija_id
-            JOIN Lajit l ON t.laji_id = l.laji_id
-            JOIN Kilpailut k ON l.kilpailu_id = k.kilpailu_id
-            WHERE (u.etunimi ILIKE %s OR u.sukunimi ILIKE %s OR (u.etunimi || ' ' || u.sukunimi) ILIKE %s)
-        """
-        params = [f'%{nimi}%', f'%{nimi}%', f'%{nimi}%']
-
-        if sukupuoli in ['M', 'N']:
-            sql += " AND u.sukupuoli = %s"
-            params.append(sukupuoli)
-
-        if ika_min is not None or ika_max is not None:
-            sql += " AND k.alkupvm IS NOT NULL AND u.syntymavuosi IS NOT NULL"
-
-            if ika_min is not None and ika_max is not None:
-                sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi BETWEEN %s AND %s)"
-                params.extend([ika_min, ika_max])
-            elif ika_min is not None:
-                sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi >= %s)"
-                params.append(ika_min)
-            elif ika_max is not None:
-                sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi <= %s)"
-                params.append(ika_max)
-
+        # Ensin haetaan osuvat urheilijat indeksistä, tulokset vain niille
+        urheilija_idt = hae_urheilija_idt(c, nimi, sukupuoli if sukupuoli in ['M', 'N'] else None)
+        if not urheilija_idt:
+            return render_template('urheilijan_tulokset.html',
+                                 nimi=nimi,
+                                 tulokset=[],
+                                 sukupuoli=sukupuoli,
+                                 ika_min=ika_min,
+                                 ika_max=ika_max)
+
+        sql, params = urheilijan_tulokset_sql(urheilija_idt, ika_min, ika_max)
         sql += " ORDER BY k.alkupvm DESC, l.lajin_nimi"
 
         c.execute(sql, params)
@@ -321,8 +662,6 @@ def hae_urheilijan_tulokset():
                 'sukupuoli': result[7]
             })
 
-        conn.close()
-
         return render_template('urheilijan_tulokset.html', 
                              nimi=nimi,
                              tulokset=tulokset,
@@ -334,125 +673,31 @@ def hae_urheilijan_tulokset():
         return render_template('error.html', message='Tietokantavirhe'), 500
 
 @app.route('/laji')
+@valimuistissa(max_age=300)
 def hae_lajin_parhaat_tulokset():
+    laji_id = request.args.get('laji_id', type=int)
     laji = request.args.get('laji', '').strip()
     sukupuoli = request.args.get('sukupuoli', '').upper()
     ika_min = request.args.get('ika_min', type=int)
     ika_max = request.args.get('ika_max', type=int)
     vuosi = request.args.get('vuosi', type=int)
 
-    if not laji:
+    if laji_id is None and not laji:
         return render_template('error.html', message='Anna lajin nimi'), 400
 
-    # Määritellään oikea järjestyssuunta eri lajeille
-    jarjestys = "DESC"  # Oletus: pituuslajit (suurin paras)
-    
-    # Aikalajit (pienin aika on paras)
-    aikalajit = ['kävely', 'aidat', 'esteet', 'viesti', 'aitaviesti', 'maantiejuoksu',
-                'maraton', 'puolimaraton', '10000m', '5000m', '3000m', '1500m', '800m', '400m',
-                '200m', '100m', '60m']
-
-    # Tarkistetaan onko kyseessä aikalaji
-    if (laji.lower().endswith('m') or 
-        any(aikalaji in laji.lower() for aikalaji in aikalajit)):
-        jarjestys = "ASC"
-
     try:
         conn = get_db_connection()
         c = conn.cursor()
 
-        # Määritellään tulosvertailufunktio järjestyksen mukaan
-        if jarjestys == "ASC":
-            order_direction = "ASC"
-            default_value = "999999"
-        else:
-            order_direction = "DESC"
-            default_value = "-999999"
-
-        sql = f"""
-            WITH ParhaatTulokset AS (
-                SELECT 
-                    u.urheilija_id,
-                    u.etunimi, 
-                    u.sukunimi, 
-                    COALESCE(s.seura_nimi, '-') as seura,
-                    COALESCE(CAST(t.tulos AS TEXT), t.lisatiedot) as tulos,
-                    k.kilpailun_nimi, 
-                    k.alkupvm,
-                    u.syntymavuosi, 
-                    u.sukupuoli,
-                    t.sijoitus,
-                    CASE 
-                        WHEN CAST(t.tulos AS TEXT) ~ '^[0-9]+:[0-9]+([.][0-9]+)?$' THEN
-                            CAST(SPLIT_PART(CAST(t.tulos AS TEXT), ':', 1) AS INTEGER) * 60 + 
-                            CAST(SPLIT_PART(CAST(t.tulos AS TEXT), ':', 2) AS NUMERIC)
-                        WHEN CAST(t.tulos AS TEXT) ~ '^[0-9]+([.][0-9]+)?$' THEN
-                            CAST(t.tulos AS NUMERIC)
-                        ELSE {default_value}
-                    END AS tulos_numero,
-                    ROW_NUMBER() OVER (
-                        PARTITION BY u.urheilija_id 
-                        ORDER BY 
-                            CASE 
-                                WHEN CAST(t.tulos AS TEXT) ~ '^[0-9]+:[0-9]+([.][0-9]+)?$' THEN
-                                    CAST(SPLIT_PART(CAST(t.tulos AS TEXT), ':', 1) AS INTEGER) * 60 + 
-                                    CAST(SPLIT_PART(CAST(t.tulos AS TEXT), ':', 2) AS NUMERIC)
-                                WHEN CAST(t.tulos AS TEXT) ~ '^[0-9]+([.][0-9]+)?$' THEN
-                                    CAST(t.tulos AS NUMERIC)
-                                ELSE {default_value}
-                            END {order_direction}
-                    ) AS rn
-                FROM Urheilijat u
-                JOIN Tulokset t ON u.urheilija_id = t.urheilija_id
-                LEFT JOIN Seurat s ON u.seura_id = s.seura_id
-                JOIN Lajit l ON t.laji_id = l.laji_id
-                JOIN Kilpailut k ON l.kilpailu_id = k.kilpailu_id
-                WHERE l.lajin_nimi ILIKE %s 
-                AND CAST(t.tulos AS TEXT) != 'DNS' 
-                AND CAST(t.tulos AS TEXT) != 'DNF'
-        """
-
-        params = [f'%{laji}%']
+        # Laji haetaan lajiluettelosta id:llä tai tarkalla nimellä (vanhat ?laji=-linkit)
+        luettelo_rivi = hae_laji(c, laji_id, laji)
 
-        if sukupuoli in ['M', 'N']:
-            sql += " AND u.sukupuoli = %s"
-            params.append(sukupuoli)
+        if not luettelo_rivi:
+            return render_template('error.html', message='Lajia ei löytynyt'), 404
 
-        if vuosi is not None:
-            sql += " AND EXTRACT(YEAR FROM k.alkupvm) = %s"
-            params.append(vuosi)
-
-        if ika_min is not None or ika_max is not None:
-            sql += " AND k.alkupvm IS NOT NULL AND u.syntymavuosi IS NOT NULL"
-
-            if ika_min is not None and ika_max is not None:
-                sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi BETWEEN %s AND %s)"
-                params.extend([ika_min, ika_max])
-            elif ika_min is not None:
-                sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi >= %s)"
-                params.append(ika_min)
-            elif ika_max is not None:
-                sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi <= %s)"
-                params.append(ika_max)
-
-        sql += f"""
-            )
-            SELECT 
-                etunimi, 
-                sukunimi, 
-                seura,
-                tulos,
-                kilpailun_nimi, 
-                alkupvm,
-                syntymavuosi, 
-                sukupuoli,
-                sijoitus
-            FROM ParhaatTulokset
-            WHERE rn = 1
-            ORDER BY tulos_numero {jarjestys}
-            LIMIT 50
-        """
+        laji_id, laji = luettelo_rivi
 
+        sql, params = lajin_parhaat_sql(laji_id, sukupuoli, vuosi, ika_min, ika_max)
         c.execute(sql, params)
         results = c.fetchall()
 
@@ -470,35 +715,31 @@ def hae_lajin_parhaat_tulokset():
                 'sijoitus': result[8]
             })
 
-        c.execute("""
-            SELECT DISTINCT EXTRACT(YEAR FROM alkupvm) as vuosi
-            FROM Kilpailut
-            WHERE alkupvm IS NOT NULL
-            ORDER BY vuosi DESC
-        """)
-        vuodet_results = c.fetchall()
-        vuodet = [r[0] for r in vuodet_results]
-
-        conn.close()
-
         return render_template('lajin_parhaat.html', 
                              laji=laji,
+                             laji_id=laji_id,
                              tulokset=tulokset,
                              sukupuoli=sukupuoli,
                              ika_min=ika_min,
                              ika_max=ika_max,
                              vuosi=vuosi,
-                             vuodet=vuodet)
+                             vuodet=hae_dimensio('vuodet'))
     except Exception as e:
         app.logger.error(f"Lajin parhaiden tulosten hakuvirhe: {str(e)}")
         return render_template('error.html', message='Tietokantavirhe'), 500
 
 @app.route('/urheilijat')
+@valimuistissa(max_age=300)
 def listaa_urheilijat():
     sukupuoli = request.args.get('sukupuoli', '').upper()
     ika_min = request.args.get('ika_min', type=int)
     ika_max = request.args.get('ika_max', type=int)
+    sivukoko = request.args.get('sivukoko', URHEILIJAT_SIVULLA, type=int)
+    # Sivutuksen kursorit: sivun viimeisen (jalkeen) tai ensimmäisen (ennen) urheilijan id
+    jalkeen = request.args.get('jalkeen', type=int)
+    ennen = request.args.get('ennen', type=int)
 
+    sivukoko = max(1, min(sivukoko, URHEILIJAT_SIVULLA_MAX))
     current_year = datetime.now().year
 
     try:
@@ -507,79 +748,108 @@ def listaa_urheilijat():
 
         sql = """
             SELECT 
-                urheilija_id,
-                TRIM(etunimi) as etunimi,
-                TRIM(sukunimi) as sukunimi,
-                sukupuoli,
-                syntymavuosi
-            FROM Urheilijat
-            WHERE 1=1
+                u.urheilija_id,
+                TRIM(u.etunimi) as etunimi,
+                TRIM(u.sukunimi) as sukunimi,
+                u.sukupuoli,
+                u.syntymavuosi
+            FROM Urheilijat u
+            WHERE u.sukupuoli IS NOT NULL AND u.syntymavuosi IS NOT NULL
         """
-
         params = []
 
         if sukupuoli in ['M', 'N']:
-            sql += " AND sukupuoli = %s"
+            sql += " AND u.sukupuoli = %s"
             params.append(sukupuoli)
 
-        sql += " AND sukupuoli IS NOT NULL AND syntymavuosi IS NOT NULL"
+        # Ikäraja muunnetaan syntymävuosiksi, jolloin vertailu on suoraan sarakkeeseen
+        if ika_max is not None:
+            sql += " AND u.syntymavuosi >= %s"
+            params.append(current_year - ika_max)
+        if ika_min is not None:
+            sql += " AND u.syntymavuosi <= %s"
+            params.append(current_year - ika_min)
+
+        # Samanniminen ja samana vuonna syntynyt urheilija näytetään vain kerran (pienin id)
+        sql += """
+            AND NOT EXISTS (
+                SELECT 1 FROM Urheilijat d
+                WHERE LOWER(TRIM(d.sukunimi)) = LOWER(TRIM(u.sukunimi))
+                  AND LOWER(TRIM(d.etunimi)) = LOWER(TRIM(u.etunimi))
+                  AND d.syntymavuosi = u.syntymavuosi
+                  AND d.sukupuoli IS NOT NULL
+                  AND d.urheilija_id < u.urheilija_id
+        """
+        if sukupuoli in ['M', 'N']:
+            sql += " AND d.sukupuoli = %s"
+            params.append(sukupuoli)
+        sql += ")"
+
+        avain = "(TRIM(u.sukunimi), TRIM(u.etunimi), u.urheilija_id)"
+        kursori = """(SELECT TRIM(sukunimi), TRIM(etunimi), urheilija_id
+                      FROM Urheilijat WHERE urheilija_id = %s)"""
+        if ennen is not None:
+            # Edellinen sivu haetaan käänteisessä järjestyksessä ja käännetään takaisin
+            sql += f" AND {avain} < {kursori} ORDER BY TRIM(u.sukunimi) DESC, TRIM(u.etunimi) DESC, u.urheilija_id DESC"
+            params.append(ennen)
+        else:
+            if jalkeen is not None:
+                sql += f" AND {avain} > {kursori}"
+                params.append(jalkeen)
+            sql += " ORDER BY TRIM(u.sukunimi), TRIM(u.etunimi), u.urheilija_id"
+
+        # Haetaan yksi ylimääräinen rivi, jotta tiedetään jatkuuko lista
+        sql += " LIMIT %s"
+        params.append(sivukoko + 1)
 
         c.execute(sql, params)
-        kaikki_urheilijat = c.fetchall()
-
-        unique_urheilijat = {}
-        for urheilija in kaikki_urheilijat:
-            avain = f"{urheilija[1].lower()}-{urheilija[2].lower()}-{urheilija[4]}"
-            if avain not in unique_urheilijat:
-                unique_urheilijat[avain] = {
-                    'urheilija_id': urheilija[0],
-                    'etunimi': urheilija[1],
-                    'sukunimi': urheilija[2],
-                    'sukupuoli': urheilija[3],
-                    'syntymavuosi': urheilija[4]
-                }
-
-        urheilijat = sorted(unique_urheilijat.values(), 
-                           key=lambda x: (x['sukunimi'], x['etunimi']))
-
-        if ika_min is not None or ika_max is not None:
-            filtered_urheilijat = []
-            for urheilija in urheilijat:
-                if urheilija['syntymavuosi']:
-                    ika = current_year - urheilija['syntymavuosi']
-                    if ((ika_min is None or ika >= ika_min) and 
-                        (ika_max is None or ika <= ika_max)):
-                        filtered_urheilijat.append(urheilija)
-            urheilijat = filtered_urheilijat
-
-        conn.close()
+        rivit = c.fetchall()
+        lisaa = len(rivit) > sivukoko
+        rivit = rivit[:sivukoko]
+        if ennen is not None:
+            rivit.reverse()
+
+        urheilijat = []
+        for urheilija in rivit:
+            urheilijat.append({
+                'urheilija_id': urheilija[0],
+                'etunimi': urheilija[1],
+                'sukunimi': urheilija[2],
+                'sukupuoli': urheilija[3],
+                'syntymavuosi': urheilija[4]
+            })
+
+        # Sivutuslinkit säilyttävät suodattimet
+        suodattimet = {'sukupuoli': sukupuoli or None, 'ika_min': ika_min, 'ika_max': ika_max,
+                       'sivukoko': sivukoko if sivukoko != URHEILIJAT_SIVULLA else None}
+        suodattimet = {k: v for k, v in suodattimet.items() if v is not None}
+
+        edellinen = None
+        seuraava = None
+        if urheilijat:
+            if (ennen is not None and lisaa) or (ennen is None and jalkeen is not None):
+                edellinen = dict(suodattimet, ennen=urheilijat[0]['urheilija_id'])
+            if (ennen is None and lisaa) or ennen is not None:
+                seuraava = dict(suodattimet, jalkeen=urheilijat[-1]['urheilija_id'])
 
         return render_template('urheilijat.html', 
                             urheilijat=urheilijat,
                             sukupuoli=sukupuoli,
                             ika_min=ika_min,
-                            ika_max=ika_max)
+                            ika_max=ika_max,
+                            sivukoko=sivukoko,
+                            edellinen=edellinen,
+                            seuraava=seuraava,
+                            suodattimet=suodattimet)
     except Exception as e:
         app.logger.error(f"Urheilijoiden hakuvirhe: {str(e)}")
         return render_template('error.html', message='Tietokantavirhe'), 500
 
 @app.route('/lajit')
+@valimuistissa(max_age=3600)
 def listaa_lajit():
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-
-        c.execute("""
-            SELECT DISTINCT lajin_nimi 
-            FROM Lajit
-            ORDER BY lajin_nimi
-        """)
-        lajit_results = c.fetchall()
-        lajit = [r[0] for r in lajit_results]
-
-        conn.close()
-
-        return render_template('lajit.html', lajit=lajit)
+        return render_template('lajit.html', lajit=hae_dimensio('lajit'))
     except Exception as e:
         app.logger.error(f"Lajien hakuvirhe: {str(e)}")
         return render_template('error.html', message='Tietokantavirhe'), 500
@@ -590,9 +860,8 @@ if __name__ == '__main__':
         exit(1)
 
     try:
-        conn = get_db_connection()
-        print("Tietokantayhteys toimii!")
-        conn.close()
+        with pooli.yhteys():
+            print("Tietokantayhteys toimii!")
     except Exception as e:
         print(f"Tietokantayhteys epäonnistui: {e}")
         print("Sovellus käynnistyy ilman tietokantayhteyttä")
@@ -3,8 +3,11 @@ import psycopg2
 import subprocess
 import os
 import time
+import json
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor
+from tietokanta import kasvata_datasukupolvi
+from api_asiakas import asiakas
 
 # Asetukset
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -77,6 +80,7 @@ def update_last_updated(event_id):
             SET last_updated = CURRENT_TIMESTAMP 
             WHERE kilpailu_id = %s
         """, (event_id,))
+        kasvata_datasukupolvi(cursor)
         
         conn.commit()
         log_message(f"Päivitetty last_updated kilpailulle {event_id}", "DEBUG")
@@ -90,9 +94,8 @@ def fetch_events():
     """Hakee tapahtumat rajapinnasta"""
     try:
         log_message("Haetaan tapahtumia rajapinnasta...")
-        response = requests.get("https://cached-public-api.tuloslista.com/live/v1/competition", timeout=15)
-        response.raise_for_status()
-        events = response.json()
+        # Lista tarkistetaan ehdollisella pyynnöllä, jos palvelin antaa ETag- tai Last-Modified-tunnisteen
+        events = json.loads(asiakas.hae_sisalto("/competition", timeout=15))
         log_message(f"Haettu {len(events)} tapahtumaa rajapinnasta")
         return events
     except requests.RequestException as e:
@@ -239,6 +242,8 @@ def main():
         log_message("Aloitetaan ikälaskurin suoritus")
         run_ikalaskuri()
         
+        asiakas.tulosta_tilastot(log_message)
+        
     except Exception as e:
         log_message(f"Kriittinen virhe pääfunktiossa: {str(e)}", "CRITICAL")
         raise
@@ -0,0 +1,24 @@
+import os
+
+# Gunicornin asetukset: gunicorn -c gunicorn.conf.py app:app
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+worker_class = 'gthread'
+timeout = 30
+
+# Worker kierrätetään muistinkäytön hillitsemiseksi; lämmityksen kesto näkyy /tilastot-sivulla
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 50))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 20))
+
+# Sovellus importataan kerran masterissa, jolloin uusi worker käynnistyy haarautumalla
+preload_app = True
+
+def post_fork(server, worker):
+    """Lämmittää uuden workerin ennen kuin se alkaa ottaa pyyntöjä"""
+    from app import lammita
+
+    tiedot = lammita()
+    worker.log.info(f"Worker {worker.pid} lämmitetty {tiedot['kesto_s']} s:ssa "
+                    f"({tiedot['sivuja']} sivua, {tiedot['virheita']} virhettä, "
+                    f"{tiedot['ohitettuja']} ohitettu)")
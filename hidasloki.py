@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import psycopg2
+from flask import has_request_context, request
+
+# Hitaiden kyselyjen loki
+HIDAS_KYSELY_MS = float(os.environ.get('HIDAS_KYSELY_MS', 500))  # tätä hitaammat kirjataan, 0 = ei kirjausta
+HIDAS_EXPLAIN_OSUUS = float(os.environ.get('HIDAS_EXPLAIN_OSUUS', 0.2))  # osuus, jolle ajetaan EXPLAIN ANALYZE
+HIDAS_LOKI = os.environ.get('HIDAS_LOKI', 'data/hitaat_kyselyt.log')
+HIDAS_LOKI_MT = float(os.environ.get('HIDAS_LOKI_MT', 5))  # yhden lokitiedoston koko ennen kierrätystä
+HIDAS_LOKI_TIEDOSTOJA = 3  # vanhoja lokitiedostoja säilytetään
+
+KYNNYS_S = HIDAS_KYSELY_MS / 1000 if HIDAS_KYSELY_MS > 0 else float('inf')
+
+# EXPLAIN ANALYZE suorittaa kyselyn uudelleen, joten vain lukukyselyt kelpaavat
+EXPLAIN_AIKARAJA_MS = 30000
+EXPLAIN_JONO = 5  # jonon ollessa täynnä uudet näytteet ohitetaan
+
+_loki = None
+_jono = None
+_saie_pid = None
+_dsn = None
+_lukko = threading.Lock()
+
+
+def alusta(dsn, **connect_kwargs):
+    """Asettaa EXPLAIN-yhteyden osoitteen (erillinen yhteys, ei poolista)"""
+    global _dsn
+    _dsn = (dsn, connect_kwargs)
+
+def _hae_loki():
+    global _loki
+    if _loki is None:
+        hakemisto = os.path.dirname(HIDAS_LOKI)
+        if hakemisto:
+            os.makedirs(hakemisto, exist_ok=True)
+        loki = logging.getLogger('hitaat_kyselyt')
+        loki.setLevel(logging.INFO)
+        loki.propagate = False
+        kasittelija = RotatingFileHandler(HIDAS_LOKI, maxBytes=int(HIDAS_LOKI_MT * 1024 * 1024),
+                                          backupCount=HIDAS_LOKI_TIEDOSTOJA, encoding='utf-8')
+        kasittelija.setFormatter(logging.Formatter('%(message)s'))
+        loki.addHandler(kasittelija)
+        _loki = loki
+    return _loki
+
+def _kirjoita(tietue):
+    try:
+        _hae_loki().info(json.dumps(tietue, default=str, ensure_ascii=False))
+    except OSError as e:
+        print(f"Hitaan kyselyn kirjaus epäonnistui: {str(e)}")
+
+def _on_lukukysely(sql):
+    alku = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    return alku in ('SELECT', 'WITH')
+
+def _explain_saie(jono):
+    """Ajaa näytteille EXPLAIN (ANALYZE, BUFFERS):n omalla yhteydellään ja kirjaa tuloksen"""
+    conn = None
+    while True:
+        tietue = jono.get()
+        try:
+            if conn is None or conn.closed:
+                dsn, kwargs = _dsn
+                conn = psycopg2.connect(dsn, **kwargs)
+                # Vain lukuoikeus ja aikaraja, ettei analyysi muuta dataa tai jää jumiin
+                conn.set_session(readonly=True)
+            c = conn.cursor()
+            c.execute(f"SET LOCAL statement_timeout = {EXPLAIN_AIKARAJA_MS}")
+            c.execute("EXPLAIN (ANALYZE, BUFFERS) " + tietue['sql'])
+            tietue['explain'] = '\n'.join(rivi[0] for rivi in c.fetchall())
+        except psycopg2.Error as e:
+            tietue['explain_virhe'] = str(e).strip()
+        finally:
+            if conn is not None and not conn.closed:
+                conn.rollback()
+        _kirjoita(tietue)
+
+def _lisaa_jonoon(tietue):
+    global _jono, _saie_pid
+    with _lukko:
+        # Forkin jälkeen säie ei periydy, joten jokainen prosessi käynnistää omansa
+        if _saie_pid != os.getpid():
+            _jono = queue.Queue(maxsize=EXPLAIN_JONO)
+            threading.Thread(target=_explain_saie, args=(_jono,), daemon=True).start()
+            _saie_pid = os.getpid()
+        jono = _jono
+    try:
+        jono.put_nowait(tietue)
+        return True
+    except queue.Full:
+        return False
+
+def kirjaa(kursori, query, vars, kesto):
+    """Kirjaa kynnyksen ylittäneen kyselyn parametreineen, osalle myös suoritussuunnitelman"""
+    try:
+        sql = kursori.mogrify(query, vars).decode('utf-8', errors='replace')
+    except (psycopg2.Error, TypeError, ValueError):
+        sql = query if isinstance(query, str) else str(query)
+
+    tietue = {
+        'aika': datetime.now().isoformat(timespec='seconds'),
+        'reitti': request.endpoint if has_request_context() else None,
+        'polku': request.full_path if has_request_context() else None,
+        'kesto_ms': round(kesto * 1000, 1),
+        'sql': sql,
+        'parametrit': vars
+    }
+
+    if (_dsn is not None and _on_lukukysely(sql) and random.random() < HIDAS_EXPLAIN_OSUUS
+            and _lisaa_jonoon(tietue)):
+        return
+    _kirjoita(tietue)
+
+def lue(maara=100):
+    """Palauttaa uusimmat kirjaukset uusimmasta vanhimpaan kaikista lokitiedostoista"""
+    tietueet = []
+    tiedostot = [HIDAS_LOKI] + [f"{HIDAS_LOKI}.{i}" for i in range(1, HIDAS_LOKI_TIEDOSTOJA + 1)]
+    for tiedosto in tiedostot:
+        if not os.path.isfile(tiedosto):
+            continue
+        with open(tiedosto, encoding='utf-8') as f:
+            rivit = f.readlines()
+        for rivi in reversed(rivit):
+            try:
+                tietueet.append(json.loads(rivi))
+            except ValueError:
+                continue
+            if len(tietueet) >= maara:
+                return tietueet
+    return tietueet
@@ -5,6 +5,7 @@ from collections import defaultdict
 import logging
 import os
 from psycopg2.extras import DictCursor
+from tietokanta import kasvata_datasukupolvi
 
 # Logituksen asetukset
 logging.basicConfig(
@@ -235,6 +236,7 @@ def update_athlete_info(urheilija_id, syntymavuosi=None, sukupuoli=None):
             params.append(urheilija_id)
             query = f"UPDATE Urheilijat SET {', '.join(updates)} WHERE urheilija_id = %s"
             cursor.execute(query, params)
+            kasvata_datasukupolvi(cursor)
             conn.commit()
             logger.info(f"Päivitetty urheilija {urheilija_id}")
             return True
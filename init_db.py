@@ -1,7 +1,223 @@
 # init_db.py
 import psycopg2
 from urllib.parse import urlparse
+import argparse
 import os
+from normalisointi import tayta_tulosarvot, tayta_lajiluettelo, normalisoi_nimi, HAKU_KIRJAIMET, HAKU_KORVAAVAT
+from tulosten_haku import rebuild_personal_bests
+
+# Johdetut taulut ja indeksit. Lauseet ovat idempotentteja, joten ne ajetaan
+# sekä alustuksessa että olemassa olevan kannan migraatiossa (--migroi).
+SKEEMAMUUTOKSET = [
+    """
+        CREATE INDEX IF NOT EXISTS idx_tulokset_kilpailu ON Tulokset (kilpailu_id)
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_kilpailut_alkupvm ON Kilpailut (alkupvm)
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS KilpailuYhteenveto (
+            kilpailu_id INTEGER PRIMARY KEY REFERENCES Kilpailut(kilpailu_id) ON DELETE CASCADE,
+            kilpailun_nimi VARCHAR(255) NOT NULL,
+            alkupvm DATE,
+            lajeja INTEGER NOT NULL DEFAULT 0,
+            tuloksia INTEGER NOT NULL DEFAULT 0,
+            urheilijoita INTEGER NOT NULL DEFAULT 0,
+            paivitetty TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    """
+        DO $$ BEGIN
+            CREATE TYPE tulostila AS ENUM ('OK', 'DNS', 'DNF', 'DQ', 'NM', 'TUNTEMATON');
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$
+    """,
+    # Tunnistamaton tulosmerkintä; ilman omaa tilaa rivi jäisi NULLiksi ja luettaisiin
+    # uudelleen jokaisessa tulosarvojen täytössä
+    """
+        ALTER TYPE tulostila ADD VALUE IF NOT EXISTS 'TUNTEMATON'
+    """,
+    """
+        ALTER TABLE Tulokset
+            ADD COLUMN IF NOT EXISTS tulos_arvo NUMERIC(12,3),
+            ADD COLUMN IF NOT EXISTS tulos_tila tulostila
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_tulokset_laji_arvo
+        ON Tulokset (laji_id, tulos_arvo)
+        WHERE tulos_tila = 'OK'
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_tulokset_urheilija ON Tulokset (urheilija_id)
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS Lajiluettelo (
+            luettelo_id SERIAL PRIMARY KEY,
+            nimi VARCHAR(255) NOT NULL UNIQUE,
+            mittaustyyppi VARCHAR(20) NOT NULL,
+            parempi VARCHAR(10) NOT NULL CHECK (parempi IN ('pienempi', 'suurempi')),
+            yksikko VARCHAR(10) NOT NULL
+        )
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_lajiluettelo_nimi_lower ON Lajiluettelo (LOWER(nimi))
+    """,
+    """
+        ALTER TABLE Lajit
+            ADD COLUMN IF NOT EXISTS luettelo_id INTEGER REFERENCES Lajiluettelo(luettelo_id)
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_lajit_luettelo ON Lajit (luettelo_id)
+    """,
+    """
+        DO $$ BEGIN
+            -- Ennatykset oli aiemmin avattu lajin nimellä; johdettu taulu luodaan uudelleen
+            IF EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'ennatykset' AND column_name = 'laji') THEN
+                DROP TABLE Ennatykset;
+            END IF;
+        END $$
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS Ennatykset (
+            urheilija_id INTEGER NOT NULL REFERENCES Urheilijat(urheilija_id) ON DELETE CASCADE,
+            luettelo_id INTEGER NOT NULL REFERENCES Lajiluettelo(luettelo_id),
+            kausi INTEGER NOT NULL,
+            vertailuarvo NUMERIC(12,3) NOT NULL,
+            tulos_id INTEGER NOT NULL REFERENCES Tulokset(tulos_id) ON DELETE CASCADE,
+            PRIMARY KEY (urheilija_id, luettelo_id, kausi)
+        )
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_ennatykset_laji_kausi
+        ON Ennatykset (luettelo_id, kausi, vertailuarvo)
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_ennatykset_laji
+        ON Ennatykset (luettelo_id, vertailuarvo)
+    """,
+    # Nimihaun hakumuoto; sama muunnos kuin normalisointi.normalisoi_nimi.
+    # Jos muunnosta muutetaan, --migroi laskee vanhentuneet hakunimet uudelleen (TAYTOT).
+    f"""
+        CREATE OR REPLACE FUNCTION hakumuoto(teksti TEXT) RETURNS TEXT
+        LANGUAGE SQL IMMUTABLE PARALLEL SAFE AS $$
+            SELECT btrim(regexp_replace(
+                translate(lower(teksti), '{HAKU_KIRJAIMET}', '{HAKU_KORVAAVAT}'),
+                '[[:space:]]+', ' ', 'g'))
+        $$
+    """,
+    """
+        ALTER TABLE Urheilijat
+            ADD COLUMN IF NOT EXISTS hakunimi TEXT
+                GENERATED ALWAYS AS (hakumuoto(etunimi || ' ' || sukunimi)) STORED,
+            ADD COLUMN IF NOT EXISTS hakunimi_kaanteinen TEXT
+                GENERATED ALWAYS AS (hakumuoto(sukunimi || ' ' || etunimi)) STORED
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_urheilijat_hakunimi
+        ON Urheilijat (hakunimi text_pattern_ops)
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_urheilijat_hakunimi_kaanteinen
+        ON Urheilijat (hakunimi_kaanteinen text_pattern_ops)
+    """,
+    # Trigrammi-indeksi osamerkkijono- ja samankaltaisuushakuun, jos pg_trgm on saatavilla
+    """
+        DO $$ BEGIN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            CREATE INDEX IF NOT EXISTS idx_urheilijat_hakunimi_trgm
+            ON Urheilijat USING gin (hakunimi gin_trgm_ops);
+        EXCEPTION WHEN OTHERS THEN
+            RAISE NOTICE 'pg_trgm ei ole käytettävissä, nimihaku käyttää alkuosahakua';
+        END $$
+    """,
+    # Urheilijalistauksen sivutusjärjestys ja duplikaattien tunnistus
+    """
+        CREATE INDEX IF NOT EXISTS idx_urheilijat_listaus
+        ON Urheilijat (TRIM(sukunimi), TRIM(etunimi), urheilija_id)
+        WHERE sukupuoli IS NOT NULL AND syntymavuosi IS NOT NULL
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_urheilijat_tunniste
+        ON Urheilijat (LOWER(TRIM(sukunimi)), LOWER(TRIM(etunimi)), syntymavuosi)
+    """,
+    # Datasukupolvi kasvaa jokaisessa datamuutoksessa, sivuvälimuisti tunnistaa sillä vanhat sivut
+    """
+        CREATE TABLE IF NOT EXISTS Datasukupolvi (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            sukupolvi BIGINT NOT NULL DEFAULT 0,
+            paivitetty TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    """
+        INSERT INTO Datasukupolvi (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING
+    """,
+    """
+        CREATE INDEX IF NOT EXISTS idx_kilpailuyhteenveto_pvm
+        ON KilpailuYhteenveto ((COALESCE(alkupvm, DATE '0001-01-01')) DESC, kilpailu_id DESC)
+        WHERE tuloksia > 0
+    """,
+    # Ajastimen (ajastin.py) päivitysajon tila, jonka kaikki web-prosessit lukevat
+    """
+        CREATE TABLE IF NOT EXISTS Paivitystila (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            tila VARCHAR(20) NOT NULL DEFAULT 'odottaa',
+            viesti TEXT,
+            ajaja VARCHAR(255),
+            aloitettu TIMESTAMP,
+            valmistunut TIMESTAMP,
+            pyydetty TIMESTAMP
+        )
+    """,
+    """
+        INSERT INTO Paivitystila (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING
+    """,
+    # Ajastimen elonmerkki, jonka se kirjaa joka kierroksella (/tilastot, /metrics)
+    """
+        ALTER TABLE Paivitystila ADD COLUMN IF NOT EXISTS syke TIMESTAMP
+    """,
+]
+
+# Johdettujen taulujen täyttö olemassa olevasta datasta
+TAYTOT = [
+    """
+        INSERT INTO KilpailuYhteenveto
+            (kilpailu_id, kilpailun_nimi, alkupvm, lajeja, tuloksia, urheilijoita, paivitetty)
+        SELECT k.kilpailu_id, k.kilpailun_nimi, k.alkupvm,
+               COUNT(DISTINCT t.laji_id), COUNT(t.tulos_id), COUNT(DISTINCT t.urheilija_id), NOW()
+        FROM Kilpailut k
+        LEFT JOIN Tulokset t ON t.kilpailu_id = k.kilpailu_id
+        GROUP BY k.kilpailu_id
+        ON CONFLICT (kilpailu_id) DO UPDATE SET
+            kilpailun_nimi = EXCLUDED.kilpailun_nimi,
+            alkupvm = EXCLUDED.alkupvm,
+            lajeja = EXCLUDED.lajeja,
+            tuloksia = EXCLUDED.tuloksia,
+            urheilijoita = EXCLUDED.urheilijoita,
+            paivitetty = EXCLUDED.paivitetty
+    """,
+    # Generoidut sarakkeet lasketaan uudelleen päivityksessä; vain muuttuneet rivit
+    """
+        UPDATE Urheilijat SET etunimi = etunimi
+        WHERE hakunimi IS DISTINCT FROM hakumuoto(etunimi || ' ' || sukunimi)
+        OR hakunimi_kaanteinen IS DISTINCT FROM hakumuoto(sukunimi || ' ' || etunimi)
+    """,
+]
+
+# Nimiä, joilla kannan hakumuoto() verrataan normalisoi_nimi-funktioon
+HAKUMUOTO_TARKISTUS = ['Äijälä Örjan', 'Åström Åsa', 'ÖSTERBERG ÄKE', 'Émilie  Çelik-Šuvalov', 'Anna-Liisa Mäkelä']
+
+def tarkista_hakumuoto(cursor):
+    """Varmistaa, että kannan hakumuoto() antaa saman tuloksen kuin normalisoi_nimi
+
+    Vertailu tehdään myös C-lajittelulla, jossa lower() ei muunna ääkkösiä.
+    """
+    for nimi in HAKUMUOTO_TARKISTUS:
+        cursor.execute('SELECT hakumuoto(%s), hakumuoto(%s COLLATE "C")', (nimi, nimi))
+        odotettu = normalisoi_nimi(nimi)
+        for saatu in cursor.fetchone():
+            if saatu != odotettu:
+                raise Exception(f"hakumuoto('{nimi}') = '{saatu}', odotettiin '{odotettu}'")
 
 def get_connection():
     """Luo PostgreSQL-yhteys"""
@@ -28,11 +244,17 @@ def init_database():
     
     try:
         # Poista vanhat taulut jos ovat olemassa (varalta)
+        cursor.execute("DROP TABLE IF EXISTS Ennatykset CASCADE")
+        cursor.execute("DROP TABLE IF EXISTS Datasukupolvi CASCADE")
+        cursor.execute("DROP TABLE IF EXISTS Paivitystila CASCADE")
+        cursor.execute("DROP TABLE IF EXISTS KilpailuYhteenveto CASCADE")
+        cursor.execute("DROP TABLE IF EXISTS Lajiluettelo CASCADE")
         cursor.execute("DROP TABLE IF EXISTS Tulokset CASCADE")
         cursor.execute("DROP TABLE IF EXISTS Lajit CASCADE")
         cursor.execute("DROP TABLE IF EXISTS Urheilijat CASCADE")
         cursor.execute("DROP TABLE IF EXISTS Seurat CASCADE")
         cursor.execute("DROP TABLE IF EXISTS Kilpailut CASCADE")
+        cursor.execute("DROP TYPE IF EXISTS tulostila CASCADE")
         
         # Luodaan taulut SQLiten mukaisilla sarakenimillä
         cursor.execute("""
@@ -94,6 +316,10 @@ def init_database():
             )
         """)
         
+        for lause in SKEEMAMUUTOKSET:
+            cursor.execute(lause)
+        tarkista_hakumuoto(cursor)
+        
         conn.commit()
         print("Tietokantataulut luotu onnistuneesti oikeilla sarakenimillä ja uniikkirajoitteilla!")
         
@@ -105,5 +331,42 @@ def init_database():
         cursor.close()
         conn.close()
 
+def migrate_database():
+    """Lisää puuttuvat johdetut taulut ja indeksit olemassa olevaan kantaan ja täyttää ne"""
+    print("Päivitetään tietokannan skeema...")
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        for lause in SKEEMAMUUTOKSET:
+            cursor.execute(lause)
+        tarkista_hakumuoto(cursor)
+        for lause in TAYTOT:
+            cursor.execute(lause)
+        conn.commit()
+        
+        # Normalisoidut tulosarvot lasketaan Pythonissa samalla funktiolla kuin tuonnissa
+        tayta_tulosarvot(conn)
+        tayta_lajiluettelo(conn)
+        rebuild_personal_bests(conn)
+        print("Skeema päivitetty ja johdetut taulut täytetty!")
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Virhe skeeman päivityksessä: {e}")
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
 if __name__ == "__main__":
-    init_database()
+    parser = argparse.ArgumentParser(description='Alusta tai päivitä tietokanta')
+    parser.add_argument('--migroi', action='store_true',
+                        help='Päivitä olemassa oleva kanta poistamatta tietoja')
+    args = parser.parse_args()
+    
+    if args.migroi:
+        migrate_database()
+    else:
+        init_database()
@@ -0,0 +1,199 @@
+from normalisointi import normalisoi_nimi
+
+# Nimihaussa tuloksineen näytettävien urheilijoiden enimmäismäärä
+NIMIHAKU_URHEILIJOITA = 50
+
+# Onko pg_trgm asennettu kantaan (tarkistetaan ensimmäisessä nimihaussa)
+trigrammihaku = None
+
+# Ennatykset-taulun kausi, jolla on urheilijan kaikkien aikojen paras (0 = tuntematon kausi)
+KAIKKI_KAUDET = -1
+
+# Kilpailun päivämäärä järjestystä varten; tuntematon päivä lajitellaan vanhimmaksi
+KILPAILUN_PVM = "COALESCE(alkupvm, DATE '0001-01-01')"
+
+def kilpailut_sql(maara, ennen=None):
+    """Kilpailut uusimmasta vanhimpaan, ennen = edellisen sivun viimeinen (pvm, id)"""
+    # Yhteenvetotaulussa on vain kilpailutason luvut, joten tulostaulua ei tarvitse lukea
+    sql = """
+        SELECT kilpailu_id, kilpailun_nimi, alkupvm, lajeja, tuloksia, urheilijoita
+        FROM KilpailuYhteenveto
+        WHERE tuloksia > 0
+    """
+    params = []
+
+    if ennen:
+        sql += f" AND ({KILPAILUN_PVM}, kilpailu_id) < (%s, %s)"
+        params.extend(ennen)
+
+    sql += f" ORDER BY {KILPAILUN_PVM} DESC, kilpailu_id DESC LIMIT %s"
+    params.append(maara)
+    return sql, params
+
+def hae_laji(c, laji_id=None, nimi=None):
+    """Hakee lajin lajiluettelosta id:llä tai tarkalla nimellä, palauttaa (id, nimi) tai None"""
+    if laji_id is not None:
+        c.execute("SELECT luettelo_id, nimi FROM Lajiluettelo WHERE luettelo_id = %s", (laji_id,))
+    else:
+        c.execute("""
+            SELECT luettelo_id, nimi FROM Lajiluettelo
+            WHERE LOWER(nimi) = LOWER(%s)
+            ORDER BY luettelo_id
+            LIMIT 1
+        """, (nimi,))
+    return c.fetchone()
+
+def lajin_parhaat_sql(laji_id, sukupuoli=None, vuosi=None, ika_min=None, ika_max=None,
+                      maara=50, jalkeen=None):
+    """Lajin parhaat urheilijoittain, jalkeen = edellisen sivun viimeinen (vertailuarvo, id)"""
+    # Parhaat luetaan Ennatykset-taulusta, jossa on jokaisen urheilijan kauden paras
+    # tulos lajeittain sekä kaikkien aikojen paras (kausi KAIKKI_KAUDET). Vertailuarvossa
+    # pienin on aina paras lajin suunnasta riippumatta.
+    #
+    # Yhdeltä kaudelta (tai kaikkien aikojen riveiltä) urheilijalla on yksi rivi, joten
+    # sivu luetaan suoraan (luettelo_id, kausi, vertailuarvo)-indeksin järjestyksessä.
+    # Vain ikärajaus ilman vuotta vaatii urheilijan parhaan etsimisen kausien yli.
+    yksi_kausi = vuosi is not None or (ika_min is None and ika_max is None)
+
+    sql = """
+        WITH Parhaat AS (
+            SELECT {distinct}
+                e.urheilija_id,
+                e.tulos_id,
+                e.vertailuarvo
+            FROM Ennatykset e
+            JOIN Urheilijat u ON u.urheilija_id = e.urheilija_id
+            WHERE e.luettelo_id = %s
+    """.format(distinct='' if yksi_kausi else 'DISTINCT ON (e.urheilija_id)')
+    params = [laji_id]
+
+    if sukupuoli in ['M', 'N']:
+        sql += " AND u.sukupuoli = %s"
+        params.append(sukupuoli)
+
+    if yksi_kausi:
+        sql += " AND e.kausi = %s"
+        params.append(vuosi if vuosi is not None else KAIKKI_KAUDET)
+
+    if ika_min is not None or ika_max is not None:
+        # Kausi 0 tarkoittaa tuntematonta kilpailupäivää
+        sql += " AND e.kausi > 0 AND u.syntymavuosi IS NOT NULL"
+
+        if ika_min is not None and ika_max is not None:
+            sql += " AND (e.kausi - u.syntymavuosi BETWEEN %s AND %s)"
+            params.extend([ika_min, ika_max])
+        elif ika_min is not None:
+            sql += " AND (e.kausi - u.syntymavuosi >= %s)"
+            params.append(ika_min)
+        elif ika_max is not None:
+            sql += " AND (e.kausi - u.syntymavuosi <= %s)"
+            params.append(ika_max)
+
+    if yksi_kausi:
+        if jalkeen:
+            sql += " AND (e.vertailuarvo, e.urheilija_id) > (%s, %s)"
+            params.extend(jalkeen)
+        sql += " ORDER BY e.vertailuarvo, e.urheilija_id LIMIT %s"
+        params.append(maara)
+    else:
+        # Tasatuloksista aikaisin kausi, kuten kaikkien aikojen riveillä
+        sql += " ORDER BY e.urheilija_id, e.vertailuarvo, e.kausi, e.tulos_id"
+
+    sql += """
+        )
+        SELECT
+            u.etunimi,
+            u.sukunimi,
+            COALESCE(s.seura_nimi, '-') as seura,
+            COALESCE(CAST(t.tulos AS TEXT), t.lisatiedot) as tulos,
+            k.kilpailun_nimi,
+            k.alkupvm,
+            u.syntymavuosi,
+            u.sukupuoli,
+            t.sijoitus,
+            p.urheilija_id,
+            p.vertailuarvo,
+            k.kilpailu_id
+        FROM Parhaat p
+        JOIN Tulokset t ON t.tulos_id = p.tulos_id
+        JOIN Urheilijat u ON u.urheilija_id = p.urheilija_id
+        LEFT JOIN Seurat s ON u.seura_id = s.seura_id
+        JOIN Kilpailut k ON k.kilpailu_id = t.kilpailu_id
+    """
+
+    if jalkeen and not yksi_kausi:
+        sql += " WHERE (p.vertailuarvo, p.urheilija_id) > (%s, %s)"
+        params.extend(jalkeen)
+
+    sql += " ORDER BY p.vertailuarvo, p.urheilija_id LIMIT %s"
+    params.append(maara)
+    return sql, params
+
+def hae_urheilija_idt(c, nimi, sukupuoli=None):
+    """Hakee nimeä vastaavat urheilijat hakunimi-indeksistä osuvimmat ensin
+
+    Ilman pg_trgm:ää haetaan nimen alkuosalla (etunimi sukunimi tai sukunimi etunimi),
+    trigrammeilla myös osamerkkijonolla ja samankaltaisuudella.
+    """
+    global trigrammihaku
+    if trigrammihaku is None:
+        c.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        trigrammihaku = c.fetchone()[0]
+
+    haku = normalisoi_nimi(nimi)
+    suojattu = haku.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    params = {'haku': haku, 'alku': suojattu + '%', 'osa': '%' + suojattu + '%',
+              'sukupuoli': sukupuoli, 'maara': NIMIHAKU_URHEILIJOITA}
+
+    if trigrammihaku:
+        ehto = "(hakunimi LIKE %(osa)s OR hakunimi_kaanteinen LIKE %(alku)s OR hakunimi %% %(haku)s)"
+        osuvuus = "similarity(hakunimi, %(haku)s) DESC"
+    else:
+        ehto = "(hakunimi LIKE %(alku)s OR hakunimi_kaanteinen LIKE %(alku)s)"
+        osuvuus = "length(hakunimi)"
+
+    sql = f"""
+        SELECT urheilija_id
+        FROM Urheilijat
+        WHERE {ehto}
+    """
+    if sukupuoli:
+        sql += " AND sukupuoli = %(sukupuoli)s"
+    sql += f"""
+        ORDER BY (hakunimi = %(haku)s OR hakunimi_kaanteinen = %(haku)s) DESC,
+                 {osuvuus}, sukunimi, etunimi
+        LIMIT %(maara)s
+    """
+
+    c.execute(sql, params)
+    return [r[0] for r in c.fetchall()]
+
+def urheilijan_tulokset_sql(urheilija_idt, ika_min=None, ika_max=None):
+    """Urheilijoiden tulokset ilman järjestystä; kutsuja lisää ehdot ja ORDER BY:n"""
+    sql = """
+        SELECT l.lajin_nimi, l.sarja, k.kilpailun_nimi, k.alkupvm,
+               COALESCE(CAST(t.tulos AS TEXT), t.lisatiedot) as tulos,
+               t.sijoitus, u.syntymavuosi, u.sukupuoli,
+               u.urheilija_id, u.etunimi, u.sukunimi, k.kilpailu_id, t.tulos_id
+        FROM Tulokset t
+        JOIN Urheilijat u ON t.urheilija_id = u.urheilija_id
+        JOIN Lajit l ON t.laji_id = l.laji_id AND t.kilpailu_id = l.kilpailu_id
+        JOIN Kilpailut k ON l.kilpailu_id = k.kilpailu_id
+        WHERE t.urheilija_id = ANY(%s)
+    """
+    params = [urheilija_idt]
+
+    if ika_min is not None or ika_max is not None:
+        sql += " AND k.alkupvm IS NOT NULL AND u.syntymavuosi IS NOT NULL"
+
+        if ika_min is not None and ika_max is not None:
+            sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi BETWEEN %s AND %s)"
+            params.extend([ika_min, ika_max])
+        elif ika_min is not None:
+            sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi >= %s)"
+            params.append(ika_min)
+        elif ika_max is not None:
+            sql += " AND (EXTRACT(YEAR FROM k.alkupvm) - u.syntymavuosi <= %s)"
+            params.append(ika_max)
+
+    return sql, params
@@ -6,6 +6,7 @@ from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 import requests
 import sys
+from api_asiakas import asiakas
 
 #sovellus kauhoo oletettuja tapahtuma id numeroita käyttäjän rajaamalta alueelta
 
@@ -20,10 +21,7 @@ def tarkista_tapahtuma_id(tapahtuma_id):
     """Tarkistaa onko tapahtuma jo käsitelty tai onko se olemassa"""
     # Tarkista ensin API:sta onko tapahtuma olemassa
     try:
-        response = requests.get(
-            f"https://cached-public-api.tuloslista.com/live/v1/competition/{tapahtuma_id}/properties",
-            timeout=5
-        )
+        response = asiakas.get(f"/competition/{tapahtuma_id}/properties", timeout=5)
         if response.status_code == 404:
             return False  # Tapahtumaa ei ole olemassa
     except requests.RequestException:
@@ -153,6 +151,7 @@ def main():
             time.sleep(0.3)  # 300ms viive kutsujen välissä
 
     print("\nKaikki tapahtumat käsitelty")
+    asiakas.tulosta_tilastot()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+import threading
+import time
+
+from flask import g, has_request_context, request, template_rendered, before_render_template
+from psycopg2 import extensions
+
+import hidasloki
+
+# Histogrammien rajat (s); viimeisen jälkeen tulee aina +Inf
+KESTO_RAJAT = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAUSE_RAJAT = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Prometheus-tekstimuodon sisältötyyppi
+METRIIKKA_TYYPPI = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _nimiot(nimet, arvot):
+    if not nimet:
+        return ''
+    osat = []
+    for nimi, arvo in zip(nimet, arvot):
+        arvo = str(arvo).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        osat.append(f'{nimi}="{arvo}"')
+    return '{' + ','.join(osat) + '}'
+
+
+class Laskuri:
+    """Kasvava laskuri nimiöittäin"""
+
+    tyyppi = 'counter'
+
+    def __init__(self, nimi, kuvaus, nimiot=()):
+        self.nimi = nimi
+        self.kuvaus = kuvaus
+        self.nimiot = tuple(nimiot)
+        self._arvot = {}
+        self._lukko = threading.Lock()
+
+    def kasvata(self, *nimiot, maara=1):
+        with self._lukko:
+            self._arvot[nimiot] = self._arvot.get(nimiot, 0) + maara
+
+    def rivit(self):
+        with self._lukko:
+            arvot = sorted(self._arvot.items())
+        for nimiot, arvo in arvot:
+            yield f"{self.nimi}{_nimiot(self.nimiot, nimiot)} {arvo}"
+
+
+class Histogrammi:
+    """Kumulatiivinen histogrammi nimiöittäin (Prometheus-histogrammi)"""
+
+    tyyppi = 'histogram'
+
+    def __init__(self, nimi, kuvaus, nimiot=(), rajat=KESTO_RAJAT):
+        self.nimi = nimi
+        self.kuvaus = kuvaus
+        self.nimiot = tuple(nimiot)
+        self.rajat = tuple(rajat)
+        # nimiöt -> [lokeroiden määrät, summa, määrä]
+        self._sarjat = {}
+        self._lukko = threading.Lock()
+
+    def havainto(self, arvo, *nimiot):
+        # Lokero etsitään ennen lukkoa; rajoja on vähän, joten lineaarinen haku riittää
+        lokero = len(self.rajat)
+        for i, raja in enumerate(self.rajat):
+            if arvo <= raja:
+                lokero = i
+                break
+        with self._lukko:
+            sarja = self._sarjat.get(nimiot)
+            if sarja is None:
+                sarja = self._sarjat[nimiot] = [[0] * (len(self.rajat) + 1), 0.0, 0]
+            sarja[0][lokero] += 1
+            sarja[1] += arvo
+            sarja[2] += 1
+
+    def rivit(self):
+        with self._lukko:
+            sarjat = sorted((nimiot, (list(s[0]), s[1], s[2])) for nimiot, s in self._sarjat.items())
+        nimet = self.nimiot + ('le',)
+        for nimiot, (lokerot, summa, maara) in sarjat:
+            kertyma = 0
+            for raja, lukumaara in zip(self.rajat + ('+Inf',), lokerot):
+                kertyma += lukumaara
+                yield f"{self.nimi}_bucket{_nimiot(nimet, nimiot + (raja,))} {kertyma}"
+            yield f"{self.nimi}_sum{_nimiot(self.nimiot, nimiot)} {summa}"
+            yield f"{self.nimi}_count{_nimiot(self.nimiot, nimiot)} {maara}"
+
+
+# Prosessin mittarit; jokainen gunicorn-worker kerää omansa
+pyyntojen_kesto = Histogrammi('http_request_duration_seconds', 'Pyynnön käsittelyaika reiteittäin', ('endpoint',))
+pyynnot = Laskuri('http_requests_total', 'Pyynnöt reiteittäin ja statuksittain', ('endpoint', 'status'))
+sql_lauseet = Histogrammi('db_statements_per_request', 'SQL-lauseiden määrä pyynnössä', ('endpoint',), LAUSE_RAJAT)
+sql_aika = Histogrammi('db_time_per_request_seconds', 'SQL-lauseiden yhteiskesto pyynnössä', ('endpoint',))
+sql_kesto = Histogrammi('db_statement_duration_seconds', 'Yksittäisen SQL-lauseen kesto')
+yhteyden_odotus = Histogrammi('db_pool_acquire_seconds', 'Yhteyden lainaamiseen poolista kulunut aika')
+renderointi = Histogrammi('template_render_seconds', 'Sivupohjan renderöintiaika', ('template',))
+
+MITTARIT = [pyyntojen_kesto, pyynnot, sql_lauseet, sql_aika, sql_kesto, yhteyden_odotus, renderointi]
+
+
+def _kirjaa_sql(kesto):
+    sql_kesto.havainto(kesto)
+    if has_request_context() and 'mittaus_alku' in g:
+        g.sql_lauseita += 1
+        g.sql_aika += kesto
+
+
+class _MittaavaKursori:
+    """Kursorin lisäosa, joka mittaa execute-kutsut ja kirjaa hitaat kyselyt
+
+    Nimetyn (palvelinpuolen) kursorin rivien nouto iteroitaessa ei näy mittauksessa,
+    vain kyselyn avaus.
+    """
+
+    def execute(self, query, vars=None):
+        alku = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            kesto = time.perf_counter() - alku
+            _kirjaa_sql(kesto)
+            if kesto >= hidasloki.KYNNYS_S:
+                hidasloki.kirjaa(self, query, vars, kesto)
+
+    def executemany(self, query, vars_list):
+        alku = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _kirjaa_sql(time.perf_counter() - alku)
+
+
+_kursoriluokat = {}
+
+def _mittaava(luokka):
+    """Palauttaa kursoriluokasta mittaavan aliluokan (luodaan kerran luokkaa kohden)"""
+    mittaava = _kursoriluokat.get(luokka)
+    if mittaava is None:
+        mittaava = type(f"Mittaava{luokka.__name__}", (_MittaavaKursori, luokka), {})
+        _kursoriluokat[luokka] = mittaava
+    return mittaava
+
+
+class MittaavaYhteys(extensions.connection):
+    """Yhteys, jonka kaikki kursorit (myös cursor_factory-kursorit) mittaavat kyselynsä
+
+    Annetaan psycopg2.connectille parametrina connection_factory.
+    """
+
+    def cursor(self, *args, **kwargs):
+        kwargs['cursor_factory'] = _mittaava(kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+
+def _pyynto_alkoi():
+    g.mittaus_alku = time.perf_counter()
+    g.sql_lauseita = 0
+    g.sql_aika = 0.0
+
+def _pyynto_valmis(vastaus):
+    g.mittaus_status = vastaus.status_code
+    return vastaus
+
+def _pyynto_paattyi(virhe):
+    """Kirjataan teardownissa, jotta virtaavan vastauksen kyselyt ehtivät mukaan"""
+    if 'mittaus_alku' not in g:
+        return
+    kesto = time.perf_counter() - g.pop('mittaus_alku')
+    reitti = request.endpoint or 'tuntematon'
+    status = 500 if virhe is not None else g.get('mittaus_status', 500)
+
+    pyyntojen_kesto.havainto(kesto, reitti)
+    pyynnot.kasvata(reitti, str(status))
+    sql_lauseet.havainto(g.sql_lauseita, reitti)
+    sql_aika.havainto(g.sql_aika, reitti)
+
+def _renderointi_alkoi(app, template, context, **extra):
+    g.setdefault('renderoinnit', []).append(time.perf_counter())
+
+def _renderointi_valmis(app, template, context, **extra):
+    alut = g.get('renderoinnit')
+    if alut:
+        renderointi.havainto(time.perf_counter() - alut.pop(), template.name or 'tuntematon')
+
+
+def muotoile(lisarivit=()):
+    """Palauttaa mittarit Prometheus-tekstimuodossa"""
+    rivit = []
+    for mittari in MITTARIT:
+        rivit.append(f"# HELP {mittari.nimi} {mittari.kuvaus}")
+        rivit.append(f"# TYPE {mittari.nimi} {mittari.tyyppi}")
+        rivit.extend(mittari.rivit())
+    rivit.extend(lisarivit)
+    return '\n'.join(rivit) + '\n'
+
+
+def alusta(app):
+    """Kytkee pyyntöjen ja sivupohjien mittauksen sovellukseen"""
+    app.before_request(_pyynto_alkoi)
+    app.after_request(_pyynto_valmis)
+    app.teardown_request(_pyynto_paattyi)
+    before_render_template.connect(_renderointi_alkoi, app)
+    template_rendered.connect(_renderointi_valmis, app)
@@ -0,0 +1,231 @@
+import argparse
+import os
+import re
+import sys
+from decimal import Decimal, InvalidOperation
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# Asetukset
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# Tulosten tilat (vastaavat tietokannan tulostila-enumia)
+TILA_OK = 'OK'
+TILA_DNS = 'DNS'
+TILA_DNF = 'DNF'
+TILA_DQ = 'DQ'
+TILA_NM = 'NM'
+TILA_TUNTEMATON = 'TUNTEMATON'  # merkintää ei tunnistettu; ei ole mukana tilastoissa
+
+# Tulosmerkinnät, jotka eivät ole suorituksia
+TILAMERKINNAT = {
+    'DNS': TILA_DNS,
+    'DNF': TILA_DNF,
+    'DQ': TILA_DQ,
+    'DSQ': TILA_DQ,
+    'NM': TILA_NM,
+    'NH': TILA_NM,
+    'X': TILA_NM,
+    '-': TILA_NM
+}
+
+# Lajiluettelon luokat: (mittaustyyppi, parempi, yksikkö)
+LAJI_AIKA = ('aika', 'pienempi', 's')
+LAJI_MATKA = ('matka', 'suurempi', 'm')
+LAJI_KORKEUS = ('korkeus', 'suurempi', 'm')
+LAJI_PISTEET = ('pisteet', 'suurempi', 'p')
+
+# Lajinimen osat, joiden perusteella laji luokitellaan (tarkistetaan tässä järjestyksessä)
+PISTELAJIT = ['ottelu', 'pisteet']
+KORKEUSLAJIT = ['korkeus', 'seiväs']
+MATKALAJIT = ['pituus', 'loikka', 'kuula', 'kiekko', 'keihäs', 'moukari', 'paino', 'pallo']
+AIKALAJIT = ['kävely', 'aidat', 'esteet', 'viesti', 'juoksu', 'maraton', 'maasto', 'maantie']
+
+# Juoksumatka lajin nimessä, esim. "100m", "60 m aj", "4x100m", "10km"
+JUOKSUMATKA_RE = re.compile(r'\d+\s*(m|km)\b')
+
+# Nimihaun kirjainmuunnokset; samat merkit muunnetaan kannan hakumuoto()-funktiossa.
+# Isot kirjaimet ovat mukana, koska kannan lower() ei muunna niitä kaikissa
+# lokaaleissa (LC_CTYPE = C), jolloin Ä-alkuinen nimi ei löytyisi hausta.
+HAKU_KIRJAIMET = 'åäöáàâãéèêëíìîïóòôõúùûüýÿšžçñÅÄÖÁÀÂÃÉÈÊËÍÌÎÏÓÒÔÕÚÙÛÜÝŸŠŽÇÑ-'
+HAKU_KORVAAVAT = 'aaoaaaaeeeeiiiioooouuuuyyszcnaaoaaaaeeeeiiiioooouuuuyyszcn '
+HAKU_MUUNNOS = str.maketrans(HAKU_KIRJAIMET, HAKU_KORVAAVAT)
+
+# Tuloksen numeerinen alkuosa; perässä voi olla tuulilukema, q/Q, PB, SB tms.
+TULOS_RE = re.compile(r'^(\d+(?:[.:]\d+)*)')
+
+def get_db_connection():
+    return psycopg2.connect(DATABASE_URL)
+
+def _aika_sekunneiksi(tunnit, minuutit, sekunnit):
+    """Laskee ajan sekunteina, palauttaa None jos osat eivät ole kelvollisia"""
+    if minuutit >= 60 or sekunnit >= 60:
+        return None
+    return tunnit * 3600 + minuutit * 60 + sekunnit
+
+def normalisoi_tulos(teksti):
+    """Muuntaa tulosmerkkijonon vertailukelpoiseksi numeroksi ja tilaksi
+
+    Ajat (ss.hh, m.ss.hh, m:ss.hh, h:mm:ss) muunnetaan sekunneiksi, matkat,
+    korkeudet ja pisteet palautetaan sellaisenaan. Palauttaa parin (arvo, tila),
+    jossa arvo on Decimal tai None ja tila jokin TILA_*-vakioista. Tunnistamaton
+    merkintä saa tilan TILA_TUNTEMATON, jottei sitä käsitellä uudelleen joka ajossa.
+    """
+    if teksti is None:
+        return None, TILA_TUNTEMATON
+
+    merkinta = str(teksti).strip().upper().replace(',', '.')
+    if not merkinta:
+        return None, TILA_TUNTEMATON
+
+    if merkinta in TILAMERKINNAT:
+        return None, TILAMERKINNAT[merkinta]
+
+    osuma = TULOS_RE.match(merkinta)
+    if not osuma:
+        return None, TILA_TUNTEMATON
+    luku = osuma.group(1)
+
+    try:
+        if ':' in luku:
+            # m:ss.hh tai h:mm:ss(.hh)
+            osat = luku.split(':')
+            sekunnit = Decimal(osat[-1])
+            if len(osat) == 2:
+                arvo = _aika_sekunneiksi(0, int(osat[0]), sekunnit)
+            elif len(osat) == 3:
+                arvo = _aika_sekunneiksi(int(osat[0]), int(osat[1]), sekunnit)
+            else:
+                arvo = None
+        else:
+            osat = luku.split('.')
+            if len(osat) <= 2:
+                # ss.hh, matka, korkeus tai pisteet
+                arvo = Decimal(luku)
+            elif len(osat) == 3:
+                # m.ss.hh (esim. 1.29.94)
+                arvo = _aika_sekunneiksi(0, int(osat[0]), Decimal(f"{osat[1]}.{osat[2]}"))
+            elif len(osat) == 4:
+                # h.mm.ss.hh
+                arvo = _aika_sekunneiksi(int(osat[0]), int(osat[1]), Decimal(f"{osat[2]}.{osat[3]}"))
+            else:
+                arvo = None
+    except (ValueError, InvalidOperation):
+        arvo = None
+
+    if arvo is None:
+        return None, TILA_TUNTEMATON
+    return arvo.quantize(Decimal('0.001')), TILA_OK
+
+def normalisoi_nimi(nimi):
+    """Muuntaa nimen hakumuotoon: pienet kirjaimet, ei diakriittejä, yksi väli sanojen välissä"""
+    nimi = (nimi or '').lower().translate(HAKU_MUUNNOS)
+    return ' '.join(nimi.split())
+
+def luokittele_laji(lajin_nimi):
+    """Päättelee lajin mittaustyypin, paremmuussuunnan ja yksikön siistitystä nimestä"""
+    nimi = (lajin_nimi or '').lower()
+    sanat = re.findall(r'[a-zåäö]+', nimi)
+
+    if any(osa in nimi for osa in PISTELAJIT):
+        return LAJI_PISTEET
+    if any(osa in nimi for osa in KORKEUSLAJIT):
+        return LAJI_KORKEUS
+    if any(osa in nimi for osa in MATKALAJIT):
+        return LAJI_MATKA
+    if (JUOKSUMATKA_RE.search(nimi) or 'aj' in sanat or
+            any(osa in nimi for osa in AIKALAJIT)):
+        return LAJI_AIKA
+    return LAJI_MATKA
+
+def hae_luettelo_id(c, lajin_nimi):
+    """Palauttaa lajin id:n lajiluettelosta, uusi laji lisätään luokiteltuna"""
+    c.execute('SELECT luettelo_id FROM Lajiluettelo WHERE nimi = %s', (lajin_nimi,))
+    rivi = c.fetchone()
+    if rivi:
+        return rivi[0]
+
+    # Olemassa olevaa luokitusta ei ylikirjoiteta, jotta käsin korjattu suunta säilyy
+    mittaustyyppi, parempi, yksikko = luokittele_laji(lajin_nimi)
+    c.execute('''INSERT INTO Lajiluettelo (nimi, mittaustyyppi, parempi, yksikko)
+                 VALUES (%s, %s, %s, %s)
+                 ON CONFLICT (nimi) DO NOTHING
+                 RETURNING luettelo_id''',
+              (lajin_nimi, mittaustyyppi, parempi, yksikko))
+    rivi = c.fetchone()
+    if rivi:
+        return rivi[0]
+
+    # Rinnakkainen tuonti ehti lisätä lajin
+    c.execute('SELECT luettelo_id FROM Lajiluettelo WHERE nimi = %s', (lajin_nimi,))
+    return c.fetchone()[0]
+
+def tayta_lajiluettelo(conn):
+    """Liittää lajiluetteloon ne Lajit-rivit, joilta luettelo-id puuttuu"""
+    c = conn.cursor()
+    c.execute('SELECT DISTINCT lajin_nimi FROM Lajit WHERE luettelo_id IS NULL')
+    for (lajin_nimi,) in c.fetchall():
+        luettelo_id = hae_luettelo_id(c, lajin_nimi)
+        c.execute('''UPDATE Lajit SET luettelo_id = %s
+                     WHERE lajin_nimi = %s AND luettelo_id IS NULL''',
+                  (luettelo_id, lajin_nimi))
+    conn.commit()
+
+def tayta_tulosarvot(conn, kaikki=False, eran_koko=5000):
+    """Täyttää tulos_arvo- ja tulos_tila-sarakkeet olemassa oleville tuloksille
+
+    Rivit käydään läpi tulos_id-järjestyksessä erissä, joten muistinkäyttö pysyy
+    pienenä. Oletuksena käsitellään vain rivit, joilta tila puuttuu.
+    """
+    c = conn.cursor()
+    viimeisin_id = 0
+    paivitetty = 0
+
+    while True:
+        sql = '''SELECT tulos_id, lisatiedot, CAST(tulos AS TEXT)
+                 FROM Tulokset
+                 WHERE tulos_id > %s'''
+        if not kaikki:
+            sql += ' AND tulos_tila IS NULL'
+        sql += ' ORDER BY tulos_id LIMIT %s'
+        c.execute(sql, (viimeisin_id, eran_koko))
+        rivit = c.fetchall()
+        if not rivit:
+            break
+
+        arvot = []
+        for tulos_id, lisatiedot, tulos in rivit:
+            # Alkuperäinen tulosteksti on lisatiedoissa, vanhoilla riveillä vain tulos-sarakkeessa
+            arvo, tila = normalisoi_tulos(lisatiedot if lisatiedot else tulos)
+            arvot.append((tulos_id, arvo, tila))
+
+        execute_values(c, '''UPDATE Tulokset t
+                             SET tulos_arvo = v.arvo, tulos_tila = v.tila::tulostila
+                             FROM (VALUES %s) AS v(tulos_id, arvo, tila)
+                             WHERE t.tulos_id = v.tulos_id''',
+                       arvot, template='(%s, %s::NUMERIC, %s)')
+        conn.commit()
+
+        paivitetty += len(rivit)
+        viimeisin_id = rivit[-1][0]
+        print(f"Käsitelty {paivitetty} tulosta", file=sys.stderr)
+
+    return paivitetty
+
+def main():
+    parser = argparse.ArgumentParser(description='Täytä tulosten normalisoidut arvot')
+    parser.add_argument('--kaikki', action='store_true',
+                        help='Laske arvot uudelleen myös jo normalisoiduille riveille')
+    parser.add_argument('--era', type=int, default=5000, help='Kerralla käsiteltävien rivien määrä')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        maara = tayta_tulosarvot(conn, kaikki=args.kaikki, eran_koko=args.era)
+        print(f"Normalisoitu {maara} tulosta")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
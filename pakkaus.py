@@ -0,0 +1,139 @@
+import argparse
+import gzip
+import mimetypes
+import os
+import zlib
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # Brotli on valinnainen, ilman sitä käytetään gzipiä
+    brotli = None
+
+# Pakkauksen asetukset
+PAKKAUS_KYNNYS = int(os.environ.get('PAKKAUS_KYNNYS', 1024))  # tavua, pienempiä ei pakata
+PAKKAUS_TASO = int(os.environ.get('PAKKAUS_TASO', 6))  # gzip 1-9
+BROTLI_TASO = int(os.environ.get('BROTLI_TASO', 5))  # brotli 0-11
+PAKKAUS_TYYPIT = set(os.environ.get(
+    'PAKKAUS_TYYPIT',
+    'text/html,text/css,text/plain,text/csv,application/json,application/x-ndjson,'
+    'application/javascript,image/svg+xml,image/x-icon,image/vnd.microsoft.icon'
+).split(','))
+
+# Esipakattujen tiedostojen päätteet suositusjärjestyksessä
+ESIPAKATUT = [('br', '.br'), ('gzip', '.gz')]
+
+def valitse_koodaus():
+    """Valitsee asiakkaan hyväksymistä pakkauksista parhaan saatavilla olevan"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def pakattava(mimetype, koko):
+    """Pakataanko tämän tyyppinen ja kokoinen runko"""
+    return mimetype in PAKKAUS_TYYPIT and koko >= PAKKAUS_KYNNYS
+
+def pakkaa(runko, koodaus):
+    """Pakkaa rungon brotlilla ('br') tai gzipillä"""
+    if koodaus == 'br':
+        return brotli.compress(runko, quality=BROTLI_TASO)
+    return gzip.compress(runko, compresslevel=PAKKAUS_TASO)
+
+def merkitse_pakatuksi(vastaus, koodaus):
+    """Asettaa pakatun vastauksen otsakkeet"""
+    vastaus.headers['Content-Encoding'] = koodaus
+    vastaus.vary.add('Accept-Encoding')
+    # Pakattu esitys ei ole tavu tavulta sama, joten vahva ETag heikennetään
+    etag, heikko = vastaus.get_etag()
+    if etag and not heikko:
+        vastaus.set_etag(etag, weak=True)
+
+def _virtaa_pakattuna(osat, koodaus):
+    """Pakkaa virtaavan vastauksen pala kerrallaan"""
+    if koodaus == 'br':
+        pakkaaja = brotli.Compressor(quality=BROTLI_TASO)
+        for osa in osat:
+            pakattu = pakkaaja.process(osa.encode('utf-8') if isinstance(osa, str) else osa)
+            if pakattu:
+                yield pakattu
+        yield pakkaaja.finish()
+    else:
+        # wbits 31 = gzip-otsake ja -tarkiste
+        pakkaaja = zlib.compressobj(PAKKAUS_TASO, zlib.DEFLATED, 31)
+        for osa in osat:
+            pakattu = pakkaaja.compress(osa.encode('utf-8') if isinstance(osa, str) else osa)
+            if pakattu:
+                yield pakattu
+        yield pakkaaja.flush()
+
+def pakkaa_vastaus(vastaus):
+    """after_request: pakkaa sallitun tyyppiset vastaukset gzipillä tai brotlilla"""
+    if (vastaus.status_code != 200 or vastaus.direct_passthrough or
+            'Content-Encoding' in vastaus.headers or
+            vastaus.mimetype not in PAKKAUS_TYYPIT):
+        return vastaus
+
+    vastaus.vary.add('Accept-Encoding')
+    koodaus = valitse_koodaus()
+    if koodaus is None:
+        return vastaus
+
+    if vastaus.is_streamed:
+        # Virtaavan vastauksen kokoa ei tiedetä etukäteen, joten se pakataan aina
+        vastaus.response = _virtaa_pakattuna(vastaus.response, koodaus)
+        vastaus.headers.pop('Content-Length', None)
+    else:
+        runko = vastaus.get_data()
+        if len(runko) < PAKKAUS_KYNNYS:
+            return vastaus
+        vastaus.set_data(pakkaa(runko, koodaus))
+
+    merkitse_pakatuksi(vastaus, koodaus)
+    return vastaus
+
+def laheta_esipakattu(hakemisto, tiedosto, max_age):
+    """Lähettää tiedoston build-vaiheessa pakattuna versiona, jos asiakas sen hyväksyy"""
+    vastaus = None
+    for koodaus, paate in ESIPAKATUT:
+        if (request.accept_encodings[koodaus] and
+                os.path.isfile(os.path.join(hakemisto, tiedosto + paate))):
+            # Sisältötyyppi alkuperäisen tiedoston mukaan, ei .gz/.br-päätteen
+            mimetype = mimetypes.guess_type(tiedosto)[0] or 'application/octet-stream'
+            vastaus = send_from_directory(hakemisto, tiedosto + paate, mimetype=mimetype, max_age=max_age)
+            vastaus.headers['Content-Encoding'] = koodaus
+            break
+
+    if vastaus is None:
+        vastaus = send_from_directory(hakemisto, tiedosto, max_age=max_age)
+    vastaus.vary.add('Accept-Encoding')
+    return vastaus
+
+def esipakkaa(hakemisto):
+    """Luo hakemiston tiedostoista .gz- ja .br-versiot (ajetaan Docker-buildissa)"""
+    for juuri, _, tiedostot in os.walk(hakemisto):
+        for nimi in tiedostot:
+            if nimi.endswith(('.gz', '.br')):
+                continue
+            polku = os.path.join(juuri, nimi)
+            with open(polku, 'rb') as f:
+                data = f.read()
+
+            pakatut = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                pakatut.append(('.br', brotli.compress(data, quality=11)))
+
+            for paate, pakattu in pakatut:
+                # Pakkaus ei kannata, jos se ei pienennä tiedostoa selvästi
+                if len(pakattu) < len(data) * 0.9:
+                    with open(polku + paate, 'wb') as f:
+                        f.write(pakattu)
+                    print(f"{polku}{paate}: {len(data)} -> {len(pakattu)} tavua")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Esipakkaa staattiset tiedostot')
+    parser.add_argument('hakemisto', nargs='?', default='static', help='Pakattava hakemisto')
+    args = parser.parse_args()
+    esipakkaa(args.hakemisto)
@@ -0,0 +1,360 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+# Poolin asetukset (maksimi kannattaa pitää gunicornin --threads + 1)
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', 3))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # sekuntia
+POOL_PING_VALI = float(os.environ.get('DB_POOL_PING', 30))  # sekuntia
+
+# Lukukopion asetukset (DATABASE_READ_URL)
+LUKUKOPIO_MAX_VIIVE = float(os.environ.get('LUKUKOPIO_MAX_VIIVE', 30))  # sekuntia, tätä jäljemmässä käytetään pääkantaa
+LUKUKOPIO_TARKISTUSVALI = float(os.environ.get('LUKUKOPIO_TARKISTUSVALI', 5))  # sekuntia
+LUKUKOPIO_MAX_TAUKO = 60  # epäonnistuneiden tarkistusten pisin väli (s)
+LUKUKOPIO_YHDISTYS_AIKARAJA = 2  # tarkistusyhteyden avauksen ja kyselyn aikaraja (s)
+
+
+class PooliTaynna(Exception):
+    """Vapaata yhteyttä ei saatu aikarajan sisällä"""
+
+
+class YhteysPooli:
+    """Säieturvallinen PostgreSQL-yhteyspooli terveystarkistuksella ja odotustilastoilla"""
+
+    def __init__(self, dsn, minconn=POOL_MIN, maxconn=POOL_MAX,
+                 timeout=POOL_TIMEOUT, ping_vali=POOL_PING_VALI, odotus_mittari=None, **connect_kwargs):
+        self.dsn = dsn
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.ping_vali = ping_vali
+        self.connect_kwargs = connect_kwargs
+        # Kutsutaan jokaisen lainauksen kestolla (odotus, tarkistus ja mahdollinen avaus)
+        self.odotus_mittari = odotus_mittari
+
+        # Vapaat yhteydet (yhteys, palautusaika); uusin käytetään ensin
+        self._vapaat_yhteydet = []
+        self._pid = os.getpid()
+        self._esitaytetty = False
+        self._lukko = threading.Lock()
+        self._paikat = threading.BoundedSemaphore(self.maxconn)
+
+        self._tilastot = {
+            'lainauksia': 0,
+            'odotus_yhteensa_s': 0.0,
+            'odotus_max_s': 0.0,
+            'aikakatkaisuja': 0,
+            'avattuja': 0,
+            'kierratettyja': 0,
+            'kaytossa': 0
+        }
+
+    def _tarkista_prosessi(self):
+        """Forkin jälkeen vanhan prosessin yhteyksiä ei saa käyttää eikä sulkea"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._esitaytetty = False
+            self._vapaat_yhteydet = []
+            self._paikat = threading.BoundedSemaphore(self.maxconn)
+            self._tilastot['kaytossa'] = 0
+
+    def _avaa(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        with self._lukko:
+            self._tilastot['avattuja'] += 1
+        return conn
+
+    def _on_kunnossa(self, conn, palautettu):
+        """Tarkistaa yhteyden kunnon, pitkään käyttämättä ollut yhteys pingataan"""
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - palautettu < self.ping_vali:
+            return True
+
+        try:
+            c = conn.cursor()
+            c.execute("SELECT 1")
+            c.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def esitayta(self):
+        """Avaa yhteyksiä, kunnes vapaita on vähintään minimimäärä"""
+        with self._lukko:
+            self._tarkista_prosessi()
+            self._esitaytetty = True
+            puuttuu = self.minconn - len(self._vapaat_yhteydet) - self._tilastot['kaytossa']
+        for _ in range(max(0, puuttuu)):
+            conn = self._avaa()
+            with self._lukko:
+                self._vapaat_yhteydet.append((conn, time.monotonic()))
+
+    def ota(self):
+        """Lainaa yhteyden poolista, odottaa tarvittaessa vapaata yhteyttä"""
+        with self._lukko:
+            self._tarkista_prosessi()
+            esitayta = not self._esitaytetty
+            paikat = self._paikat
+        if esitayta:
+            self.esitayta()
+
+        alku = time.monotonic()
+        if not paikat.acquire(timeout=self.timeout):
+            with self._lukko:
+                self._tilastot['aikakatkaisuja'] += 1
+            raise PooliTaynna(f"Vapaata tietokantayhteyttä ei saatu {self.timeout} sekunnissa")
+        odotus = time.monotonic() - alku
+
+        try:
+            conn = None
+            while conn is None:
+                with self._lukko:
+                    vapaa = self._vapaat_yhteydet.pop() if self._vapaat_yhteydet else None
+                if vapaa is None:
+                    conn = self._avaa()
+                elif self._on_kunnossa(*vapaa):
+                    conn = vapaa[0]
+                else:
+                    # Rikkinäinen yhteys suljetaan ja tilalle otetaan seuraava
+                    self._sulje_hiljaa(vapaa[0])
+                    with self._lukko:
+                        self._tilastot['kierratettyja'] += 1
+        except Exception:
+            paikat.release()
+            raise
+
+        with self._lukko:
+            self._tilastot['lainauksia'] += 1
+            self._tilastot['odotus_yhteensa_s'] += odotus
+            self._tilastot['odotus_max_s'] = max(self._tilastot['odotus_max_s'], odotus)
+            self._tilastot['kaytossa'] += 1
+        if self.odotus_mittari is not None:
+            self.odotus_mittari(time.monotonic() - alku)
+        return conn
+
+    def palauta(self, conn):
+        """Palauttaa yhteyden pooliin, keskeneräinen transaktio perutaan"""
+        rikki = conn.closed != 0
+        if not rikki:
+            tila = conn.get_transaction_status()
+            if tila == extensions.TRANSACTION_STATUS_UNKNOWN:
+                rikki = True
+            elif tila != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    rikki = True
+
+        with self._lukko:
+            if self._pid != os.getpid():
+                # Yhteys on peritty forkissa, sitä ei palauteta uuden prosessin pooliin
+                return
+            if rikki:
+                self._tilastot['kierratettyja'] += 1
+            else:
+                self._vapaat_yhteydet.append((conn, time.monotonic()))
+            self._tilastot['kaytossa'] -= 1
+            paikat = self._paikat
+
+        if rikki:
+            self._sulje_hiljaa(conn)
+        paikat.release()
+
+    @staticmethod
+    def _sulje_hiljaa(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    @contextmanager
+    def yhteys(self):
+        """Lainaa yhteyden with-lohkon ajaksi"""
+        conn = self.ota()
+        try:
+            yield conn
+        finally:
+            self.palauta(conn)
+
+    def tilastot(self):
+        """Palauttaa poolin odotus- ja käyttötilastot"""
+        with self._lukko:
+            tilastot = dict(self._tilastot)
+            tilastot['vapaita'] = len(self._vapaat_yhteydet)
+        lainauksia = tilastot['lainauksia']
+        tilastot['odotus_keskiarvo_s'] = tilastot['odotus_yhteensa_s'] / lainauksia if lainauksia else 0.0
+        tilastot['min'] = self.minconn
+        tilastot['max'] = self.maxconn
+        return tilastot
+
+    def sulje(self):
+        """Sulkee kaikki vapaat yhteydet"""
+        with self._lukko:
+            if self._pid != os.getpid():
+                return
+            vapaat, self._vapaat_yhteydet = self._vapaat_yhteydet, []
+        for conn, _ in vapaat:
+            self._sulje_hiljaa(conn)
+
+
+class LukuReititin:
+    """Ohjaa lukupyynnöt lukukopiolle, kun se on tavoitettavissa ja riittävän ajan tasalla
+
+    Kopion tila (viive ja datasukupolvi) tarkistetaan korkeintaan kerran
+    tarkistusvälissä omalla lyhytikäisellä yhteydellä. Tarkistusta ei tehdä
+    lukon sisällä: yksi pyyntö tarkistaa ja muut käyttävät sillä välin
+    viimeisintä tunnettua tilaa. Tavoittamaton tai liikaa jäljessä oleva
+    kopio ohitetaan, jolloin kaikki kyselyt menevät pääkantaan, ja
+    epäonnistuneiden tarkistusten väli kasvaa.
+    """
+
+    # Viive on nolla, kun kaikki vastaanotettu WAL on toistettu (muuten hiljainen pääkanta näyttäisi viiveeltä)
+    VIIVE_SQL = """
+        SELECT CASE
+                   WHEN NOT pg_is_in_recovery() THEN 0
+                   WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                   ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+               END,
+               (SELECT sukupolvi FROM Datasukupolvi)
+    """
+
+    def __init__(self, ensisijainen, lukukopio=None, max_viive=LUKUKOPIO_MAX_VIIVE,
+                 tarkistusvali=LUKUKOPIO_TARKISTUSVALI):
+        self.ensisijainen = ensisijainen
+        self.lukukopio = lukukopio
+        self.max_viive = max_viive
+        self.tarkistusvali = tarkistusvali
+        self._lukko = threading.Lock()
+        self._tila = None
+        self._tarkistettu = None
+        self._tarkistamassa = False
+        self._perakkaisia_virheita = 0
+        self._tilastot = {'lukukopiolle': 0, 'paakantaan': 0, 'tarkistuksia': 0, 'virheita': 0,
+                          'varalle': 0}
+
+    def _tarkista(self):
+        """Palauttaa (viive, sukupolvi) tai None, jos kopio ei vastaa
+
+        Oma yhteys eikä poolin yhteys, jotta yhteyden avaukselle ja kyselylle
+        on aina aikaraja eikä puoliavoin pooliyhteys jää odottamaan.
+        """
+        asetukset = dict(self.lukukopio.connect_kwargs)
+        asetukset.update(
+            connect_timeout=LUKUKOPIO_YHDISTYS_AIKARAJA,
+            keepalives=1, keepalives_idle=5, keepalives_interval=2, keepalives_count=2,
+            options=f"-c statement_timeout={int(LUKUKOPIO_YHDISTYS_AIKARAJA * 1000)}"
+        )
+        conn = None
+        try:
+            conn = psycopg2.connect(self.lukukopio.dsn, **asetukset)
+            c = conn.cursor()
+            c.execute(self.VIIVE_SQL)
+            viive, sukupolvi = c.fetchone()
+            return float(viive), sukupolvi
+        except psycopg2.Error as e:
+            print(f"Lukukopion tarkistus epäonnistui: {str(e).strip()}")
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _kirjaa_tila(self, tila):
+        """Tallentaa tarkistuksen tuloksen; kutsutaan lukon sisällä"""
+        self._tila = tila
+        self._tarkistettu = time.monotonic()
+        if tila is None:
+            self._tilastot['virheita'] += 1
+            self._perakkaisia_virheita += 1
+        else:
+            self._perakkaisia_virheita = 0
+
+    def _seuraava_tarkistus(self):
+        """Tarkistusväli kaksinkertaistuu jokaisesta peräkkäisestä virheestä (enintään LUKUKOPIO_MAX_TAUKO)"""
+        return min(self.tarkistusvali * 2 ** self._perakkaisia_virheita,
+                   max(self.tarkistusvali, LUKUKOPIO_MAX_TAUKO))
+
+    def tila(self):
+        """Lukukopion (viive, sukupolvi) tai None; tarkistetaan tarkistusvälin välein"""
+        if self.lukukopio is None:
+            return None
+        with self._lukko:
+            if (self._tarkistamassa or (self._tarkistettu is not None and
+                                        time.monotonic() - self._tarkistettu < self._seuraava_tarkistus())):
+                return self._tila
+            self._tarkistamassa = True
+            self._tilastot['tarkistuksia'] += 1
+
+        tila = None
+        try:
+            tila = self._tarkista()
+        finally:
+            with self._lukko:
+                self._kirjaa_tila(tila)
+                self._tarkistamassa = False
+        return tila
+
+    def valitse(self, kirjoitus=False):
+        """Palauttaa (pooli, lukukopion datasukupolvi); pääkannalle sukupolvi on None"""
+        tila = None if kirjoitus else self.tila()
+        kopio = tila is not None and tila[0] <= self.max_viive
+        with self._lukko:
+            self._tilastot['lukukopiolle' if kopio else 'paakantaan'] += 1
+        if kopio:
+            return self.lukukopio, tila[1]
+        return self.ensisijainen, None
+
+    def ota(self, kirjoitus=False):
+        """Lainaa yhteyden valitusta poolista; palauttaa (pooli, yhteys, lukukopion datasukupolvi)
+
+        Jos lukukopion yhteyttä ei saada, kopio merkitään tavoittamattomaksi ja
+        yhteys lainataan pääkannasta.
+        """
+        kohde, sukupolvi = self.valitse(kirjoitus)
+        if kohde is self.ensisijainen:
+            return kohde, kohde.ota(), None
+        try:
+            return kohde, kohde.ota(), sukupolvi
+        except (psycopg2.OperationalError, PooliTaynna) as e:
+            print(f"Lukukopion yhteys epäonnistui, luetaan pääkannasta: {str(e).strip()}")
+            with self._lukko:
+                self._kirjaa_tila(None)
+                self._tilastot['varalle'] += 1
+            return self.ensisijainen, self.ensisijainen.ota(), None
+
+    def tilastot(self):
+        """Palauttaa reitityksen laskurit ja kopion viimeisimmän tilan"""
+        with self._lukko:
+            tilastot = dict(self._tilastot)
+            tilastot['kaytossa'] = self.lukukopio is not None
+            tilastot['viive_s'] = self._tila[0] if self._tila else None
+            tilastot['sukupolvi'] = self._tila[1] if self._tila else None
+            tilastot['tarkistusvali_s'] = self._seuraava_tarkistus()
+        return tilastot
+
+
+def kasvata_datasukupolvi(c):
+    """Merkitsee datan muuttuneeksi; kutsutaan samassa transaktiossa kuin muutos"""
+    c.execute("UPDATE Datasukupolvi SET sukupolvi = sukupolvi + 1, paivitetty = NOW()")
+
+
+# Päivitysajon advisory-lukon avain; sama kaikille prosesseille ja koneille
+PAIVITYS_LUKKO = 72011
+
+# Onko päivitysajon lukko jonkin istunnon hallussa (pg_locks näkyy kaikille käyttäjille)
+PAIVITYS_KAYNNISSA_SQL = """
+    SELECT EXISTS (
+        SELECT 1 FROM pg_locks
+        WHERE locktype = 'advisory' AND granted
+          AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+          AND classid = 0 AND objid = %s AND objsubid = 1
+    )
+"""
@@ -1,4 +1,3 @@
-import requests
 import psycopg2
 import os
 from datetime import datetime
@@ -7,11 +6,22 @@ import argparse
 import json
 import re
 import sys
-from psycopg2.extras import DictCursor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from psycopg2.extras import DictCursor, execute_values
+from normalisointi import normalisoi_tulos, hae_luettelo_id
+from tietokanta import kasvata_datasukupolvi
+from kyselyt import KAIKKI_KAUDET
+from api_asiakas import asiakas
 
 # Asetukset
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# Monirivisen lauseen rivimäärä; tätä suurempi laji tallennetaan useammalla lauseella
+ERAKOKO = 1000
+
+# Yhtä aikaa haettavien lajien tulosten määrä (automaatti_haku ajaa lisäksi useita kilpailuja rinnakkain)
+HAKU_SAIKEET = int(os.environ.get('HAKU_SAIKEET', 4))
+
 def get_db_connection():
     return psycopg2.connect(DATABASE_URL)
 
@@ -49,16 +59,26 @@ def parse_date(date_str):
         print(f"Virhe päivämäärän jäsentämisessä: {date_str} - {str(e)}", file=sys.stderr)
         return None
 
-def fetch_competition_info(competition_id):
-    """Hakee kilpailun perustiedot"""
-    api_url = f"https://cached-public-api.tuloslista.com/live/v1/competition/{competition_id}"
-    try:
-        response = requests.get(api_url, timeout=10)
-        response.raise_for_status()
-        data = json.loads(clean_json_response(response.text))
-        
-        # Etsi ensimmäinen virallinen kilpailupäivä
-        competition_date = None
+def fetch_competition_rounds(competition_id):
+    """Hakee kilpailun kierrokset päivittäin"""
+    return json.loads(asiakas.hae_sisalto(f"/competition/{competition_id}", timeout=10,
+                                          puhdista=clean_json_response))
+
+def fetch_competition_properties(competition_id):
+    """Hakee kilpailun ominaisuudet (nimi, paikkakunta)"""
+    return json.loads(asiakas.hae_sisalto(f"/competition/{competition_id}/properties", timeout=10,
+                                          puhdista=clean_json_response))
+
+def fetch_event_results(competition_id, event_id):
+    """Hakee yhden virallisen lajin tulokset; viralliset tulokset eivät enää muutu"""
+    return json.loads(asiakas.hae_sisalto(f"/results/{competition_id}/{event_id}", timeout=10,
+                                          muuttumaton=True, puhdista=clean_json_response))
+
+def parse_competition_info(competition_id, data, props_data):
+    """Kokoaa kilpailun perustiedot kierroksista ja ominaisuuksista"""
+    # Etsi ensimmäinen virallinen kilpailupäivä
+    competition_date = None
+    if isinstance(data, dict):
         for date_str, rounds in data.items():
             if date_str == "Competition":
                 continue
@@ -69,49 +89,165 @@ def fetch_competition_info(competition_id):
                         break
                 if competition_date:
                     break
-        
-        # Hae kilpailun perustiedot
-        props_url = f"https://cached-public-api.tuloslista.com/live/v1/competition/{competition_id}/properties"
-        props_response = requests.get(props_url, timeout=10)
-        props_response.raise_for_status()
-        props_data = json.loads(clean_json_response(props_response.text))
-        
-        # Oletusarvot jos tietoja ei löydy
-        default_info = {
-            'Name': f"Kilpailu {competition_id}",
-            'Location': None,
-            'StartDate': None,
-            'EndDate': None
+    
+    # Oletusarvot jos tietoja ei löydy
+    default_info = {
+        'Name': f"Kilpailu {competition_id}",
+        'Location': None,
+        'StartDate': None,
+        'EndDate': None
+    }
+    
+    if props_data and 'Competition' in props_data:
+        comp_data = props_data['Competition']
+        return {
+            'Name': comp_data.get('Name', default_info['Name']),
+            'Location': comp_data.get('Location', default_info['Location']),
+            'StartDate': parse_date(competition_date),
+            'EndDate': parse_date(competition_date)
         }
-        
-        if props_data and 'Competition' in props_data:
-            comp_data = props_data['Competition']
-            return {
-                'Name': comp_data.get('Name', default_info['Name']),
-                'Location': comp_data.get('Location', default_info['Location']),
-                'StartDate': parse_date(competition_date),
-                'EndDate': parse_date(competition_date)
-            }
-        return default_info
+    return default_info
+
+def fetch_competition_info(competition_id):
+    """Hakee kilpailun perustiedot"""
+    try:
+        return parse_competition_info(competition_id,
+                                      fetch_competition_rounds(competition_id),
+                                      fetch_competition_properties(competition_id))
     except Exception as e:
         print(f"Virhe kilpailun tietojen haussa: {str(e)}", file=sys.stderr)
-        return {
-            'Name': f"Kilpailu {competition_id}",
-            'Location': None,
-            'StartDate': None,
-            'EndDate': None
-        }
+        return parse_competition_info(competition_id, None, None)
+
+class KilpailuKonteksti:
+    """Yhden ajon kilpailu: kierrokset ja ominaisuudet haetaan rajapinnasta vain kerran
+
+    Samaa kontekstia käytetään kilpailun tallennukseen, kierrosten läpikäyntiin
+    ja jokaisen lajin tallennukseen.
+    """
 
-def save_competition_info(conn, competition_id):
-    """Tallentaa kilpailun perustiedot tietokantaan (aina)"""
+    def __init__(self, competition_id):
+        self.competition_id = competition_id
+        # Ilman kierroksia lajeja ei voi hakea, joten virhe välitetään kutsujalle
+        self.kierrokset = fetch_competition_rounds(competition_id)
+        try:
+            ominaisuudet = fetch_competition_properties(competition_id)
+        except Exception as e:
+            print(f"Virhe kilpailun tietojen haussa: {str(e)}", file=sys.stderr)
+            ominaisuudet = None
+        self.info = parse_competition_info(competition_id, self.kierrokset, ominaisuudet)
+        self.tallennettu = False
+
+    def tallenna(self, conn):
+        """Tallentaa kilpailun perustiedot, kerran ajoa kohden"""
+        if not self.tallennettu:
+            self.tallennettu = save_competition_info(conn, self.competition_id, self.info)
+        return self.tallennettu
+
+def update_competition_summary(c, competition_id):
+    """Päivittää kilpailun rivin KilpailuYhteenveto-tauluun (kilpailusivun listaus)"""
+    c.execute('''INSERT INTO KilpailuYhteenveto
+                 (kilpailu_id, kilpailun_nimi, alkupvm, lajeja, tuloksia, urheilijoita, paivitetty)
+                 SELECT k.kilpailu_id, k.kilpailun_nimi, k.alkupvm,
+                        COUNT(DISTINCT t.laji_id), COUNT(t.tulos_id), COUNT(DISTINCT t.urheilija_id), NOW()
+                 FROM Kilpailut k
+                 LEFT JOIN Tulokset t ON t.kilpailu_id = k.kilpailu_id
+                 WHERE k.kilpailu_id = %s
+                 GROUP BY k.kilpailu_id
+                 ON CONFLICT (kilpailu_id) DO UPDATE SET
+                 kilpailun_nimi = EXCLUDED.kilpailun_nimi,
+                 alkupvm = EXCLUDED.alkupvm,
+                 lajeja = EXCLUDED.lajeja,
+                 tuloksia = EXCLUDED.tuloksia,
+                 urheilijoita = EXCLUDED.urheilijoita,
+                 paivitetty = EXCLUDED.paivitetty''',
+              (int(competition_id),))
+
+# Lajin kauden parhaat tulokset urheilijoittain. Vertailuarvo on lajeissa, joissa
+# pienempi on parempi, tulos_arvo ja muissa sen vastaluku, joten pienin on aina paras.
+PERSONAL_BESTS_SQL = '''INSERT INTO Ennatykset (urheilija_id, luettelo_id, kausi, vertailuarvo, tulos_id)
+                          SELECT DISTINCT ON (t.urheilija_id, l.luettelo_id, kausi)
+                                 t.urheilija_id, l.luettelo_id,
+                                 COALESCE(EXTRACT(YEAR FROM k.alkupvm)::INTEGER, 0) AS kausi,
+                                 CASE WHEN lj.parempi = 'pienempi' THEN t.tulos_arvo
+                                      ELSE -t.tulos_arvo END AS vertailuarvo,
+                                 t.tulos_id
+                          FROM Tulokset t
+                          JOIN Lajit l ON l.laji_id = t.laji_id AND l.kilpailu_id = t.kilpailu_id
+                          JOIN Lajiluettelo lj ON lj.luettelo_id = l.luettelo_id
+                          JOIN Kilpailut k ON k.kilpailu_id = t.kilpailu_id
+                          WHERE t.tulos_tila = 'OK'
+                          AND t.tulos_arvo IS NOT NULL
+                          {rajaus}
+                          ORDER BY t.urheilija_id, l.luettelo_id, kausi,
+                                   vertailuarvo, k.alkupvm, t.tulos_id
+                          ON CONFLICT (urheilija_id, luettelo_id, kausi) DO UPDATE SET
+                          vertailuarvo = EXCLUDED.vertailuarvo,
+                          tulos_id = EXCLUDED.tulos_id'''
+
+# Kaikkien aikojen paras johdetaan kausien parhaista omaksi rivikseen, jotta
+# rajaamaton tilasto luetaan suoraan indeksistä ilman urheilijoiden läpikäyntiä.
+ALL_TIME_BESTS_SQL = '''INSERT INTO Ennatykset (urheilija_id, luettelo_id, kausi, vertailuarvo, tulos_id)
+                          SELECT DISTINCT ON (e.urheilija_id, e.luettelo_id)
+                                 e.urheilija_id, e.luettelo_id, {kaikki}, e.vertailuarvo, e.tulos_id
+                          FROM Ennatykset e
+                          WHERE e.kausi <> {kaikki}
+                          {{rajaus}}
+                          ORDER BY e.urheilija_id, e.luettelo_id, e.vertailuarvo, e.kausi, e.tulos_id
+                          ON CONFLICT (urheilija_id, luettelo_id, kausi) DO UPDATE SET
+                          vertailuarvo = EXCLUDED.vertailuarvo,
+                          tulos_id = EXCLUDED.tulos_id'''.format(kaikki=KAIKKI_KAUDET)
+
+def update_personal_bests(c, competition_id, event_id, luettelo_id):
+    """Laskee lajin urheilijoiden kauden ja kaikkien aikojen parhaat uudelleen juuri tallennetun lajin perusteella"""
+    # Vain tämän lajin urheilijat ja kilpailun kausi lasketaan, joten työ ei kasva historian mukana
+    parametrit = {'luettelo_id': int(luettelo_id),
+                  'laji_id': int(event_id),
+                  'kilpailu_id': int(competition_id),
+                  'kaikki': KAIKKI_KAUDET}
+
+    # Päivitetty tulos säilyttää tulos_id:nsä, joten ON DELETE CASCADE ei poista vanhaa
+    # ennätystä. Poistetaan rivit ensin, ettei DNS/DNF/DQ/NM-tilaan korjattu tulos jää
+    # voimaan urheilijalle, jolla ei ole muuta hyväksyttyä tulosta.
+    c.execute('''DELETE FROM Ennatykset
+                 WHERE luettelo_id = %(luettelo_id)s
+                 AND kausi IN (%(kaikki)s,
+                               (SELECT COALESCE(EXTRACT(YEAR FROM alkupvm)::INTEGER, 0)
+                                FROM Kilpailut WHERE kilpailu_id = %(kilpailu_id)s))
+                 AND urheilija_id IN (SELECT urheilija_id FROM Tulokset
+                                      WHERE laji_id = %(laji_id)s AND kilpailu_id = %(kilpailu_id)s)''',
+              parametrit)
+
+    rajaus = '''AND l.luettelo_id = %(luettelo_id)s
+                  AND t.urheilija_id IN (SELECT urheilija_id FROM Tulokset
+                                       WHERE laji_id = %(laji_id)s AND kilpailu_id = %(kilpailu_id)s)
+                  AND COALESCE(EXTRACT(YEAR FROM k.alkupvm)::INTEGER, 0) =
+                      (SELECT COALESCE(EXTRACT(YEAR FROM alkupvm)::INTEGER, 0)
+                       FROM Kilpailut WHERE kilpailu_id = %(kilpailu_id)s)'''
+    c.execute(PERSONAL_BESTS_SQL.format(rajaus=rajaus), parametrit)
+
+    c.execute(ALL_TIME_BESTS_SQL.format(rajaus='''AND e.luettelo_id = %(luettelo_id)s
+                  AND e.urheilija_id IN (SELECT urheilija_id FROM Tulokset
+                                       WHERE laji_id = %(laji_id)s AND kilpailu_id = %(kilpailu_id)s)'''),
+              parametrit)
+
+def rebuild_personal_bests(conn):
+    """Täyttää Ennatykset-taulun koko historiasta"""
+    c = conn.cursor()
+    c.execute(PERSONAL_BESTS_SQL.format(rajaus=''))
+    c.execute(ALL_TIME_BESTS_SQL.format(rajaus=''))
+    conn.commit()
+
+def save_competition_info(conn, competition_id, comp_info=None):
+    """Tallentaa kilpailun perustiedot tietokantaan (aina), comp_info haetaan tarvittaessa"""
     if not conn:
         return False
         
     c = conn.cursor()
     
     try:
-        # Hae kilpailun tiedot API:sta
-        comp_info = fetch_competition_info(competition_id)
+        # Hae kilpailun tiedot API:sta, jos niitä ei annettu
+        if comp_info is None:
+            comp_info = fetch_competition_info(competition_id)
         
         # Varmista että kilpailu on olemassa
         c.execute('''INSERT INTO Kilpailut 
@@ -129,6 +265,9 @@ def save_competition_info(conn, competition_id):
                    comp_info['StartDate'],
                    comp_info['EndDate']))
         
+        update_competition_summary(c, competition_id)
+        kasvata_datasukupolvi(c)
+        
         conn.commit()
         return True
         
@@ -176,6 +315,9 @@ def parse_results(api_data, seura_filter=None):
                 except ValueError:
                     processed_result = None
             
+            # Vertailukelpoinen arvo ja tila (DNS/DNF/DQ/NM) tulostaulukoita varten
+            tulos_arvo, tulos_tila = normalisoi_tulos(raw_result)
+            
             # Suodata seuran mukaan jos annettu
             org_data = result.get('Organization', {}) or {}
             seura_nimi = org_data.get('Name', '-') if isinstance(org_data, dict) else '-'
@@ -193,6 +335,8 @@ def parse_results(api_data, seura_filter=None):
                 'seura': str(seura_nimi),
                 'tulos': processed_result,
                 'tulos_teksti': str(raw_result),
+                'tulos_arvo': tulos_arvo,
+                'tulos_tila': tulos_tila,
                 'sarja': series,
                 'sukupuoli': sukupuoli,
                 'syntymavuosi': int(result.get('BirthYear')) if str(result.get('BirthYear', '')).isdigit() else None
@@ -269,8 +413,77 @@ def siisti_lajin_nimi(lajin_nimi):
     
     return lajin_nimi.strip()
 
-def save_event_results(conn, competition_id, event_id, event_name, results, seura_filter=None):
-    """Tallentaa tulokset tietokantaan - päivittää jos on jo olemassa"""
+def valmistele_tulosrivit(results):
+    """Muuntaa rajapinnan tulosrivit tallennettavaan muotoon avaimella (etunimi, sukunimi)
+
+    Virheelliset rivit ilmoitetaan yksitellen ja jätetään pois. Jos sama nimi on
+    lajissa useasti, viimeinen rivi jää voimaan.
+    """
+    rivit = {}
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+
+        # Nimi
+        nimi = str(result.get('nimi', ''))
+        nimet = nimi.split()
+        etunimi = ' '.join(nimet[:-1]) if len(nimet) > 1 else ''
+        sukunimi = nimet[-1] if nimet else ''
+
+        if not etunimi or not sukunimi:
+            continue
+
+        try:
+            tulos = float(result.get('tulos')) if result.get('tulos') is not None else None
+            # Tulokset.tulos on DECIMAL(10,3); liian suuri arvo kaataisi koko erän lauseen
+            if tulos is not None and abs(tulos) >= 10 ** 7:
+                raise ValueError(f"tulos {tulos} on liian suuri")
+
+            seura_nimi = result.get('seura', '-')
+            rivit[(etunimi, sukunimi)] = {
+                'seura': str(seura_nimi) if seura_nimi and seura_nimi != '-' else None,
+                'sukupuoli': str(result.get('sukupuoli')) if result.get('sukupuoli') else None,
+                'syntymavuosi': int(result.get('syntymavuosi')) if str(result.get('syntymavuosi', '')).isdigit() else None,
+                'sijoitus': int(result.get('sijoitus', 0)) if str(result.get('sijoitus', '0')).isdigit() else 0,
+                'tulos': tulos,
+                'lisatiedot': str(result.get('tulos_teksti', '')),
+                'tulos_arvo': result.get('tulos_arvo'),
+                'tulos_tila': result.get('tulos_tila')
+            }
+        except (TypeError, ValueError) as e:
+            print(f"Virhe tallennettaessa urheilijaa {etunimi} {sukunimi}: {str(e)}", file=sys.stderr)
+
+    return rivit
+
+def tallenna_erana(c, sql, rivit, kuvaus):
+    """Ajaa monirivisen lauseen (execute_values) ja palauttaa sen RETURNING-rivit
+
+    Koko erä tallennetaan yhdellä lauseella. Jos lause epäonnistuu, erä puolitetaan,
+    kunnes virheelliset rivit löytyvät; ne ilmoitetaan yksitellen ja muut tallennetaan.
+    """
+    if not rivit:
+        return []
+
+    c.execute("SAVEPOINT sp_era")
+    try:
+        palautetut = execute_values(c, sql, rivit, page_size=ERAKOKO, fetch=True)
+        c.execute("RELEASE SAVEPOINT sp_era")
+        return palautetut
+    except psycopg2.Error as e:
+        c.execute("ROLLBACK TO SAVEPOINT sp_era")
+        c.execute("RELEASE SAVEPOINT sp_era")
+        if len(rivit) == 1:
+            print(f"Virhe tallennettaessa {kuvaus(rivit[0])}: {str(e).strip()}", file=sys.stderr)
+            return []
+
+    puoli = len(rivit) // 2
+    return tallenna_erana(c, sql, rivit[:puoli], kuvaus) + tallenna_erana(c, sql, rivit[puoli:], kuvaus)
+
+def save_event_results(conn, competition_id, event_id, event_name, results, seura_filter=None, kilpailu=None):
+    """Tallentaa tulokset tietokantaan - päivittää jos on jo olemassa
+
+    kilpailu on ajon KilpailuKonteksti; ilman sitä kilpailun tiedot haetaan ja tallennetaan joka kerta.
+    """
     if not conn or not event_id or not event_name:
         return []
         
@@ -282,99 +495,89 @@ def save_event_results(conn, competition_id, event_id, event_name, results, seur
     
     try:
         # Varmista kilpailu
-        save_competition_info(conn, competition_id)
+        if kilpailu is not None:
+            kilpailu.tallenna(conn)
+        else:
+            save_competition_info(conn, competition_id)
         
-        # Lisää/päivitä laji
+        # Lisää/päivitä laji ja liitä se lajiluetteloon
+        luettelo_id = hae_luettelo_id(c, str(cleaned_event_name))
         c.execute('''INSERT INTO Lajit 
-                     (laji_id, kilpailu_id, lajin_nimi, sarja)
-                     VALUES (%s, %s, %s, %s)
+                     (laji_id, kilpailu_id, lajin_nimi, sarja, luettelo_id)
+                     VALUES (%s, %s, %s, %s, %s)
                      ON CONFLICT (laji_id, kilpailu_id) DO UPDATE SET
                      lajin_nimi = EXCLUDED.lajin_nimi,
-                     sarja = EXCLUDED.sarja''',
-                  (int(event_id), int(competition_id), str(cleaned_event_name), str(series) if series else None))
+                     sarja = EXCLUDED.sarja,
+                     luettelo_id = EXCLUDED.luettelo_id''',
+                  (int(event_id), int(competition_id), str(cleaned_event_name), str(series) if series else None,
+                   luettelo_id))
         
         if results and isinstance(results, list):
-            for result in results:
-                if not isinstance(result, dict):
-                    continue
-                    
-                try:
-                    # Käytä SAVEPOINT:iä jokaisen urheilijan kohdalla
-                    c.execute("SAVEPOINT sp_athlete")
-                    
-                    # Käsittele seura
-                    seura_nimi = result.get('seura', '-')
-                    seura_id = None
-                    if seura_nimi and seura_nimi != '-':
-                        c.execute('''INSERT INTO Seurat (seura_nimi) VALUES (%s) 
-                                     ON CONFLICT (seura_nimi) DO NOTHING''', 
-                                 (str(seura_nimi),))
-                        c.execute('SELECT seura_id FROM Seurat WHERE seura_nimi = %s', 
-                                 (str(seura_nimi),))
-                        row = c.fetchone()
-                        if row:
-                            seura_id = int(row[0])
-                    
-                    # Nimi
-                    nimi = str(result.get('nimi', ''))
-                    nimet = nimi.split()
-                    etunimi = ' '.join(nimet[:-1]) if len(nimet) > 1 else ''
-                    sukunimi = nimet[-1] if nimet else ''
-                    
-                    if not etunimi or not sukunimi:
-                        c.execute("ROLLBACK TO SAVEPOINT sp_athlete")
-                        continue
-                    
-                    # Urheilija - käytä ON CONFLICT DO UPDATE
-                    c.execute('''INSERT INTO Urheilijat 
-                                 (etunimi, sukunimi, sukupuoli, syntymavuosi, seura_id)
-                                 VALUES (%s, %s, %s, %s, %s)
-                                 ON CONFLICT (etunimi, sukunimi) DO UPDATE SET
-                                 sukupuoli = COALESCE(EXCLUDED.sukupuoli, Urheilijat.sukupuoli),
-                                 syntymavuosi = COALESCE(EXCLUDED.syntymavuosi, Urheilijat.syntymavuosi),
-                                 seura_id = COALESCE(EXCLUDED.seura_id, Urheilijat.seura_id)
-                                 RETURNING urheilija_id''',
-                              (str(etunimi), str(sukunimi),
-                               str(result.get('sukupuoli')) if result.get('sukupuoli') else None,
-                               int(result.get('syntymavuosi')) if str(result.get('syntymavuosi', '')).isdigit() else None,
-                               int(seura_id) if seura_id else None))
-                    
-                    urheilija_row = c.fetchone()
-                    urheilija_id = int(urheilija_row[0]) if urheilija_row else None
-                    
-                    if not urheilija_id:
-                        c.execute("ROLLBACK TO SAVEPOINT sp_athlete")
-                        continue
-                    
-                    # TÄRKEIN: Tarkista onko tulos jo olemassa
-                    # Jos on, DELETE ja sitten INSERT (ei UPDATE)
-                    c.execute('''DELETE FROM Tulokset 
-                                 WHERE laji_id = %s AND kilpailu_id = %s AND urheilija_id = %s''',
-                              (int(event_id), int(competition_id), int(urheilija_id)))
-                    
-                    # Nyt INSERT uutena (ei duplikaattivirhettä)
-                    c.execute('''INSERT INTO Tulokset 
-                                 (laji_id, kilpailu_id, urheilija_id, sijoitus, tulos, lisatiedot)
-                                 VALUES (%s, %s, %s, %s, %s, %s)''',
-                              (int(event_id), int(competition_id), int(urheilija_id),
-                               int(result.get('sijoitus', 0)) if str(result.get('sijoitus', '0')).isdigit() else 0,
-                               float(result.get('tulos')) if result.get('tulos') is not None else None,
-                               str(result.get('tulos_teksti', ''))))
-                    
+            rivit = valmistele_tulosrivit(results)
+
+            # Seurat: puuttuvat lisätään ja kaikkien id:t haetaan samalla lauseella
+            seura_nimet = sorted({rivi['seura'] for rivi in rivit.values() if rivi['seura']})
+            palautetut = tallenna_erana(c, '''
+                WITH nimet (seura_nimi) AS (VALUES %s),
+                uudet AS (
+                    INSERT INTO Seurat (seura_nimi)
+                    SELECT seura_nimi FROM nimet
+                    ON CONFLICT (seura_nimi) DO NOTHING
+                    RETURNING seura_id, seura_nimi
+                )
+                SELECT seura_id, seura_nimi FROM uudet
+                UNION ALL
+                SELECT s.seura_id, s.seura_nimi FROM Seurat s JOIN nimet n ON n.seura_nimi = s.seura_nimi''',
+                [(nimi,) for nimi in seura_nimet],
+                lambda rivi: f"seuraa {rivi[0]}")
+            seurat = {seura_nimi: int(seura_id) for seura_id, seura_nimi in palautetut}
+
+            # Urheilijat
+            palautetut = tallenna_erana(c, '''
+                INSERT INTO Urheilijat
+                (etunimi, sukunimi, sukupuoli, syntymavuosi, seura_id)
+                VALUES %s
+                ON CONFLICT (etunimi, sukunimi) DO UPDATE SET
+                sukupuoli = COALESCE(EXCLUDED.sukupuoli, Urheilijat.sukupuoli),
+                syntymavuosi = COALESCE(EXCLUDED.syntymavuosi, Urheilijat.syntymavuosi),
+                seura_id = COALESCE(EXCLUDED.seura_id, Urheilijat.seura_id)
+                RETURNING urheilija_id, etunimi, sukunimi''',
+                [(etunimi, sukunimi, rivi['sukupuoli'], rivi['syntymavuosi'], seurat.get(rivi['seura']))
+                 for (etunimi, sukunimi), rivi in rivit.items()],
+                lambda rivi: f"urheilijaa {rivi[0]} {rivi[1]}")
+            urheilija_idt = {(etunimi, sukunimi): int(urheilija_id) for urheilija_id, etunimi, sukunimi in palautetut}
+
+            # Tulokset: olemassa oleva tulos korvataan (tulos_id säilyy)
+            palautetut = tallenna_erana(c, '''
+                INSERT INTO Tulokset
+                (laji_id, kilpailu_id, urheilija_id, sijoitus, tulos, lisatiedot,
+                 tulos_arvo, tulos_tila)
+                VALUES %s
+                ON CONFLICT (laji_id, kilpailu_id, urheilija_id) DO UPDATE SET
+                sijoitus = EXCLUDED.sijoitus,
+                tulos = EXCLUDED.tulos,
+                lisatiedot = EXCLUDED.lisatiedot,
+                tulos_arvo = EXCLUDED.tulos_arvo,
+                tulos_tila = EXCLUDED.tulos_tila
+                RETURNING urheilija_id''',
+                [(int(event_id), int(competition_id), urheilija_idt[avain], rivi['sijoitus'], rivi['tulos'],
+                  rivi['lisatiedot'], rivi['tulos_arvo'], rivi['tulos_tila'])
+                 for avain, rivi in rivit.items() if avain in urheilija_idt],
+                lambda rivi: f"tulosta urheilijalle {rivi[2]}")
+            tallennetut = {int(rivi[0]) for rivi in palautetut}
+
+            for (etunimi, sukunimi), urheilija_id in urheilija_idt.items():
+                if urheilija_id in tallennetut:
                     athletes_data.append({
                         'id': urheilija_id,
                         'name': f"{etunimi} {sukunimi}",
                         'series': series
                     })
-                    
-                    # Poista savepoint
-                    c.execute("RELEASE SAVEPOINT sp_athlete")
-                    
-                except Exception as e:
-                    # Rollback vain tämän urheilijan muutokset
-                    c.execute("ROLLBACK TO SAVEPOINT sp_athlete")
-                    print(f"Virhe tallennettaessa urheilijaa {etunimi} {sukunimi}: {str(e)}", file=sys.stderr)
-                    continue
+        
+        # Päivitä kilpailun yhteenveto ja kauden parhaat samassa transaktiossa tulosten kanssa
+        update_competition_summary(c, competition_id)
+        update_personal_bests(c, competition_id, event_id, luettelo_id)
+        kasvata_datasukupolvi(c)
         
         conn.commit()
         return athletes_data
@@ -496,11 +699,17 @@ def main():
         conn = get_db_connection()
         print(f"Tietokanta sijaitsee: {DATABASE_URL}", file=sys.stderr)
         
+        # Hae kilpailun kierrokset ja tiedot kerran koko ajolle
+        try:
+            kilpailu = KilpailuKonteksti(args.id)
+        except Exception as e:
+            print(f"Virhe kilpailun kierrosten haussa: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        
         # TALLENNA KILPAILUN TIEDOT AINA
-        save_competition_info(conn, args.id)
+        kilpailu.tallenna(conn)
         
-        # Hae kilpailun tiedot
-        competition_info = fetch_competition_info(args.id)
+        competition_info = kilpailu.info
         print(f"\nHaetaan tulokset kilpailulle: {competition_info['Name']} (ID: {args.id})")
         if competition_info['Location']:
             print(f"Paikkakunta: {competition_info['Location']}")
@@ -512,18 +721,9 @@ def main():
             else:
                 print(f"Päivämäärä: {start_str}")
         
-        # Hae kilpailun kierrokset
-        try:
-            response = requests.get(
-                f"https://cached-public-api.tuloslista.com/live/v1/competition/{args.id}",
-                timeout=10
-            )
-            response.raise_for_status()
-            competition_rounds = json.loads(clean_json_response(response.text))
-            print(f"\nAPI vastaus kilpailulle {args.id}:")
-        except Exception as e:
-            print(f"Virhe kilpailun kierrosten haussa: {str(e)}", file=sys.stderr)
-            sys.exit(1)
+        # Kilpailun kierrokset
+        competition_rounds = kilpailu.kierrokset
+        print(f"\nAPI vastaus kilpailulle {args.id}:")
         
         if not isinstance(competition_rounds, dict):
             print("Virhe: Kilpailun kierrosten data on virheellisessä muodossa", file=sys.stderr)
@@ -552,6 +752,8 @@ def main():
         athletes_data = []
         lajit_käsitelty = 0
         
+        # Viralliset lajit
+        official_events = []
         for date_str, rounds in competition_rounds.items():
             if date_str == "Competition" or not isinstance(rounds, list):
                 continue
@@ -561,27 +763,27 @@ def main():
                     continue
                     
                 event_id = round_data.get('EventId')
-                event_name = round_data.get('EventName', 'Tuntematon laji')
-                
-                if not event_id:
-                    continue
-                
+                if event_id:
+                    official_events.append((event_id, round_data.get('EventName', 'Tuntematon laji')))
+        
+        # Tulokset haetaan rinnakkain ja tallennetaan sitä mukaa kuin ne valmistuvat.
+        # Tietokantaa käytetään vain tästä säikeestä.
+        with ThreadPoolExecutor(max_workers=max(1, HAKU_SAIKEET)) as executor:
+            haut = {executor.submit(fetch_event_results, args.id, event_id): (event_id, event_name)
+                    for event_id, event_name in official_events}
+            
+            for haku in as_completed(haut):
+                event_id, event_name = haut[haku]
                 print(f"Käsitellään lajia: {event_name} (ID: {event_id}, Status: Official)")
-                    
-                # Hae tapahtuman tulokset
+                
                 try:
-                    response = requests.get(
-                        f"https://cached-public-api.tuloslista.com/live/v1/results/{args.id}/{event_id}",
-                        timeout=10
-                    )
-                    response.raise_for_status()
-                    event_results = json.loads(clean_json_response(response.text))
+                    event_results = haku.result()
                     
                     event_name, results = parse_results(event_results, args.seura)
                     
                     if results and len(results) > 0:
                         print(f"  Löytyi {len(results)} tulosta seuralle {args.seura if args.seura else 'kaikki'}")
-                        athletes = save_event_results(conn, args.id, event_id, event_name, results, args.seura)
+                        athletes = save_event_results(conn, args.id, event_id, event_name, results, args.seura, kilpailu)
                         if athletes:
                             athletes_data.extend(athletes)
                             lajit_käsitelty += 1
@@ -605,6 +807,7 @@ def main():
         traceback.print_exc()
         sys.exit(1)
     finally:
+        asiakas.tulosta_tilastot()
         if 'conn' in locals():
             conn.close()
 
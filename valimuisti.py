@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Sivukohtaisia välimuistiaikoja muistetaan enintään näin monelle avaimelle sukupolvea kohden
+MAX_AGE_AVAIMIA = 10000
+
+
+class TuoreusValimuisti:
+    """Prosessin sisäinen välimuisti tietokannan päivitystilalle lyhyellä TTL:llä"""
+
+    def __init__(self, lataaja, ttl):
+        self._lataaja = lataaja
+        self.ttl = ttl
+        self._lukko = threading.Lock()
+        self._arvo = None
+        self._ladattu = None
+
+    def hae(self):
+        """Palauttaa välimuistissa olevan arvon, ladataan uudelleen kun TTL on kulunut"""
+        with self._lukko:
+            if self._ladattu is not None and time.monotonic() - self._ladattu < self.ttl:
+                return self._arvo
+            # Lataus tehdään lukon sisällä, jotta samanaikaiset pyynnöt eivät kaikki kysy kannasta
+            arvo = self._lataaja()
+            self._arvo = arvo
+            self._ladattu = time.monotonic()
+            return arvo
+
+    def mitatoi(self):
+        """Pakottaa seuraavan haun lataamaan arvon tietokannasta"""
+        with self._lukko:
+            self._ladattu = None
+
+
+class SivuValimuisti:
+    """Renderöityjen sivujen LRU-välimuisti, joka tyhjenee datasukupolven vaihtuessa"""
+
+    def __init__(self, max_tavut):
+        self.max_tavut = max_tavut
+        self._lukko = threading.Lock()
+        self._sivut = OrderedDict()  # avain -> (runko, mimetype, max_age, {koodaus: pakattu runko})
+        self._max_aget = OrderedDict()  # avain -> max_age, säilyy vaikka sivu poistettaisiin
+        self._sukupolvi = None
+        self._tavut = 0
+        self._tilastot = {'osumia': 0, 'ohituksia': 0, 'poistettuja': 0, 'tyhjennyksia': 0, 'pakkauksia': 0}
+
+    @staticmethod
+    def _koko(sivu):
+        return len(sivu[0]) + sum(len(pakattu) for pakattu in sivu[3].values())
+
+    def _karsi(self):
+        while self._tavut > self.max_tavut:
+            _, poistettu = self._sivut.popitem(last=False)
+            self._tavut -= self._koko(poistettu)
+            self._tilastot['poistettuja'] += 1
+
+    def _tarkista_sukupolvi(self, sukupolvi):
+        """Vanhemman datasukupolven sivut eivät enää ole voimassa
+
+        Palauttaa False, jos pyynnön sukupolvi on välimuistia vanhempi (esim. pyyntö
+        on lukenut sukupolven ennen päivitystä). Tällöin välimuistia ei tyhjennetä,
+        ettei uuden sukupolven sivuja hylätä vanhan vuoksi.
+        """
+        if self._sukupolvi is not None:
+            if sukupolvi < self._sukupolvi:
+                return False
+            if sukupolvi == self._sukupolvi:
+                return True
+        if self._sivut:
+            self._tilastot['tyhjennyksia'] += 1
+        self._sivut.clear()
+        self._max_aget.clear()
+        self._tavut = 0
+        self._sukupolvi = sukupolvi
+        return True
+
+    def hae(self, avain, sukupolvi):
+        """Palauttaa (runko, mimetype, max_age) tai None, jos sivua ei ole tälle sukupolvelle"""
+        with self._lukko:
+            sivu = self._sivut.get(avain) if self._tarkista_sukupolvi(sukupolvi) else None
+            if sivu is None:
+                self._tilastot['ohituksia'] += 1
+                return None
+            self._sivut.move_to_end(avain)
+            self._tilastot['osumia'] += 1
+            return sivu[:3]
+
+    def tallenna(self, avain, sukupolvi, runko, mimetype, max_age):
+        """Tallentaa sivun, vanhimmat käyttämättömät poistetaan muistirajan ylittyessä"""
+        koko = len(runko)
+        if koko > self.max_tavut:
+            return
+        with self._lukko:
+            if not self._tarkista_sukupolvi(sukupolvi):
+                return
+            vanha = self._sivut.pop(avain, None)
+            if vanha is not None:
+                self._tavut -= self._koko(vanha)
+            self._sivut[avain] = (runko, mimetype, max_age, {})
+            self._tavut += koko
+            self._karsi()
+            self._max_aget[avain] = max_age
+            self._max_aget.move_to_end(avain)
+            if len(self._max_aget) > MAX_AGE_AVAIMIA:
+                self._max_aget.popitem(last=False)
+
+    def hae_max_age(self, avain, sukupolvi):
+        """Palauttaa sivulle tallennetun välimuistiajan (304-vastauksiin) tai None
+
+        Ei kirjaa osumaa eikä siirrä sivua LRU-järjestyksessä.
+        """
+        with self._lukko:
+            if sukupolvi != self._sukupolvi:
+                return None
+            return self._max_aget.get(avain)
+
+    def hae_pakattu(self, avain, sukupolvi, koodaus):
+        """Palauttaa sivun rungon valmiiksi pakattuna annetulla koodauksella tai None"""
+        with self._lukko:
+            # Muu kuin nykyinen sukupolvi on aina ohitus
+            if sukupolvi != self._sukupolvi:
+                return None
+            sivu = self._sivut.get(avain)
+            return sivu[3].get(koodaus) if sivu is not None else None
+
+    def tallenna_pakattu(self, avain, sukupolvi, koodaus, pakattu):
+        """Tallentaa sivun pakatun rungon, jottei osumia tarvitse pakata uudelleen"""
+        with self._lukko:
+            if sukupolvi != self._sukupolvi:
+                return
+            sivu = self._sivut.get(avain)
+            if sivu is None or koodaus in sivu[3]:
+                return
+            sivu[3][koodaus] = pakattu
+            self._tavut += len(pakattu)
+            self._tilastot['pakkauksia'] += 1
+            self._karsi()
+
+    def tilastot(self):
+        """Palauttaa osuma- ja muistinkäyttötilastot"""
+        with self._lukko:
+            tilastot = dict(self._tilastot)
+            tilastot['sivuja'] = len(self._sivut)
+            tilastot['tavuja'] = self._tavut
+            tilastot['sukupolvi'] = self._sukupolvi
+        tilastot['max_tavut'] = self.max_tavut
+        return tilastot
+
+
+class DimensioValimuisti:
+    """Harvoin muuttuvat luettelot (vuodet, lajit), ladataan tarvittaessa datasukupolvea kohden"""
+
+    def __init__(self, lataajat):
+        self._lataajat = lataajat  # nimi -> funktio, joka palauttaa luettelon
+        self._lukko = threading.Lock()
+        self._arvot = {}  # nimi -> (sukupolvi, arvo)
+        self._tilastot = {'osumia': 0, 'latauksia': 0}
+
+    def hae(self, nimi, sukupolvi):
+        """Palauttaa luettelon; ladataan uudelleen vain, jos datasukupolvi on vaihtunut"""
+        with self._lukko:
+            tallennettu = self._arvot.get(nimi)
+            if tallennettu is not None and sukupolvi is not None and tallennettu[0] == sukupolvi:
+                self._tilastot['osumia'] += 1
+                return tallennettu[1]
+            # Kuten tuoreusvälimuistissa, samanaikaiset pyynnöt odottavat yhtä latausta
+            arvo = self._lataajat[nimi]()
+            self._arvot[nimi] = (sukupolvi, arvo)
+            self._tilastot['latauksia'] += 1
+            return arvo
+
+    def tilastot(self):
+        """Palauttaa osumat, lataukset ja ladattujen luetteloiden sukupolvet"""
+        with self._lukko:
+            tilastot = dict(self._tilastot)
+            tilastot['luettelot'] = {nimi: arvo[0] for nimi, arvo in self._arvot.items()}
+        return tilastot
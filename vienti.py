@@ -0,0 +1,141 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+import psycopg2
+
+from kyselyt import hae_laji
+
+# Asetukset
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+# Kuinka monta riviä palvelinpuolen kursorista luetaan ja kirjoitetaan kerralla
+VIENTI_ITERSIZE = int(os.environ.get('VIENTI_ITERSIZE', 2000))
+
+VIENTIMUODOT = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+VIENTI_KENTAT = ['tulos_id', 'kilpailu_id', 'kilpailun_nimi', 'paikkakunta', 'alkupvm',
+                 'laji_id', 'lajin_nimi', 'sarja', 'luettelo_id', 'urheilija_id', 'etunimi',
+                 'sukunimi', 'syntymavuosi', 'sukupuoli', 'seura', 'sijoitus', 'tulos',
+                 'tulos_arvo', 'tulos_tila', 'tuuli', 'reaktioaika', 'lisatiedot']
+
+def get_db_connection():
+    return psycopg2.connect(DATABASE_URL)
+
+def json_arvo(arvo):
+    """JSON-muunnos kannan tyypeille"""
+    if isinstance(arvo, (date, datetime)):
+        return arvo.isoformat()
+    if isinstance(arvo, Decimal):
+        return float(arvo)
+    return str(arvo)
+
+def vientikursori(conn, vuosi=None, seura=None, luettelo_id=None, itersize=VIENTI_ITERSIZE):
+    """Avaa tulosten vientikyselyn palvelinpuolen kursorilla
+
+    Rivit luetaan vasta iteroitaessa itersize rivin erissä, joten muistinkäyttö
+    ei riipu viennin koosta. Kursori on suljettava käytön jälkeen.
+    """
+    sql = """
+        SELECT t.tulos_id, k.kilpailu_id, k.kilpailun_nimi, k.paikkakunta, k.alkupvm,
+               l.laji_id, l.lajin_nimi, l.sarja, l.luettelo_id,
+               u.urheilija_id, u.etunimi, u.sukunimi, u.syntymavuosi, u.sukupuoli,
+               s.seura_nimi AS seura, t.sijoitus,
+               COALESCE(CAST(t.tulos AS TEXT), t.lisatiedot) AS tulos,
+               t.tulos_arvo, t.tulos_tila, t.tuuli, t.reaktioaika, t.lisatiedot
+        FROM Tulokset t
+        JOIN Lajit l ON t.laji_id = l.laji_id AND t.kilpailu_id = l.kilpailu_id
+        JOIN Kilpailut k ON t.kilpailu_id = k.kilpailu_id
+        JOIN Urheilijat u ON t.urheilija_id = u.urheilija_id
+        LEFT JOIN Seurat s ON u.seura_id = s.seura_id
+        WHERE TRUE
+    """
+    params = []
+
+    if vuosi is not None:
+        # Päivämääräväli käyttää alkupvm-indeksiä toisin kuin EXTRACT(YEAR ...)
+        sql += " AND k.alkupvm >= %s AND k.alkupvm < %s"
+        params.extend([date(vuosi, 1, 1), date(vuosi + 1, 1, 1)])
+
+    if seura:
+        sql += " AND LOWER(s.seura_nimi) = LOWER(%s)"
+        params.append(seura)
+
+    if luettelo_id is not None:
+        sql += " AND l.luettelo_id = %s"
+        params.append(luettelo_id)
+
+    sql += " ORDER BY t.tulos_id"
+
+    c = conn.cursor(name=f"vienti_{uuid.uuid4().hex}")
+    c.itersize = itersize
+    c.execute(sql, params)
+    return c
+
+def vientiosat(c, muoto):
+    """Muuntaa kursorin rivit CSV- tai NDJSON-paloiksi, yksi pala kursorin erää kohden"""
+    puskuri = io.StringIO()
+    kirjoittaja = csv.writer(puskuri) if muoto == 'csv' else None
+    if kirjoittaja:
+        kirjoittaja.writerow(VIENTI_KENTAT)
+
+    try:
+        for i, rivi in enumerate(c, 1):
+            if kirjoittaja:
+                kirjoittaja.writerow(['' if arvo is None else arvo for arvo in rivi])
+            else:
+                puskuri.write(json.dumps(dict(zip(VIENTI_KENTAT, rivi)), default=json_arvo, ensure_ascii=False))
+                puskuri.write('\n')
+
+            if i % c.itersize == 0:
+                yield puskuri.getvalue()
+                puskuri.seek(0)
+                puskuri.truncate()
+    finally:
+        c.close()
+
+    if puskuri.tell():
+        yield puskuri.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description='Vie tulokset CSV- tai NDJSON-tiedostoon')
+    parser.add_argument('--muoto', choices=sorted(VIENTIMUODOT), default='csv', help='Tiedostomuoto')
+    parser.add_argument('--vuosi', type=int, help='Vain tämän vuoden kilpailut')
+    parser.add_argument('--seura', help='Vain tämän seuran urheilijat')
+    parser.add_argument('--laji', help='Vain tämä laji (lajiluettelon nimi)')
+    parser.add_argument('--era', type=int, default=VIENTI_ITERSIZE, help='Kerralla luettavien rivien määrä')
+    parser.add_argument('-o', '--tiedosto', help='Kohdetiedosto (oletus: vakiotuloste)')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        luettelo_id = None
+        if args.laji:
+            laji = hae_laji(conn.cursor(), nimi=args.laji)
+            if not laji:
+                print(f"Lajia ei löytynyt: {args.laji}", file=sys.stderr)
+                sys.exit(1)
+            luettelo_id = laji[0]
+
+        c = vientikursori(conn, args.vuosi, args.seura, luettelo_id, args.era)
+        tiedosto = open(args.tiedosto, 'w', encoding='utf-8', newline='') if args.tiedosto else sys.stdout
+        try:
+            for osa in vientiosat(c, args.muoto):
+                tiedosto.write(osa)
+        finally:
+            if args.tiedosto:
+                tiedosto.close()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()